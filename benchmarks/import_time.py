@@ -0,0 +1,26 @@
+import statistics
+import subprocess
+import sys
+
+# compares importing fastastra with importing it plus the embedding provider stack it used to load eagerly
+RUNS = 5
+CASES = {
+    "fastastra.fastastra": "import fastastra.fastastra",
+    "fastastra.fastastra + openai + agentd.patch": "import fastastra.fastastra, openai, agentd.patch",
+}
+
+
+def time_import(statement):
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    for name, statement in CASES.items():
+        timings = [time_import(statement) for _ in range(RUNS)]
+        print(f"{name}: median {statistics.median(timings) * 1000:.0f} ms, min {min(timings) * 1000:.0f} ms over {RUNS} runs")
+
+
+if __name__ == "__main__":
+    main()
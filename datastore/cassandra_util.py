@@ -41,12 +41,12 @@ class DDLModel(BaseModel):
     partition_key: List[str] = Field(..., description="List of partition key column names, *NOTE ORDER MATTERS*")
     clustering_columns: List[str] = Field(..., description="List of clustering column column names, *NOTE ORDER MATTERS*")
 
-    def to_string(self, keyspace_name: str = None, table_name: str = None):
+    def to_string(self, keyspace_name: str = None, table_name: str = None, if_not_exists: bool = False):
         if keyspace_name is not None:
             self.keyspace_name = keyspace_name
         if table_name is not None:
             self.table_name = table_name
-        ddl_statement = f"CREATE TABLE {self.keyspace_name}.{self.table_name} (\n" + \
+        ddl_statement = f"CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{self.keyspace_name}.{self.table_name} (\n" + \
                         ",\n".join([f"    {column.name} {column.type}" for column in self.columns]) + \
                         ",\n    PRIMARY KEY ((" + \
                         ", ".join(self.partition_key) + ")"
@@ -0,0 +1,245 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Sequence
+
+from cassandra import OperationTimedOut, ReadTimeout, WriteTimeout
+from cassandra.cluster import NoHostAvailable
+from cassandra.protocol import OverloadedErrorMessage
+from loguru import logger
+
+# overloaded requests are resubmitted this many times, after a backoff, by run_limited
+DEFAULT_OVERLOAD_RETRIES = 5
+OVERLOAD_BACKOFF = 0.1
+
+
+CONGESTION_ERRORS = (OverloadedErrorMessage, OperationTimedOut, ReadTimeout, WriteTimeout)
+
+
+def _host_errors(error: Exception) -> List[Exception]:
+    # NoHostAvailable wraps what every tried host answered
+    if isinstance(error, NoHostAvailable) and error.errors:
+        return list(error.errors.values())
+    return [error]
+
+
+def is_overloaded(error: Exception) -> bool:
+    # coordinator rejected the request (overload or rate limit), it was not executed so it is safe to resubmit
+    return all(isinstance(host_error, OverloadedErrorMessage) for host_error in _host_errors(error))
+
+
+def is_congested(error: Exception) -> bool:
+    # errors that mean the cluster is behind and fewer requests should be in flight
+    return all(isinstance(host_error, CONGESTION_ERRORS) for host_error in _host_errors(error))
+
+
+class AdaptiveLimiter:
+    # AIMD limit on requests in flight, shared by every concurrent operation on a cluster. The limit grows by about
+    # one per round trip while it is being used and latencies are stable, and is multiplied by backoff on overload,
+    # rate limit and timeout errors or when recent latency rises above latency_tolerance times the baseline
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = None, backoff: float = 0.5,
+                 latency_tolerance: float = 2.0, min_samples: int = 20):
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_samples = min_samples
+        self._limit = float(max(min_limit, min(initial, self.max_limit)))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        # (loop, future) of coroutines waiting in acquire_async, woken on every release
+        self._async_waiters = []
+        self._samples = 0
+        self._recent = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self.overloads = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "max_limit": self.max_limit,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+            "latency": self._recent,
+            "baseline_latency": self._baseline,
+        }
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    async def acquire_async(self):
+        # waits without blocking the event loop, a cancelled waiter holds nothing
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, latency: float = None, error: Exception = None):
+        with self._condition:
+            self._in_flight -= 1
+            if error is not None:
+                if is_overloaded(error):
+                    self.overloads += 1
+                if is_congested(error):
+                    self._decrease()
+            elif latency is not None:
+                self._on_latency(latency)
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    @contextmanager
+    def request(self):
+        # one blocking request, e.g. a page of a scan
+        self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.release(error=e)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.release(time.perf_counter() - start)
+
+    def _on_latency(self, latency):
+        self._samples += 1
+        if self._recent is None:
+            self._recent = self._baseline = latency
+        self._recent += 0.2 * (latency - self._recent)
+        # the baseline follows improvements quickly and degradations slowly, so queueing shows up as a gap
+        self._baseline += (0.1 if latency < self._baseline else 0.01) * (latency - self._baseline)
+        if self._samples >= self.min_samples and self._recent > self.latency_tolerance * self._baseline:
+            self._decrease()
+        elif self._in_flight + 1 >= self._limit / 2:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def _decrease(self):
+        # at most once per round trip, the requests already in flight were sent at the old limit
+        now = time.monotonic()
+        if now - self._last_decrease < (self._recent or 0.0):
+            return
+        self._last_decrease = now
+        limit = max(self.min_limit, self._limit * self.backoff)
+        if int(limit) != int(self._limit):
+            self.decreases += 1
+            logger.debug(f"concurrency limit {int(self._limit)} -> {int(limit)}")
+        self._limit = limit
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def call_limited(limiter: AdaptiveLimiter, fn: Callable[[], Any], retries: int = DEFAULT_OVERLOAD_RETRIES) -> Any:
+    # one blocking request, e.g. a point read or a page of a scan, resubmitted after an exponential backoff while
+    # it is overloaded
+    for attempt in range(retries + 1):
+        try:
+            with limiter.request():
+                return fn()
+        except Exception as e:
+            if attempt == retries or not is_overloaded(e):
+                raise
+            time.sleep(OVERLOAD_BACKOFF * 2 ** attempt)
+
+
+async def call_limited_async(limiter: AdaptiveLimiter, fn: Callable[[], Any], retries: int = DEFAULT_OVERLOAD_RETRIES) -> Any:
+    # call_limited for coroutines
+    for attempt in range(retries + 1):
+        await limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            limiter.release(error=e)
+            if attempt == retries or not is_overloaded(e):
+                raise
+            await asyncio.sleep(OVERLOAD_BACKOFF * 2 ** attempt)
+            continue
+        except BaseException:
+            limiter.release()
+            raise
+        limiter.release(time.perf_counter() - start)
+        return result
+
+
+def run_limited(limiter: AdaptiveLimiter, submit: Callable[[Any], Any], items: Sequence[Any], max_in_flight: int,
+                retries: int = DEFAULT_OVERLOAD_RETRIES) -> List[Any]:
+    # submit(item) returns a driver ResponseFuture. Items are sent while both the limiter and max_in_flight allow,
+    # results come back in item order and the first error is raised. Overloaded requests are resubmitted after
+    # an exponential backoff, other errors stop further submissions
+    results = [None] * len(items)
+    pending = list(range(len(items)))
+    for attempt in range(retries + 1):
+        futures = _submit_all(limiter, submit, items, pending, max_in_flight)
+        overloaded = []
+        for index, future in futures:
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                if attempt < retries and is_overloaded(e):
+                    overloaded.append(index)
+                else:
+                    raise e
+        if not overloaded:
+            return results
+        logger.info(f"{len(overloaded)} requests overloaded, retrying at a limit of {limiter.limit}")
+        time.sleep(OVERLOAD_BACKOFF * 2 ** attempt)
+        pending = overloaded
+    return results
+
+
+def _submit_all(limiter, submit, items, indexes, max_in_flight):
+    slots = threading.BoundedSemaphore(max_in_flight)
+    failed = threading.Event()
+    futures = []
+
+    def finished(_, start):
+        slots.release()
+        limiter.release(time.perf_counter() - start)
+
+    def errored(error, start):
+        slots.release()
+        limiter.release(error=error)
+        if not is_overloaded(error):
+            failed.set()
+
+    for index in indexes:
+        if failed.is_set():
+            break
+        slots.acquire()
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            future = submit(items[index])
+        except Exception:
+            slots.release()
+            limiter.release()
+            raise
+        future.add_callbacks(finished, errored, callback_args=(start,), errback_args=(start,))
+        futures.append((index, future))
+    return futures
@@ -0,0 +1,130 @@
+from typing import Optional, Union
+
+from cassandra.policies import DCAwareRoundRobinPolicy, RoundRobinPolicy, TokenAwarePolicy
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from datastore.concurrency import AdaptiveLimiter
+
+DEFAULT_CONCURRENCY = 100
+REACTORS = ("libev", "asyncio", "asyncore", "gevent", "eventlet", "twisted")
+LOAD_BALANCING_POLICIES = ("token_aware", "dc_aware", "round_robin")
+
+
+class ConnectionOptions(BaseModel):
+    compression: Union[bool, str] = Field(True, description="lz4, snappy, True to pick whatever is installed or False")
+    reactor: str = Field("libev", description=f"Event loop used by the driver, one of {REACTORS}. Falls back to asyncio when unavailable")
+    load_balancing: str = Field("token_aware", description=f"One of {LOAD_BALANCING_POLICIES}")
+    local_dc: Optional[str] = Field(None, description="Local datacenter for dc aware load balancing")
+    request_concurrency: int = Field(DEFAULT_CONCURRENCY, description="Requests in flight for fastastra's concurrent operations")
+    adaptive_concurrency: bool = Field(True, description="Shrink concurrency on overload, rate limit and timeout errors or rising latency and grow it back when healthy")
+    max_request_concurrency: Optional[int] = Field(None, description="Highest limit adaptive concurrency grows to, 4 x request_concurrency when not set")
+    connections_per_host: Optional[int] = Field(None, description="Core and max connections per host, protocol v1 / v2 only")
+    max_requests_per_connection: Optional[int] = Field(None, description="Requests per connection before opening another, protocol v1 / v2 only")
+    protocol_version: Optional[int] = Field(None, description="Native protocol version, negotiated when not set")
+    connect_timeout: float = 10.0
+    idle_heartbeat_interval: float = 30.0
+    executor_threads: int = 2
+
+    @classmethod
+    def low_latency(cls, **kwargs):
+        # small interactive requests: no compression overhead, token aware routing, modest concurrency
+        return cls(**{"compression": False, "request_concurrency": 32, "connect_timeout": 5.0, "idle_heartbeat_interval": 10.0, **kwargs})
+
+    @classmethod
+    def bulk_throughput(cls, **kwargs):
+        # large vector payloads and many requests in flight: lz4 and more driver threads
+        return cls(**{"compression": "lz4", "request_concurrency": 256, "executor_threads": 4, **kwargs})
+
+    def validate_options(self):
+        # everything the Cluster constructor would reject is reported here, before connecting
+        from cassandra import ProtocolVersion
+        from cassandra.connection import locally_supported_compressions
+        if isinstance(self.compression, str):
+            if self.compression not in ("lz4", "snappy"):
+                raise ValueError(f"Unsupported compression {self.compression}, expected lz4, snappy, True or False")
+            if self.compression not in locally_supported_compressions:
+                raise ValueError(f"{self.compression} compression requires the {self.compression} package, install it with `pip install {'lz4' if self.compression == 'lz4' else 'python-snappy'}`")
+        if self.reactor not in REACTORS:
+            raise ValueError(f"Unsupported reactor {self.reactor}, expected one of {REACTORS}")
+        if self.load_balancing not in LOAD_BALANCING_POLICIES:
+            raise ValueError(f"Unsupported load balancing policy {self.load_balancing}, expected one of {LOAD_BALANCING_POLICIES}")
+        if self.request_concurrency < 1:
+            raise ValueError("request_concurrency must be at least 1")
+        if self.max_request_concurrency is not None and self.max_request_concurrency < self.request_concurrency:
+            raise ValueError("max_request_concurrency must be at least request_concurrency")
+        if self.local_dc is not None and self.load_balancing == "round_robin":
+            raise ValueError("local_dc only applies to the dc_aware and token_aware load balancing policies")
+        if self.connections_per_host is not None and self.connections_per_host < 1:
+            raise ValueError("connections_per_host must be at least 1")
+        if self.max_requests_per_connection is not None and self.max_requests_per_connection < 1:
+            raise ValueError("max_requests_per_connection must be at least 1")
+        if self.protocol_version is not None and self.protocol_version not in ProtocolVersion.SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported protocol_version {self.protocol_version}, expected one of {sorted(ProtocolVersion.SUPPORTED_VERSIONS)}")
+        if self.connect_timeout <= 0:
+            raise ValueError("connect_timeout must be greater than 0")
+        if self.idle_heartbeat_interval < 0:
+            raise ValueError("idle_heartbeat_interval must be at least 0, 0 disables heartbeats")
+        if self.executor_threads < 1:
+            raise ValueError("executor_threads must be at least 1")
+        if (self.connections_per_host or self.max_requests_per_connection) and (self.protocol_version is None or self.protocol_version > 2):
+            logger.warning("connections_per_host and max_requests_per_connection only apply to protocol v1 / v2, newer protocols multiplex requests over one connection per host")
+        return self
+
+    def connection_class(self):
+        # libev is a C extension that may not be built, fall back to the pure python asyncio reactor
+        try:
+            if self.reactor == "libev":
+                from cassandra.io.libevreactor import LibevConnection
+                return LibevConnection
+            if self.reactor == "asyncore":
+                from cassandra.io.asyncorereactor import AsyncoreConnection
+                return AsyncoreConnection
+            if self.reactor == "gevent":
+                from cassandra.io.geventreactor import GeventConnection
+                return GeventConnection
+            if self.reactor == "eventlet":
+                from cassandra.io.eventletreactor import EventletConnection
+                return EventletConnection
+            if self.reactor == "twisted":
+                from cassandra.io.twistedreactor import TwistedConnection
+                return TwistedConnection
+        except Exception as e:
+            logger.warning(f"{self.reactor} reactor is not available ({e}), falling back to asyncio")
+        from cassandra.io.asyncioreactor import AsyncioConnection
+        return AsyncioConnection
+
+    def load_balancing_policy(self):
+        # a new instance per execution profile
+        if self.load_balancing == "round_robin":
+            return RoundRobinPolicy()
+        dc_aware = DCAwareRoundRobinPolicy(local_dc=self.local_dc) if self.local_dc else DCAwareRoundRobinPolicy()
+        if self.load_balancing == "dc_aware":
+            return dc_aware
+        return TokenAwarePolicy(dc_aware)
+
+    def cluster_kwargs(self):
+        kwargs = {
+            "compression": self.compression,
+            "connect_timeout": self.connect_timeout,
+            "idle_heartbeat_interval": self.idle_heartbeat_interval,
+            "executor_threads": self.executor_threads,
+        }
+        if self.protocol_version is not None:
+            kwargs["protocol_version"] = self.protocol_version
+        return kwargs
+
+    def concurrency_limiter(self) -> AdaptiveLimiter:
+        if not self.adaptive_concurrency:
+            return AdaptiveLimiter(self.request_concurrency, min_limit=self.request_concurrency)
+        return AdaptiveLimiter(self.request_concurrency, max_limit=self.max_request_concurrency or self.request_concurrency * 4)
+
+    def apply_pool_settings(self, cluster):
+        from cassandra.policies import HostDistance
+        if cluster.protocol_version > 2:
+            return
+        if self.connections_per_host:
+            cluster.set_max_connections_per_host(HostDistance.LOCAL, self.connections_per_host)
+            cluster.set_core_connections_per_host(HostDistance.LOCAL, self.connections_per_host)
+        if self.max_requests_per_connection:
+            cluster.set_max_requests_per_connection(HostDistance.LOCAL, self.max_requests_per_connection)
@@ -0,0 +1,129 @@
+import threading
+from collections import deque
+from typing import Dict
+
+from cassandra.cluster import ExecutionProfile
+from cassandra.policies import RetryPolicy, SpeculativeExecutionPolicy, ConstantSpeculativeExecutionPolicy, NoSpeculativeExecutionPolicy
+from cassandra.protocol import OverloadedErrorMessage
+from cassandra.query import dict_factory
+from pydantic import BaseModel, Field
+
+POINT_READ = "point_read"
+INDEX_READ = "index_read"
+ANN = "ann"
+SCAN = "scan"
+WRITE = "write"
+OPERATIONS = (POINT_READ, INDEX_READ, ANN, SCAN, WRITE)
+
+
+class LatencyPolicy(BaseModel):
+    timeout: float = Field(..., description="Client side request timeout in seconds")
+    idempotent: bool = Field(False, description="Idempotent statements may be retried and speculatively executed")
+    speculative: bool = Field(False, description="Send the request to another replica when it is slower than the percentile delay")
+    speculative_percentile: float = Field(99.0, description="Percentile of recent latencies used as the speculative delay")
+    speculative_max_attempts: int = Field(1, description="Maximum number of speculative executions per request")
+    max_retries: int = Field(1, description="Retries on read timeouts and request errors")
+
+
+DEFAULT_LATENCY_POLICIES: Dict[str, LatencyPolicy] = {
+    POINT_READ: LatencyPolicy(timeout=2.0, idempotent=True, speculative=True),
+    INDEX_READ: LatencyPolicy(timeout=5.0, idempotent=True, speculative=True),
+    ANN: LatencyPolicy(timeout=5.0, idempotent=True, speculative=True),
+    SCAN: LatencyPolicy(timeout=30.0, idempotent=True),
+    WRITE: LatencyPolicy(timeout=5.0, idempotent=False),
+}
+
+
+class OperationRetryPolicy(RetryPolicy):
+    # overloads are rethrown so the adaptive limiter sees them, backs off and resubmits: the driver default retries
+    # them on the next host straight away. Timeouts, unavailable replicas and request errors are retried up to
+    # max_retries, write timeouts only for idempotent statements
+    def __init__(self, max_retries: int = 1):
+        self.max_retries = max_retries
+
+    def on_read_timeout(self, query, consistency, required_responses, received_responses, data_retrieved, retry_num):
+        if retry_num < self.max_retries:
+            return self.RETRY, consistency
+        return self.RETHROW, None
+
+    def on_write_timeout(self, query, consistency, write_type, required_responses, received_responses, retry_num):
+        if retry_num < self.max_retries and query is not None and query.is_idempotent:
+            return self.RETRY, consistency
+        return self.RETHROW, None
+
+    def on_unavailable(self, query, consistency, required_replicas, alive_replicas, retry_num):
+        if retry_num < self.max_retries:
+            return self.RETRY_NEXT_HOST, None
+        return self.RETHROW, None
+
+    def on_request_error(self, query, consistency, error, retry_num):
+        if isinstance(error, OverloadedErrorMessage):
+            return self.RETHROW, None
+        if retry_num < self.max_retries:
+            return self.RETRY_NEXT_HOST, None
+        return self.RETHROW, None
+
+
+class PercentileSpeculativeExecutionPolicy(SpeculativeExecutionPolicy):
+    # speculates after the given percentile of recently observed latencies instead of a fixed delay. The percentile
+    # is recomputed every refresh_every samples so building a plan stays cheap on sub-millisecond reads
+    def __init__(self, percentile=99.0, max_attempts=1, window=1000, min_samples=50, initial_delay=0.1, min_delay=0.005,
+                 refresh_every=50):
+        self.percentile = percentile
+        self.max_attempts = max_attempts
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.refresh_every = refresh_every
+        self._latencies = deque(maxlen=window)
+        self._since_refresh = 0
+        self._delay = initial_delay
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._since_refresh += 1
+            if len(self._latencies) < self.min_samples or self._since_refresh < self.refresh_every:
+                return
+            self._since_refresh = 0
+            latencies = list(self._latencies)
+        latencies.sort()
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        self._delay = max(self.min_delay, latencies[index])
+
+    def delay(self):
+        return self._delay
+
+    def new_plan(self, keyspace, statement):
+        return ConstantSpeculativeExecutionPolicy.ConstantSpeculativeExecutionPlan(self.delay(), self.max_attempts)
+
+
+def resolve_latency_policies(overrides: Dict[str, LatencyPolicy] = None) -> Dict[str, LatencyPolicy]:
+    policies = dict(DEFAULT_LATENCY_POLICIES)
+    for operation, policy in (overrides or {}).items():
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}, expected one of {OPERATIONS}")
+        policies[operation] = policy
+    return policies
+
+
+def make_execution_profiles(policies: Dict[str, LatencyPolicy], load_balancing_policy_factory=None):
+    # one dict-row execution profile per operation, returned with the speculative policies that need latency samples.
+    # Every profile retries with the operation's max_retries and leaves overloads to the adaptive limiter
+    profiles = {}
+    speculative_policies = {}
+    for operation, policy in policies.items():
+        if policy.speculative:
+            speculative_policy = PercentileSpeculativeExecutionPolicy(policy.speculative_percentile, policy.speculative_max_attempts)
+            speculative_policies[operation] = speculative_policy
+        else:
+            speculative_policy = NoSpeculativeExecutionPolicy()
+        profiles[operation] = ExecutionProfile(
+            row_factory=dict_factory,
+            request_timeout=policy.timeout,
+            retry_policy=OperationRetryPolicy(policy.max_retries),
+            speculative_execution_policy=speculative_policy,
+            **({"load_balancing_policy": load_balancing_policy_factory()} if load_balancing_policy_factory else {})
+        )
+    return profiles, speculative_policies
@@ -0,0 +1,85 @@
+import copy
+from collections.abc import Sequence
+from typing import Dict, List
+
+import numpy as np
+from cassandra.cqltypes import FloatType, VectorType
+
+# vector<float, n> values are n big endian float32s on the wire
+WIRE_DTYPE = np.dtype(">f4")
+
+
+class LazyVector(Sequence):
+    # a vector<float, n> column value kept as its wire bytes, decoded on first use. numpy() is a zero copy view,
+    # indexing, iterating or tolist() decode once into python floats
+    __slots__ = ("raw", "_values")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._values = None
+
+    def numpy(self) -> np.ndarray:
+        return np.frombuffer(self.raw, dtype=WIRE_DTYPE)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.numpy().astype(dtype or np.float32)
+
+    def tolist(self) -> List[float]:
+        if self._values is None:
+            self._values = self.numpy().tolist()
+        return self._values
+
+    def __len__(self):
+        return len(self.raw) // WIRE_DTYPE.itemsize
+
+    def __getitem__(self, index):
+        return self.tolist()[index]
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyVector):
+            return self.raw == other.raw
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"LazyVector({len(self)})"
+
+
+_lazy_types: Dict[type, type] = {}
+
+
+def _deserialize(cls, byts, protocol_version):
+    expected_byte_size = WIRE_DTYPE.itemsize * cls.vector_size
+    if len(byts) != expected_byte_size:
+        raise ValueError(f"Expected vector of dimension {cls.vector_size} to have serialized size {expected_byte_size}; observed serialized size of {len(byts)} instead")
+    return LazyVector(byts)
+
+
+def lazy_vector_type(cqltype):
+    # float vector types deserialize to LazyVector, every other type is returned as is
+    if not (isinstance(cqltype, type) and issubclass(cqltype, VectorType) and cqltype.subtype is FloatType):
+        return cqltype
+    lazy_type = _lazy_types.get(cqltype)
+    if lazy_type is None:
+        lazy_type = type(cqltype.__name__, (cqltype,), {"deserialize": classmethod(_deserialize)})
+        _lazy_types[cqltype] = lazy_type
+    return lazy_type
+
+
+def lazy_vector_statement(statement):
+    # a copy of the prepared statement whose result metadata decodes float vectors lazily. Prepared statements
+    # are executed without result metadata on the wire, so rows are parsed with these types
+    if not statement.result_metadata:
+        return statement
+    result_metadata = [(keyspace, table, name, lazy_vector_type(cqltype)) for keyspace, table, name, cqltype in statement.result_metadata]
+    if all(lazy[3] is column[3] for lazy, column in zip(result_metadata, statement.result_metadata)):
+        return statement
+    lazy_statement = copy.copy(statement)
+    lazy_statement.result_metadata = result_metadata
+    return lazy_statement
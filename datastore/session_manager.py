@@ -0,0 +1,72 @@
+import atexit
+import os
+import threading
+from typing import Callable, Dict, Hashable
+
+from loguru import logger
+
+
+class SharedSession:
+    def __init__(self, cluster, session, speculative_policies=None, limiter=None):
+        self.cluster = cluster
+        self.session = session
+        # built with the cluster's execution profiles, so every client sharing it records latencies in the same place
+        self.speculative_policies = speculative_policies or {}
+        # in flight limit of every concurrent operation on this cluster
+        self.limiter = limiter
+        self.refs = 0
+
+
+class SessionManager:
+    # one Cluster and Session per key inside a process. Driver sockets and event loop threads do not survive
+    # fork, so children start with an empty registry and reconnect lazily instead of using the parent's
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[Hashable, SharedSession] = {}
+        self.pid = os.getpid()
+
+    def acquire(self, key: Hashable, connect: Callable[[], SharedSession]) -> SharedSession:
+        with self._lock:
+            shared = self._sessions.get(key)
+            if shared is None:
+                shared = connect()
+                self._sessions[key] = shared
+            shared.refs += 1
+            return shared
+
+    def release(self, key: Hashable, pid: int):
+        # clients acquired in a parent process must not shut down anything from a child
+        if pid != self.pid:
+            return
+        with self._lock:
+            shared = self._sessions.get(key)
+            if shared is None:
+                return
+            shared.refs -= 1
+            if shared.refs > 0:
+                return
+            del self._sessions[key]
+        self._shutdown(shared)
+
+    def shutdown(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for shared in sessions:
+            self._shutdown(shared)
+
+    def _shutdown(self, shared: SharedSession):
+        try:
+            shared.cluster.shutdown()
+        except Exception as e:
+            logger.warning(f"Exception shutting down cluster: {e}")
+
+    def _after_fork_in_child(self):
+        # the inherited clusters belong to the parent, drop them without shutting them down
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.pid = os.getpid()
+
+
+session_manager = SessionManager()
+os.register_at_fork(after_in_child=session_manager._after_fork_in_child)
+atexit.register(session_manager.shutdown)
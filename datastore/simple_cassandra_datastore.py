@@ -1,23 +1,50 @@
+import asyncio
+import heapq
+import itertools
 import os
+import queue
+import random
+import threading
 import time
-from typing import Any, Dict, List
-from cassandra import ConsistencyLevel
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, List, Iterator, Tuple
+from cassandra import ConsistencyLevel, DriverException
 import json
-import requests
-from cassandra.policies import RetryPolicy
 from loguru import logger
 from pydantic import BaseModel
 
-from cassandra.cluster import Cluster, NoHostAvailable
-from cassandra.io.libevreactor import LibevConnection
+from cassandra.cluster import Cluster, NoHostAvailable, ExecutionProfile, EXEC_PROFILE_DEFAULT
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.query import SimpleStatement, dict_factory, named_tuple_factory, UNSET_VALUE
+from cassandra.query import SimpleStatement, BatchStatement, BatchType, dict_factory, named_tuple_factory, UNSET_VALUE
+
+from datastore.concurrency import AdaptiveLimiter, run_limited, call_limited, call_limited_async
+from datastore.connection_options import ConnectionOptions
+from datastore.lazy_vector import lazy_vector_statement
+from datastore.latency import POINT_READ, INDEX_READ, ANN, SCAN, WRITE, OperationRetryPolicy, resolve_latency_policies, make_execution_profiles
+from datastore.session_manager import SharedSession, session_manager
+from datastore.singleflight import SingleFlight
 
 
 CASSANDRA_HOST = os.environ.get("CASSANDRA_HOST", "localhost")
 CASSANDRA_PORT = int(os.environ.get("CASSANDRA_PORT", 9042))
 CASSANDRA_KEYSPACE = os.environ.get("CASSANDRA_KEYSPACE", "default_keyspace")
 CASSANDRA_USER = 'token'
+DEFAULT_PAGE_SIZE = 1000
+# rows are returned as dicts through this profile; the default profile keeps named tuples
+EXEC_PROFILE_DICT = "dict"
+DEFAULT_ANN_LIMIT = 20
+SIMILARITY_FUNCTIONS = ("cosine", "dot_product", "euclidean")
+# alias of the similarity column added to scatter-gather ann rows
+SCORE_COLUMN = "similarity_score"
+# reads that identical concurrent requests may share when coalescing is enabled
+COALESCED_OPERATIONS = (POINT_READ, INDEX_READ, ANN)
+# Murmur3Partitioner token bounds
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+# a hibernated database takes minutes to resume, connecting is retried with jittered exponential backoff until then
+WAKE_UP_TIMEOUT = 300.0
+WAKE_UP_BACKOFF = 2.0
+WAKE_UP_MAX_BACKOFF = 30.0
 
 
 class Payload(BaseModel):
@@ -31,20 +58,21 @@ class CassandraDataStore():
         # self.client = self.create_db_client()
         pass
 
-    def create_db_client(self, token, dbid):
-        self.client = CassandraClient(token, dbid)
+    def create_db_client(self, token, dbid, latency_policies=None, connection_options=None):
+        self.client = CassandraClient(token, dbid, latency_policies, connection_options)
         return self.client
 
     def getSubApp(self):
         return self.app
 
-    def setupSession(self, token, dbid):
+    def setupSession(self, token, dbid, latency_policies=None, connection_options=None):
         self.dbid = dbid
-        self.client = self.create_db_client(token, dbid)
+        self.client = self.create_db_client(token, dbid, latency_policies, connection_options)
         return self.client
 
 
 def get_astra_bundle_url(dbid, token):
+    import requests
     # Define the URL
     url = f"https://api.astra.datastax.com/v2/databases/{dbid}/secureBundleURL"
 
@@ -72,7 +100,27 @@ def get_astra_bundle_url(dbid, token):
     else:
         return response['downloadURL']
 
+def connect_waking_up(dbid, token, connect, timeout=WAKE_UP_TIMEOUT):
+    # a hibernated database doesn't answer the bundle's metadata service, so each failed connect asks Astra to
+    # wake it up and waits before trying again. Any other error is ours and raised straight away
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            return connect()
+        except DriverException as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(f"DB {dbid} did not wake up within {timeout:.0f}s: {e}")
+            logger.warning(f"DB {dbid} is Hibernated ({e}), will attempt to wake it up")
+            make_keyspace(dbid, token)
+            delay = min(WAKE_UP_MAX_BACKOFF, WAKE_UP_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+            time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+            attempt += 1
+
+
 def make_keyspace(databaseID, token):
+    import requests
     # Define the URL
     url = f"https://api.astra.datastax.com/v2/databases/{databaseID}/keyspaces/{CASSANDRA_KEYSPACE}"
 
@@ -106,40 +154,50 @@ def make_keyspace(databaseID, token):
     return
 
 
-class VectorRetryPolicy(RetryPolicy):
-    def on_read_timeout(self, query, consistency, required_responses,
-                        received_responses, data_retrieved, retry_num):
-        if retry_num < 3:
-            logger.info(f"retrying timeout {retry_num}")
-            logger.info(f"query: {query}")
-            return RetryPolicy.RETRY, consistency  # return a tuple
-        else:
-            return RetryPolicy.RETHROW, consistency
-
-    def on_request_error(self, query, consistency, error, retry_num):
-        if retry_num < 3:
-            logger.info(f"retrying error {retry_num}")
-            logger.info(f"query: {query}")
-            return RetryPolicy.RETRY, consistency  # return a tuple
-        else:
-            return RetryPolicy.RETHROW, consistency
-
-
-    def on_unavailable(self, query, consistency, required_replicas, alive_replicas, retry_num):
-        return RetryPolicy.RETHROW, consistency  # return a tuple
-
-    def on_write_timeout(self, query, consistency, write_type,
-                         required_responses, received_responses, retry_num):
-        return RetryPolicy.RETHROW, consistency  # return a tuple
+def split_token_ranges(ring_tokens, splits) -> List[Tuple[int, int]]:
+    # ranges are (start, end] so together they cover the whole ring exactly once
+    boundaries = sorted(set([MIN_TOKEN, MAX_TOKEN] + [int(token) for token in ring_tokens]))
+    ranges = list(zip(boundaries[:-1], boundaries[1:]))
+    parts = -(-splits // len(ranges))
+    if parts <= 1:
+        return ranges
+    split_ranges = []
+    for start, end in ranges:
+        step = (end - start) // parts
+        if step == 0:
+            split_ranges.append((start, end))
+            continue
+        for i in range(parts):
+            split_end = end if i == parts - 1 else start + step * (i + 1)
+            split_ranges.append((start + step * i, split_end))
+    return split_ranges
 
 
+class VectorRetryPolicy(OperationRetryPolicy):
+    # index and ann reads retry timeouts more often than the profile default
+    def __init__(self, max_retries=3):
+        super().__init__(max_retries)
 
 
 class CassandraClient():
-    def __init__(self, token, dbid) -> None:
+    def __init__(self, token, dbid, latency_policies=None, connection_options: ConnectionOptions = None) -> None:
         super().__init__()
         self.dbid = dbid
-        self.cluster =  None
+        self._token = token
+        self._cluster = None
+        self._session = None
+        # pid that acquired the shared session, a different pid means we were forked and must reconnect
+        self._pid = None
+        self._session_key = None
+        self._prepared_statements = {}
+        self.latency_policies = resolve_latency_policies(latency_policies)
+        self.connection_options = (connection_options or ConnectionOptions()).validate_options()
+        self._speculative_policies = {}
+        self.limiter: AdaptiveLimiter = None
+        # set by enable_coalescing, identical in flight reads then share one request
+        self.singleflight: SingleFlight = None
+        # rows of point, index and ann reads keep float vectors as wire bytes until used, see LazyVector
+        self.lazy_vectors = False
         try:
             self.connect(token,dbid)
         except NoHostAvailable as e:
@@ -153,11 +211,54 @@ class CassandraClient():
         # TODO: potentially re-enable document table creation for vector search enabled databases
         #self.create_table(token)
 
+    @property
+    def session(self):
+        self._reconnect_after_fork()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+        self._pid = os.getpid()
+
+    @property
+    def cluster(self):
+        self._reconnect_after_fork()
+        return self._cluster
+
+    @cluster.setter
+    def cluster(self, cluster):
+        self._cluster = cluster
+
+    def _reconnect_after_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            logger.info(f"process forked, reconnecting to {self.dbid} in pid {os.getpid()}")
+            self.connect(self._token, self.dbid)
+
     def connect(self, token, dbid):
+        # clients with the same credentials and settings share one Cluster per process
+        key = (
+            token,
+            dbid,
+            tuple((operation, policy.model_dump_json()) for operation, policy in sorted(self.latency_policies.items())),
+            self.connection_options.model_dump_json(),
+        )
+        shared = session_manager.acquire(key, lambda: self._connect_cluster(token, dbid))
+        self._session_key = key
+        self._cluster = shared.cluster
+        self._session = shared.session
+        self._speculative_policies = shared.speculative_policies
+        self.limiter = shared.limiter
+        self._pid = session_manager.pid
+        # statements prepared on another process's session are not usable here
+        self._prepared_statements = {}
+
+    def _connect_cluster(self, token, dbid) -> SharedSession:
         if dbid is not None:
             # connect to Astra
             url = get_astra_bundle_url(dbid, token)
             if url:
+                import requests
                 # Download the secure connect bundle and extract it
                 r = requests.get(url)
                 bundlepath = f'/tmp/{dbid}.zip'
@@ -168,16 +269,23 @@ class CassandraClient():
                     'secure_connect_bundle': bundlepath
                 }
                 auth_provider = PlainTextAuthProvider(CASSANDRA_USER, token)
-                # TODO - support unhibernating things
-                try:
-                    self.cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
-                    self.cluster.connection_class = LibevConnection
-                except Exception as e:
-                    make_keyspace(dbid, token)
-                    logger.warning(f"DB {dbid} is Hibernated, will attempt to wake it up")
-                    return self.connect(token,dbid)
-
-                self.session = self.cluster.connect()
+                options = self.connection_options
+                operation_profiles, speculative_policies = make_execution_profiles(self.latency_policies, options.load_balancing_policy)
+                cluster = connect_waking_up(dbid, token, lambda: Cluster(
+                    cloud=cloud_config,
+                    auth_provider=auth_provider,
+                    execution_profiles={
+                        EXEC_PROFILE_DEFAULT: ExecutionProfile(row_factory=named_tuple_factory, load_balancing_policy=options.load_balancing_policy()),
+                        EXEC_PROFILE_DICT: ExecutionProfile(row_factory=dict_factory, load_balancing_policy=options.load_balancing_policy()),
+                        **operation_profiles,
+                    },
+                    **options.cluster_kwargs()
+                ))
+                cluster.connection_class = options.connection_class()
+
+                session = cluster.connect()
+                options.apply_pool_settings(cluster)
+                return SharedSession(cluster, session, speculative_policies, options.concurrency_limiter())
             else:
                 #time.sleep(5)
                 #return self.connect(token, dbid)
@@ -195,10 +303,36 @@ class CassandraClient():
             logger.warning(f"Exception creating table or index: {e}")
             raise Exception(f"Failed to create table or index {e}")
 
+    def execute_ddl(self, statements: List[str]):
+        # independent schema changes run concurrently, then waits for every node to agree on the new schema
+        futures = [self.session.execute_async(SimpleStatement(ddl, consistency_level=ConsistencyLevel.QUORUM)) for ddl in statements]
+        errors = []
+        for ddl, future in zip(statements, futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"Exception running {ddl}: {e}")
+                errors.append(e)
+        self.wait_for_schema_agreement()
+        if errors:
+            raise Exception(f"Failed {len(errors)} of {len(statements)} schema changes: {errors[0]}")
+
+    def wait_for_schema_agreement(self):
+        # returns as soon as all nodes report the same schema version, at most max_schema_agreement_wait seconds
+        if not self.cluster.control_connection.wait_for_schema_agreement():
+            logger.warning(f"schema agreement not reached after {self.cluster.max_schema_agreement_wait}s")
+
+    def close(self):
+        # the shared cluster shuts down when its last client in the owning process closes, or at exit
+        if self._session_key is not None:
+            session_manager.release(self._session_key, self._pid)
+            self._session_key = None
+
     def __del__(self):
-        # close the connection when the client is destroyed
-        if self.cluster:
-            self.cluster.shutdown()
+        try:
+            self.close()
+        except Exception:
+            pass
 
 
     async def select_all_from_table_async(self, keyspace, table) -> List[Dict[str, Any]]:
@@ -206,56 +340,351 @@ class CassandraClient():
 
     def select_all_from_table(self, keyspace, table) -> List[Dict[str, Any]]:
         queryString = f"""SELECT * FROM {keyspace}.{table} limit 10"""
-        statement = self.session.prepare(queryString)
+        statement = self._read_statement(queryString)
         statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
+        rows = self._execute(SCAN, statement)
         json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
         return json_rows
 
-    def delete_from_table_by_keys(self, keyspace, table, keys, args) -> List[Dict[str, Any]]:
-        queryString = f"""DELETE FROM {keyspace}.{table} WHERE """
-        partitionKeyValues = []
+    def prepare(self, query_string):
+        # prepared statements are cached per query string so hot paths only pay for the round trip once
+        statement = self._prepared_statements.get(query_string)
+        if statement is None:
+            statement = self.session.prepare(query_string)
+            self._prepared_statements[query_string] = statement
+        return statement
+
+    def _read_statement(self, query_string):
+        # prepared statement for reads whose rows go back to callers, with lazily decoded vectors when enabled
+        statement = self.prepare(query_string)
+        if not self.lazy_vectors:
+            return statement
+        key = ("lazy_vectors", query_string)
+        lazy_statement = self._prepared_statements.get(key)
+        if lazy_statement is None:
+            lazy_statement = lazy_vector_statement(statement)
+            self._prepared_statements[key] = lazy_statement
+        return lazy_statement
+
+    def enable_coalescing(self, singleflight: SingleFlight = None):
+        self.singleflight = singleflight or SingleFlight()
+        return self.singleflight
+
+    def disable_coalescing(self):
+        self.singleflight = None
+
+    def _coalescing_key(self, operation, statement, parameters):
+        # statement shape plus bound values, bound statements carry their serialized values
+        prepared = getattr(statement, "prepared_statement", statement)
+        values = getattr(statement, "values", None) if parameters is None else parameters
+        return operation, prepared.query_string, statement.consistency_level, tuple(values or ())
+
+    def _execute(self, operation, statement, parameters=None):
+        # runs through the operation's execution profile (timeout, speculative execution) and feeds its latency
+        # back into the percentile based speculative delay
+        if self.singleflight is not None and operation in COALESCED_OPERATIONS:
+            # shared results are materialized, a result set can only be iterated by one caller
+            key = self._coalescing_key(operation, statement, parameters)
+            return self.singleflight.do(key, lambda: list(self._execute_statement(operation, statement, parameters)))
+        return self._execute_statement(operation, statement, parameters)
+
+    def _execute_statement(self, operation, statement, parameters=None, paging_state=None):
+        # one request through the shared limiter, overloaded requests are resubmitted after a backoff
+        statement.is_idempotent = self.latency_policies[operation].idempotent
+
+        def execute():
+            start = time.perf_counter()
+            try:
+                return self.session.execute(statement, parameters, execution_profile=operation, paging_state=paging_state)
+            finally:
+                self._record_latency(operation, start)
+        return call_limited(self.limiter, execute)
+
+    def _execute_pages(self, operation, statement) -> Iterator[List[Any]]:
+        # every page is its own request resumed from the previous paging state, so each one goes through the
+        # limiter and an overloaded page is retried without restarting the query
+        paging_state = None
+        while True:
+            result = self._execute_statement(operation, statement, paging_state=paging_state)
+            yield list(result.current_rows)
+            paging_state = result.paging_state
+            if paging_state is None:
+                break
+
+    def _record_latency(self, operation, start):
+        # failed requests are recorded too, leaving out timeouts would make the speculative delay too optimistic
+        speculative_policy = self._speculative_policies.get(operation)
+        if speculative_policy is not None:
+            speculative_policy.record(time.perf_counter() - start)
+
+    async def _execute_async(self, operation, statement, parameters=None):
+        if self.singleflight is not None and operation in COALESCED_OPERATIONS:
+            key = self._coalescing_key(operation, statement, parameters)
+            return await self.singleflight.do_async(key, lambda: self._execute_statement_async(operation, statement, parameters))
+        return await self._execute_statement_async(operation, statement, parameters)
+
+    async def _execute_statement_async(self, operation, statement, parameters=None):
+        return await call_limited_async(self.limiter, lambda: self._execute_response_async(operation, statement, parameters))
+
+    async def _execute_response_async(self, operation, statement, parameters=None):
+        # bridges the driver's callback based ResponseFuture to asyncio, collecting every page
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        rows = []
+        statement.is_idempotent = self.latency_policies[operation].idempotent
+        start = time.perf_counter()
+        response = self.session.execute_async(statement, parameters, execution_profile=operation)
+
+        def resolve(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def on_page(page):
+            rows.extend(page)
+            if response.has_more_pages:
+                response.start_fetching_next_page()
+            else:
+                self._record_latency(operation, start)
+                loop.call_soon_threadsafe(resolve, rows, None)
+
+        def on_error(error):
+            self._record_latency(operation, start)
+            loop.call_soon_threadsafe(resolve, None, error)
+
+        response.add_callbacks(on_page, on_error)
+        return await future
+
+    def execute_concurrent(self, statement, parameters, concurrency=None, operation=WRITE):
+        # concurrency caps this call, the shared adaptive limiter decides how much of it is used, results in order
+        concurrency = concurrency or self.limiter.max_limit
+        statement.is_idempotent = self.latency_policies[operation].idempotent
+        session = self.session
+
+        def record(_, start):
+            self._record_latency(operation, start)
+
+        def submit(params):
+            start = time.perf_counter()
+            future = session.execute_async(statement, params, execution_profile=operation)
+            future.add_callbacks(record, record, callback_args=(start,), errback_args=(start,))
+            return future
+        return run_limited(self.limiter, submit, list(parameters), concurrency)
+
+    def _where_clause(self, keys, args, ranges=None):
+        predicates = []
+        values = []
         for column in keys:
-            queryString += f"{column} = ? AND "
-            partitionKeyValues.append(args[column])
-        # remove the last AND
-        queryString = queryString[:-4]
-        statement = self.session.prepare(queryString)
+            predicates.append(f"{column} = ?")
+            values.append(args[column])
+        # ranges are (column, operator, value) tuples on clustering columns, e.g. ("ts", "<", cutoff)
+        if ranges:
+            for column, operator, value in ranges:
+                predicates.append(f"{column} {operator} ?")
+                values.append(value)
+        return " AND ".join(predicates), values
+
+    def delete_from_table_by_keys(self, keyspace, table, keys, args, ranges=None) -> List[Dict[str, Any]]:
+        where, values = self._where_clause(keys, args, ranges)
+        statement = self.prepare(f"""DELETE FROM {keyspace}.{table} WHERE {where}""")
         statement.consistency_level = ConsistencyLevel.QUORUM
-        preparedStatement = statement.bind(partitionKeyValues)
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(preparedStatement)
+        preparedStatement = statement.bind(values)
+        rows = self._execute(WRITE, preparedStatement)
         json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
         return json_rows
 
+    def delete_many_from_table_by_keys(self, keyspace, table, keys, args_list, ranges=None, concurrency=None):
+        # every entry in args_list must provide values for the same keys so they can share one prepared statement
+        where, _ = self._where_clause(keys, {key: None for key in keys}, ranges)
+        statement = self.prepare(f"""DELETE FROM {keyspace}.{table} WHERE {where}""")
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        range_values = [value for _, _, value in ranges] if ranges else []
+        parameters = [[args[key] for key in keys] + range_values for args in args_list]
+        self.execute_concurrent(statement, parameters, concurrency=concurrency)
+
     def select_from_table_by_keys(self, keyspace, table, keys, args) -> List[Dict[str, Any]]:
+        rows = self._execute(POINT_READ, self._select_by_keys_statement(keyspace, table, keys, args))
+        json_rows = [dict(row) for row in rows]
+        return json_rows
+
+    async def select_from_table_by_keys_async(self, keyspace, table, keys, args) -> List[Dict[str, Any]]:
+        rows = await self._execute_async(POINT_READ, self._select_by_keys_statement(keyspace, table, keys, args))
+        json_rows = [dict(row) for row in rows]
+        return json_rows
+
+    def select_many_from_table_by_keys(self, keyspace, table, keys, args_list, concurrency=None) -> List[List[Dict[str, Any]]]:
+        # concurrent point reads sharing one prepared statement, one list of rows per args in args_list order
+        statement = self._select_by_keys_prepared(keyspace, table, keys)
+        parameters = [[args[column] for column in keys] for args in args_list]
+        results = self.execute_concurrent(statement, parameters, concurrency=concurrency, operation=POINT_READ)
+        return [[dict(row) for row in rows] for rows in results]
+
+    def _select_by_keys_statement(self, keyspace, table, keys, args):
+        statement = self._select_by_keys_prepared(keyspace, table, keys)
+        return statement.bind([args[column] for column in keys])
+
+    def _select_by_keys_prepared(self, keyspace, table, keys):
         queryString = f"""SELECT * FROM {keyspace}.{table} WHERE """
-        partitionKeyValues = []
         for column in keys:
             queryString += f"{column} = ? AND "
-            partitionKeyValues.append(args[column])
         # remove the last AND
         queryString = queryString[:-4]
-        statement = self.session.prepare(queryString)
+        statement = self._read_statement(queryString)
         statement.consistency_level = ConsistencyLevel.QUORUM
-        preparedStatement = statement.bind(partitionKeyValues)
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(preparedStatement)
-        json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
-        return json_rows
+        return statement
+
+    def _select_query(self, keyspace, table, keys=None, args=None, ranges=None, columns=None, order_by=None, limit=None, per_partition_limit=None):
+        # order_by is a list of (column, "ASC" | "DESC") on clustering columns, limits are bound so the shape stays stable
+        select = ", ".join(columns) if columns else "*"
+        queryString = f"""SELECT {select} FROM {keyspace}.{table}"""
+        where, values = self._where_clause(keys or [], args or {}, ranges)
+        if where:
+            queryString += f" WHERE {where}"
+        if order_by:
+            queryString += " ORDER BY " + ", ".join(f"{column} {direction}" for column, direction in order_by)
+        if per_partition_limit is not None:
+            queryString += " PER PARTITION LIMIT ?"
+            values.append(per_partition_limit)
+        if limit is not None:
+            queryString += " LIMIT ?"
+            values.append(limit)
+        return queryString, values
+
+    def iter_select_from_table(self, keyspace, table, keys=None, args=None, ranges=None, columns=None, page_size=DEFAULT_PAGE_SIZE,
+                               order_by=None, limit=None, per_partition_limit=None, operation=SCAN) -> Iterator[List[Dict[str, Any]]]:
+        # paged counterpart of select_from_table_by_keys, yields one page of rows at a time. Never coalesced, a
+        # shared result would be materialized and lose the paging
+        queryString, values = self._select_query(keyspace, table, keys, args, ranges, columns, order_by, limit, per_partition_limit)
+        statement = self.prepare(queryString)
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        bound_statement = statement.bind(values)
+        bound_statement.fetch_size = page_size
+        yield from self._execute_pages(operation, bound_statement)
+
+    def select_page(self, keyspace, table, keys=None, args=None, ranges=None, columns=None, order_by=None,
+                    page_size=DEFAULT_PAGE_SIZE, paging_state=None, operation=SCAN) -> Tuple[List[Dict[str, Any]], bytes]:
+        # one page and the driver paging state to resume from, None after the last page. Never coalesced,
+        # shared results would lose the paging state
+        queryString, values = self._select_query(keyspace, table, keys, args, ranges, columns, order_by)
+        statement = self.prepare(queryString)
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        bound_statement = statement.bind(values)
+        bound_statement.fetch_size = page_size
+        result = self._execute_statement(operation, bound_statement, paging_state=paging_state)
+        return [dict(row) for row in result.current_rows], result.paging_state
+
+    def get_token_ranges(self, splits) -> List[Tuple[int, int]]:
+        token_map = self.cluster.metadata.token_map if self.cluster else None
+        ring = [token.value for token in token_map.ring] if token_map else []
+        return split_token_ranges(ring, splits)
+
+    def _token_range_query(self, keyspace, table, partition_keys, select="*"):
+        token = f"token({', '.join(partition_keys)})"
+        return f"""SELECT {select} FROM {keyspace}.{table} WHERE {token} > ? AND {token} <= ?"""
+
+    def select_token_range_from_table(self, keyspace, table, partition_keys, token_range, columns=None, page_size=DEFAULT_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        # yields one page of rows at a time so callers never hold more than a page per range
+        select = ", ".join(columns) if columns else "*"
+        statement = self.prepare(self._token_range_query(keyspace, table, partition_keys, select))
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        bound_statement = statement.bind(token_range)
+        bound_statement.fetch_size = page_size
+        yield from self._execute_pages(SCAN, bound_statement)
+
+    def scan_table(self, keyspace, table, partition_keys, columns=None, parallelism=8, splits=None,
+                   page_size=DEFAULT_PAGE_SIZE, checkpoint=None, on_range_complete=None,
+                   transform=None, processes=None) -> Iterator[Any]:
+        # token ranges are read concurrently and their pages merged unordered into a single stream.
+        # ranges listed in checkpoint are skipped, on_range_complete(range) fires once all of a range's rows were yielded
+        completed = {tuple(token_range) for token_range in checkpoint} if checkpoint else set()
+        ranges = [r for r in self.get_token_ranges(splits or parallelism * 4) if r not in completed]
+        pages = queue.Queue(maxsize=parallelism * 2)
+        stop = threading.Event()
+        process_pool = ProcessPoolExecutor(processes) if transform is not None and processes else None
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_range(token_range):
+            try:
+                for page in self.select_token_range_from_table(keyspace, table, partition_keys, token_range, columns, page_size):
+                    if stop.is_set():
+                        return
+                    if transform is not None:
+                        page = process_pool.submit(transform, page).result() if process_pool else transform(page)
+                    if not put((token_range, page, None)):
+                        return
+                put((token_range, None, None))
+            except Exception as e:
+                put((token_range, None, e))
+
+        executor = ThreadPoolExecutor(max_workers=parallelism)
+        try:
+            for token_range in ranges:
+                executor.submit(read_range, token_range)
+            remaining = len(ranges)
+            while remaining > 0:
+                token_range, page, error = pages.get()
+                if error is not None:
+                    logger.error(f"failed to scan {keyspace}.{table} range {token_range}: {error}")
+                    raise error
+                if page is None:
+                    remaining -= 1
+                    if on_range_complete is not None:
+                        on_range_complete(token_range)
+                    continue
+                yield from page
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if process_pool is not None:
+                process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def count_table(self, keyspace, table, partition_keys, parallelism=8, splits=None) -> int:
+        statement = self.prepare(self._token_range_query(keyspace, table, partition_keys, "COUNT(*) AS count"))
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        ranges = self.get_token_ranges(splits or parallelism * 4)
+        results = self.execute_concurrent(statement, ranges, concurrency=parallelism, operation=SCAN)
+        return sum(result.one()["count"] for result in results)
+
+    def get_size_estimates(self, keyspace, table) -> Dict[str, Any]:
+        # system.size_estimates only covers the coordinator's primary ranges, so extrapolate by ring coverage
+        queryString = """SELECT range_start, range_end, mean_partition_size, partitions_count FROM system.size_estimates WHERE keyspace_name = ? AND table_name = ?"""
+        statement = self.prepare(queryString)
+        statement.consistency_level = ConsistencyLevel.ONE
+        rows = self.session.execute(statement.bind((keyspace, table)), execution_profile=EXEC_PROFILE_DICT)
+        covered = 0
+        partitions = 0
+        size = 0
+        for row in rows:
+            start, end = int(row["range_start"]), int(row["range_end"])
+            covered += end - start if end > start else end - start + 2 ** 64
+            partitions += row["partitions_count"]
+            size += row["partitions_count"] * row["mean_partition_size"]
+        if covered == 0:
+            return {"partitions": 0, "bytes": 0, "mean_partition_size": 0, "ring_coverage": 0.0}
+        coverage = covered / 2 ** 64
+        return {
+            "partitions": int(partitions / coverage),
+            "bytes": int(size / coverage),
+            "mean_partition_size": int(size / partitions) if partitions else 0,
+            "ring_coverage": coverage,
+        }
 
     async def upsert_table_from_dict_async(self, keyspace_name: str, table_name : str, obj : Dict):
         return self.upsert_table_from_dict(keyspace_name, table_name, obj)
 
     def upsert_table_from_dict(self, keyspace_name: str, table_name : str, obj : Dict):
         logger.info(f"going to upsert keyspace {keyspace_name} and table {table_name} using {obj}")
-        fields = ', '.join(obj.keys())
-        placeholders = ', '.join(['?' for _ in range(len(obj.keys()))])
-
         values_list = []
 
         for field in obj.keys():
@@ -266,14 +695,10 @@ class CassandraClient():
                 formatted_value = value
             values_list.append(formatted_value)
 
-        query_string = f"""insert into {keyspace_name}.{table_name}(
-                {fields}
-            ) VALUES (
-                {placeholders}
-            );"""
+        query_string = self._upsert_query(keyspace_name, table_name, obj.keys())
 
         logger.info(f"Preparing query_string: {query_string}")
-        statement = self.session.prepare(query_string)
+        statement = self.prepare(query_string)
         statement.consistency_level = ConsistencyLevel.QUORUM
 
         for value in values_list:
@@ -281,7 +706,8 @@ class CassandraClient():
                 values_list[values_list.index(value)] = UNSET_VALUE
 
         try:
-            response = self.session.execute(
+            response = self._execute(
+                WRITE,
                 statement,
                 tuple(values_list)
             )
@@ -289,6 +715,63 @@ class CassandraClient():
             logger.error(f"failed to upsert {table_name}: {obj}")
             raise e
 
+    def _upsert_query(self, keyspace_name, table_name, fields):
+        placeholders = ', '.join(['?' for _ in fields])
+        return f"""insert into {keyspace_name}.{table_name}(
+                {', '.join(fields)}
+            ) VALUES (
+                {placeholders}
+            );"""
+
+    def prepare_table_statements(self, keyspace, table, columns, partition_keys, clustering_columns, upsert_columns=None) -> int:
+        # prepares what point reads, inserts and deletes of a table will use so the first requests don't pay for it.
+        # upsert_columns is the order upsert_table_from_dict gets its fields in, the query text depends on it
+        before = len(self._prepared_statements)
+        self.prepare(self._upsert_query(keyspace, table, upsert_columns or columns))
+        self._insert_statement(keyspace, table, columns)
+        for keys in (partition_keys, partition_keys + clustering_columns):
+            self._select_by_keys_prepared(keyspace, table, keys)
+            where, _ = self._where_clause(keys, dict.fromkeys(keys))
+            self.prepare(f"""DELETE FROM {keyspace}.{table} WHERE {where}""")
+        return len(self._prepared_statements) - before
+
+    def _insert_statement(self, keyspace_name, table_name, columns, ttl=False):
+        # with ttl the statement ends in USING TTL ?, bound after the column values, 0 means no expiry
+        fields = ', '.join(columns)
+        placeholders = ', '.join(['?' for _ in columns])
+        using = " USING TTL ?" if ttl else ""
+        statement = self.prepare(f"""INSERT INTO {keyspace_name}.{table_name} ({fields}) VALUES ({placeholders}){using}""")
+        statement.consistency_level = ConsistencyLevel.QUORUM
+        return statement
+
+    def insert_into_table(self, keyspace_name, table_name, columns, values, ttl=None):
+        # raw write path: values are already in the order of columns and are bound as is, None is sent as unset
+        statement = self._insert_statement(keyspace_name, table_name, columns, ttl is not None)
+        parameters = [UNSET_VALUE if value is None else value for value in values]
+        if ttl is not None:
+            parameters.append(ttl)
+        self._execute(WRITE, statement, parameters)
+
+    def insert_batch(self, keyspace_name, table_name, columns, rows):
+        # one unlogged batch, for rows of a single partition which the replicas apply as one mutation. Rows are
+        # sequences of values in the order of columns
+        statement = self._insert_statement(keyspace_name, table_name, columns)
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED, consistency_level=ConsistencyLevel.QUORUM)
+        for row in rows:
+            batch.add(statement, [UNSET_VALUE if value is None else value for value in row])
+        self._execute(WRITE, batch)
+
+    def insert_many_into_table(self, keyspace_name, table_name, columns, rows, concurrency=None, ttl=None):
+        # rows are sequences of values in the order of columns, None is sent as unset so no tombstones are written
+        statement = self._insert_statement(keyspace_name, table_name, columns, ttl is not None)
+        ttl_values = [] if ttl is None else [ttl]
+        parameters = [[UNSET_VALUE if value is None else value for value in row] + ttl_values for row in rows]
+        try:
+            self.execute_concurrent(statement, parameters, concurrency=concurrency)
+        except Exception as e:
+            logger.error(f"failed to insert batch of {len(parameters)} rows into {table_name}: {e}")
+            raise e
+
     async def get_tables_async(self, keyspace):
         return self.get_tables(keyspace)
 
@@ -322,39 +805,81 @@ class CassandraClient():
         return tables
 
     def get_indexes(self, keyspace, table):
-        queryString = f"""
-        SELECT options FROM system_schema.indexes 
-        WHERE keyspace_name='{keyspace}' 
-        and table_name = '{table}'
-        and kind = 'CUSTOM' ALLOW FILTERING;
-        """
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
-        indexes = [row['options'] for row in rows]
-        indexed_columns = []
-        for index in indexes:
-            options = dict(index)
-            # TODO - extract whether it's dot vs cosine for vector types
-            # and extract vector type
-            if 'StorageAttachedIndex' in options['class_name']:
-                indexed_columns.append(options['target'])
-        self.session.row_factory = named_tuple_factory
-        return indexed_columns
+        # target columns of the table's SAI indexes
+        indexes = self.get_index_metadata(keyspace, table)
+        return [column for column, index in indexes.items() if 'StorageAttachedIndex' in index['options'].get('class_name', '')]
+
+    def get_index_metadata(self, keyspace, table) -> Dict[str, Dict[str, Any]]:
+        # {column: {"name", "kind", "options"}} from the driver's schema metadata, which schema change events keep
+        # current, options include e.g. similarity_function for vector indexes. system_schema is only read when the
+        # driver doesn't know the table yet
+        keyspace_metadata = self.cluster.metadata.keyspaces.get(keyspace)
+        table_metadata = keyspace_metadata.tables.get(table) if keyspace_metadata is not None else None
+        if table_metadata is not None:
+            indexes = [(index.name, index.kind, dict(index.index_options)) for index in table_metadata.indexes.values()]
+        else:
+            statement = self.prepare("SELECT index_name, kind, options FROM system_schema.indexes WHERE keyspace_name = ? AND table_name = ?")
+            bound_statement = statement.bind((keyspace, table))
+            bound_statement.consistency_level = ConsistencyLevel.QUORUM
+            rows = self.session.execute(bound_statement, execution_profile=EXEC_PROFILE_DICT)
+            indexes = [(row['index_name'], row['kind'], dict(row['options'])) for row in rows]
+        return {options.get('target', '').strip('"'): {"name": name, "kind": kind, "options": options} for name, kind, options in indexes}
+
+    def get_index_status(self, keyspace, index_name) -> Dict[str, bool] | None:
+        # SAI build state as seen by the coordinator, None when it is unknown: the server doesn't expose
+        # system_views or the coordinator has no row for the index
+        statement = SimpleStatement("SELECT is_queryable, is_building FROM system_views.sai_column_indexes WHERE keyspace_name = %s AND index_name = %s")
+        try:
+            rows = list(self.session.execute(statement, (keyspace, index_name), execution_profile=EXEC_PROFILE_DICT))
+        except Exception as e:
+            logger.debug(f"index status not available for {keyspace}.{index_name}: {e}")
+            return None
+        if not rows:
+            return None
+        return {"queryable": rows[0]['is_queryable'], "building": rows[0]['is_building']}
+
+    def get_schema(self, keyspace) -> Dict[str, Dict[str, Any]]:
+        # columns and indexed columns of every table in the keyspace, two queries whatever the number of tables
+        statement = self.prepare("select table_name, column_name, kind, type, position from system_schema.\"columns\" WHERE keyspace_name = ?")
+        bound_statement = statement.bind((keyspace,))
+        bound_statement.consistency_level = ConsistencyLevel.QUORUM
+        schema = {}
+        for row in self.session.execute(bound_statement, execution_profile=EXEC_PROFILE_DICT):
+            row = dict(row)
+            table = schema.setdefault(row.pop("table_name"), {"columns": [], "indexes": set()})
+            table["columns"].append(row)
+        statement = self.prepare("SELECT table_name, options FROM system_schema.indexes WHERE keyspace_name = ?")
+        bound_statement = statement.bind((keyspace,))
+        bound_statement.consistency_level = ConsistencyLevel.QUORUM
+        for row in self.session.execute(bound_statement, execution_profile=EXEC_PROFILE_DICT):
+            table = schema.get(row["table_name"])
+            target = dict(row["options"]).get("target")
+            if table is not None and target:
+                table["indexes"].add(target.strip('"'))
+        return schema
 
     def get_columns(self, keyspace, table) -> List[Dict[str, Any]]:
         queryString = f"""select column_name, kind, type, position from system_schema."columns" WHERE keyspace_name = ? and table_name = ?;"""
         statement = self.session.prepare(queryString)
         bound_statement = statement.bind((keyspace, table))
         bound_statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(bound_statement)
+        rows = self.session.execute(bound_statement, execution_profile=EXEC_PROFILE_DICT)
         json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
         return json_rows
 
-    def select_from_table_by_index(self, keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args) -> List[Dict[str, Any]]:
+    def select_from_table_by_index(self, keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args, limit=DEFAULT_ANN_LIMIT) -> List[Dict[str, Any]]:
+        operation, statement = self._select_by_index_statement(keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args, limit)
+        rows = self._execute(operation, statement)
+        json_rows = [dict(row) for row in rows]
+        return json_rows
+
+    async def select_from_table_by_index_async(self, keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args, limit=DEFAULT_ANN_LIMIT) -> List[Dict[str, Any]]:
+        operation, statement = self._select_by_index_statement(keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args, limit)
+        rows = await self._execute_async(operation, statement)
+        json_rows = [dict(row) for row in rows]
+        return json_rows
+
+    def _select_by_index_statement(self, keyspace, table, indexed_columns, vector_indexes, partition_keys, columns, args, limit=DEFAULT_ANN_LIMIT):
         queryString = f"SELECT "
         bind_values = []
         for column in columns:
@@ -423,16 +948,29 @@ class CassandraClient():
                 {column} ann of ?
                 """
                 bind_values.append(args[column])
-        # TODO make limit configurable
-        queryString += f"LIMIT 20"
+        queryString += f" LIMIT ?"
+        bind_values.append(limit)
 
-        statement = self.session.prepare(queryString)
-        statement.retry_policy = VectorRetryPolicy()
+        operation = ANN if any(column in args for column in vector_indexes) else INDEX_READ
+        statement = self._read_statement(queryString)
+        statement.retry_policy = VectorRetryPolicy(self.latency_policies[operation].max_retries)
         statement.consistency_level = ConsistencyLevel.LOCAL_ONE
-        boundStatement = statement.bind(bind_values)
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(boundStatement, timeout=100)
-        json_rows = [dict(row) for row in rows]
-        #json_rows = [{k: v for k, v in row.items() if not k in vector_indexes} for row in json_rows]
-        self.session.row_factory = named_tuple_factory
-        return json_rows
+        return operation, statement.bind(bind_values)
+
+    def select_ann_from_partitions(self, keyspace, table, vector_column, keys, args_list, vector, columns, limit=DEFAULT_ANN_LIMIT,
+                                   per_partition_limit=None, similarity="cosine", concurrency=None) -> List[Dict[str, Any]]:
+        # scatter-gather ann: one query per partition in args_list run concurrently, each returning its rows best first
+        # with a similarity_score column, k-way merged by score into the global top limit rows
+        if similarity not in SIMILARITY_FUNCTIONS:
+            raise ValueError(f"Unsupported similarity function {similarity}, expected one of {SIMILARITY_FUNCTIONS}")
+        where = " AND ".join(f"{column} = ?" for column in keys)
+        queryString = f"""SELECT {", ".join(columns)}, similarity_{similarity}({vector_column}, ?) AS {SCORE_COLUMN} FROM {keyspace}.{table} WHERE {where} ORDER BY {vector_column} ANN OF ? LIMIT ?"""
+        statement = self._read_statement(queryString)
+        statement.retry_policy = VectorRetryPolicy(self.latency_policies[ANN].max_retries)
+        statement.consistency_level = ConsistencyLevel.LOCAL_ONE
+        per_partition_limit = per_partition_limit or limit
+        parameters = [[vector] + [args[column] for column in keys] + [vector, per_partition_limit] for args in args_list]
+        results = self.execute_concurrent(statement, parameters, concurrency=concurrency, operation=ANN)
+        # each partition comes back in ann order, sorted again in case the index uses another similarity function
+        partitions = [sorted((dict(row) for row in rows), key=lambda row: row[SCORE_COLUMN], reverse=True) for rows in results]
+        return list(itertools.islice(heapq.merge(*partitions, key=lambda row: row[SCORE_COLUMN], reverse=True), limit))
@@ -1,8 +1,21 @@
+import os
+import uuid
+
+import dotenv
 from astra_assistants.astra_assistants_manager import AssistantManager
 from fasthtml.common import *
 from openai import OpenAI
 from astra_assistants import patch
 
+from fastastra.chat_log import merge_entries
+from fastastra.fastastra import AstraDatabase
+
+dotenv.load_dotenv("./.env")
+dotenv.load_dotenv("../.env")
+
+token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+dbid = os.environ.get("DBID", None)
+
 # Set up the app, including daisyui and tailwind for the chat component
 tlink = Script(src="https://cdn.tailwindcss.com"),
 dlink = Link(rel="stylesheet", href="https://cdn.jsdelivr.net/npm/daisyui@4.11.1/dist/full.min.css")
@@ -10,26 +23,38 @@ app = FastHTML(hdrs=(tlink, dlink, picolink))
 
 client = patch(OpenAI())
 sp = """You are a helpful and concise assistant."""
-messages = []
+# history lives in Astra so any worker can serve any conversation and it survives restarts
+db = AstraDatabase(token, dbid)
+log = db.conversation_log("chatbot_log")
+
+
+def conversation_id(session):
+    if 'conversation' not in session: session['conversation'] = str(uuid.uuid4())
+    return session['conversation']
+
+# Polls for the entries written after cursor while the message is still being generated
+def ChatPoller(message, cursor):
+    return Div(hx_trigger="every 0.1s", hx_swap="outerHTML", hx_get=f"/chat_message/{message}?after={cursor}",
+               id=f"chat-poller-{message}")
 
-# Chat message component, polling if message is still being generated
-def ChatMessage(msg_idx):
-    msg = messages[msg_idx]
-    text = "..." if msg['content'] == "" else msg['content']
+# Chat message component, msg is a message dict from merge_entries
+def ChatMessage(msg, cursor=None):
     bubble_class = "chat-bubble-primary" if msg['role']=='user' else 'chat-bubble-secondary'
     chat_class = "chat-end" if msg['role']=='user' else 'chat-start'
-    generating = 'generating' in messages[msg_idx] and messages[msg_idx]['generating']
-    stream_args = {"hx_trigger":"every 0.1s", "hx_swap":"outerHTML", "hx_get":f"/chat_message/{msg_idx}"}
     return Div(Div(msg['role'], cls="chat-header"),
-               Div(text, cls=f"chat-bubble {bubble_class} whitespace-pre-wrap"),
-               cls=f"chat {chat_class}", id=f"chat-message-{msg_idx}",
-               **stream_args if generating else {})
+               Div(msg['content'], cls=f"chat-bubble {bubble_class} whitespace-pre-wrap", id=f"chat-text-{msg['message']}"),
+               ChatPoller(msg['message'], cursor) if not msg['done'] else "",
+               cls=f"chat {chat_class}", id=f"chat-message-{msg['message']}")
 
-# Route that gets polled while streaming
-@app.get("/chat_message/{msg_idx}")
-def get_chat_message(msg_idx:int):
-    if msg_idx >= len(messages): return ""
-    return ChatMessage(msg_idx)
+# Route that gets polled while streaming, only reads the entries newer than the cursor
+@app.get("/chat_message/{message}")
+def get_chat_message(message:str, after:str, session):
+    entries, cursor = log.tail(conversation_id(session), after=after)
+    entries = [entry for entry in entries if str(entry.message) == message]
+    text = "".join(entry.content or "" for entry in entries)
+    done = any(entry.done for entry in entries)
+    return (Span(text, hx_swap_oob=f"beforeend:#chat-text-{message}") if text else "",
+            ChatPoller(message, cursor) if not done else "")
 
 # The input field for the user message. Also used to clear the
 # input field after sending a message via an OOB swap
@@ -40,9 +65,10 @@ def ChatInput():
 
 # The main screen
 @app.route("/")
-def get():
+def get(session):
+    entries, cursor = log.tail(conversation_id(session))
     page = Body(H1('Chatbot Demo'),
-                Div(*[ChatMessage(msg) for msg in messages],
+                Div(*[ChatMessage(msg, cursor) for msg in merge_entries(entries)],
                     id="chatlist", cls="chat-box h-[73vh] overflow-y-auto"),
                 Form(Group(ChatInput(), Button("Send", cls="btn btn-primary")),
                      hx_post="/", hx_target="#chatlist", hx_swap="beforeend",
@@ -50,27 +76,25 @@ def get():
                      ), cls="p-4 max-w-lg mx-auto")
     return Title('Chatbot Demo'), page
 
-# Run the chat model in a separate thread
+# Run the chat model in a separate thread, chunks are appended to the log in batches
 @threaded
-def get_response(r, idx):
-    for chunk in r:
-        messages[idx]["content"] += chunk
-    messages[idx]["generating"] = False
+def get_response(r, conversation, message):
+    log.stream(conversation, "assistant", r, message=message)
 
 
 manager = AssistantManager(instructions=sp, model="gpt-4o-mini", tools=[])
 
 # Handle the form submission
 @app.post("/")
-def post(msg:str):
-    idx = len(messages)
-    messages.append({"role":"user", "content":msg})
+def post(msg:str, session):
+    conversation = conversation_id(session)
+    user_message = log.append(conversation, "user", msg)
     r = manager.stream_thread(content=msg, tool=None) # Send message to chat model (with streaming)
-    messages.append({"role":"assistant", "generating":True, "content":""}) # Response initially blank
-    get_response(r, idx+1) # Start a new thread to fill in content
-    return (ChatMessage(idx), # The user's message
-            ChatMessage(idx+1), # The chatbot's response
+    message = uuid.uuid1() # Response initially blank
+    get_response(r, conversation, message) # Start a new thread to fill in content
+    return (ChatMessage({"message": user_message, "role": "user", "content": msg, "done": True}), # The user's message
+            ChatMessage({"message": message, "role": "assistant", "content": "", "done": False}, str(user_message)), # The chatbot's response
             ChatInput()) # And clear the input field via an OOB swap
 
 
-serve()
\ No newline at end of file
+serve()
@@ -6,6 +6,7 @@ from fastcore.basics import patch
 from fasthtml import *
 from fasthtml.fastapp import serve
 
+from fastastra.asgi import FastAstra
 from fastastra.fastastra import AstraDatabase
 
 dotenv.load_dotenv("./.env")
@@ -22,6 +23,8 @@ if todos not in db.t:
 if not todos.c.embeddings.indexed:
     todos.c.embeddings.index()
 Todo = todos.dataclass()
+# prepares the todos statements and opens the embedding client before the app reports ready
+astra = FastAstra(db=db, tables=["todos"], warm_embeddings=True)
 
 id_curr = 'current-todo'
 
@@ -30,9 +33,10 @@ def tid(id): return f'todo-{id}'
 
 
 css = Style(':root { --pico-font-size: 100%; }')
-auth = user_pwd_auth(user='s3kret', skip=[r'/favicon\.ico', r'/static/.*', r'.*\.css'])
-app = FastHTML(hdrs=(picolink, css), middleware=[auth])
+auth = user_pwd_auth(user='s3kret', skip=[r'/favicon\.ico', r'/static/.*', r'.*\.css', r'/health'])
+app = FastHTML(hdrs=(picolink, css), middleware=[auth], lifespan=astra.lifespan)
 rt = app.route
+rt("/health")(astra.health)
 
 
 @rt("/{fname:path}.{ext:static}")
@@ -59,6 +63,13 @@ def clr_details():
     return Div(hx_swap_oob='innerHTML', id=id_curr)
 
 
+def todo_page(cursor=None):
+    page, next_cursor = todos.page(20, cursor)
+    # the "more" item replaces itself with the next page
+    more = Li(Button("More"), hx_get=f"/todos?cursor={next_cursor}", hx_swap="outerHTML") if next_cursor else ''
+    return *page, more
+
+
 @rt("/")
 async def get(request):
     search = Form(
@@ -69,11 +80,16 @@ async def get(request):
     ),
     add = Form(Group(mk_input(), Button("Add")),
                hx_post="/", target_id='todo-list', hx_swap="beforeend")
-    card = Card(Ol(*todos(), id='todo-list'),
+    card = Card(Ol(*todo_page(), id='todo-list'),
                 header=add, footer=Div(id=id_curr)),
     return Titled('Todo list', search, card)
 
 
+@rt("/todos")
+async def get(cursor: str = None):
+    return todo_page(cursor)
+
+
 @rt("/todos/{id}")
 async def delete(id: str):
     todos.delete(id)
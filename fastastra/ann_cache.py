@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class _Entry:
+    def __init__(self, group: Hashable, vector: np.ndarray, rows: List[Dict[str, Any]], expires: float):
+        self.group = group
+        self.vector = vector
+        self.rows = rows
+        self.expires = expires
+
+
+class SemanticCache:
+    # ann results keyed by (table, filter args, query vector). A lookup hits when a cached query vector of the same
+    # table and filters is within max_distance cosine distance of the new one
+    def __init__(self, max_distance: float = 0.05, ttl: float = 300.0, max_entries: int = 1024):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # least recently used first, shared by every group so max_entries bounds the whole cache
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # per group entry ids and their stacked normalized vectors, rebuilt lazily after changes
+        self._groups: Dict[Hashable, List[int]] = {}
+        self._matrices: Dict[Hashable, np.ndarray] = {}
+        # text -> embedding so repeated query texts skip the provider
+        self._embeddings: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        # bumped by every write to a table, results read before a write are not stored after it
+        self._generations: Dict[str, int] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _group(self, table: str, filters: Dict[str, Any]) -> Hashable:
+        return table, tuple(sorted((column, repr(value)) for column, value in filters.items()))
+
+    def _normalize(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._groups[entry.group]
+        ids.remove(entry_id)
+        if not ids:
+            del self._groups[entry.group]
+        self._matrices.pop(entry.group, None)
+
+    def get(self, table: str, filters: Dict[str, Any], vector) -> Optional[List[Dict[str, Any]]]:
+        group = self._group(table, filters)
+        query = self._normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            ids = self._groups.get(group)
+            if ids:
+                for entry_id in [entry_id for entry_id in ids if self._entries[entry_id].expires <= now]:
+                    self._remove(entry_id)
+                ids = self._groups.get(group)
+            if not ids:
+                self.misses += 1
+                return None
+            matrix = self._matrices.get(group)
+            if matrix is None:
+                matrix = np.stack([self._entries[entry_id].vector for entry_id in ids])
+                self._matrices[group] = matrix
+            distances = 1.0 - matrix @ query
+            nearest = int(np.argmin(distances))
+            if distances[nearest] > self.max_distance:
+                self.misses += 1
+                return None
+            entry_id = ids[nearest]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id].rows
+
+    def generation(self, table: str) -> int:
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def put(self, table: str, filters: Dict[str, Any], vector, rows: List[Dict[str, Any]], generation: int = None):
+        group = self._group(table, filters)
+        with self._lock:
+            if generation is not None and generation != self._generations.get(table, 0):
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(group, self._normalize(vector), rows, time.monotonic() + self.ttl)
+            self._groups.setdefault(group, []).append(entry_id)
+            self._matrices.pop(group, None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, table: str):
+        # any write can change a table's top-k, so every entry for the table goes
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry.group[0] == table]:
+                self._remove(entry_id)
+
+    def get_embedding(self, model: str, text: str) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._embeddings.get((model, text))
+            if embedding is not None:
+                self._embeddings.move_to_end((model, text))
+            return embedding
+
+    def put_embedding(self, model: str, text: str, embedding: List[float]):
+        with self._lock:
+            self._embeddings[(model, text)] = embedding
+            while len(self._embeddings) > self.max_entries:
+                self._embeddings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._matrices.clear()
+            self._embeddings.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+from loguru import logger
+from starlette.responses import JSONResponse
+
+from fastastra.fastastra import AstraDatabase, Table, ai_client_cache
+
+
+class FastAstra:
+    # lifespan for FastHTML / Starlette apps: connects, loads the schema of the declared tables, prepares their
+    # statements and optionally warms the embedding client before the app reports ready, closes the database on shutdown
+    def __init__(self, token: str = None, dbid: str = None, tables: List[str] = (), warm_embeddings: bool = False, db: AstraDatabase = None, **db_kwargs):
+        if db is None and token is None:
+            raise ValueError("FastAstra needs a token or an AstraDatabase")
+        self.token = token
+        self.dbid = dbid
+        self.table_names = list(tables)
+        # makes one embedding call at startup so the provider client is imported and its connection is open
+        self.warm_embeddings = warm_embeddings
+        self.db_kwargs = db_kwargs
+        self.db = db
+        self.ready = False
+
+    def table(self, table_name) -> Table:
+        return self.db.table(table_name)
+
+    def startup(self):
+        started = time.time()
+        if self.db is None:
+            self.db = AstraDatabase(self.token, self.dbid, **self.db_kwargs)
+        prepared = 0
+        for table_name in self.table_names:
+            table = self.db.table(table_name)
+            if not table.columns:
+                logger.warning(f"table {table_name} does not exist, skipping warm up")
+                continue
+            prepared += table.warm()
+        if self.warm_embeddings and self.db.embedding_model:
+            ai_client_cache.get_client()
+            self.db.embed("warm up")
+        self.ready = True
+        logger.info(f"ready in {time.time() - started:.1f}s, {len(self.table_names)} tables and {prepared} statements prepared")
+
+    def shutdown(self):
+        self.ready = False
+        if self.db is not None:
+            self.db.close()
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        await asyncio.to_thread(self.startup)
+        app.state.db = self.db
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.shutdown)
+
+    async def health(self, request=None):
+        # readiness probe, 503 until startup finished and again once shutdown started
+        return JSONResponse({"ready": self.ready}, status_code=200 if self.ready else 503)
@@ -0,0 +1,366 @@
+import base64
+import csv
+import datetime
+import decimal
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List
+
+from cassandra import util
+from cassandra.cqltypes import cqltype_to_python
+from loguru import logger
+
+from datastore.cassandra_util import CassandraType
+from datastore.lazy_vector import LazyVector
+from datastore.simple_cassandra_datastore import DEFAULT_PAGE_SIZE
+
+FORMATS = ("parquet", "ndjson", "csv")
+PROGRESS_LOG_INTERVAL = 10
+COLLECTION_TYPES = (list, tuple, dict, set, frozenset, util.SortedSet, util.OrderedMap, util.OrderedMapSerializedKey)
+
+
+def _to_python(value):
+    # the driver returns its own Date / Time wrappers and sorted sets, normalize them for the writers
+    if isinstance(value, util.Date):
+        return value.date()
+    if isinstance(value, util.Time):
+        return value.time()
+    if isinstance(value, (set, frozenset, util.SortedSet)):
+        return [_to_python(v) for v in value]
+    if isinstance(value, (dict, util.OrderedMap, util.OrderedMapSerializedKey)):
+        return {k: _to_python(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_python(v) for v in value]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, LazyVector):
+        return value.tolist()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, COLLECTION_TYPES + (util.Date, util.Time)):
+        return _to_python(value)
+    return str(value)
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, LazyVector):
+        value = value.tolist()
+    if isinstance(value, COLLECTION_TYPES):
+        return json.dumps(_to_python(value), default=_json_default)
+    return _json_default(value)
+
+
+def _arrow_type(pa, type_str):
+    python_type = cqltype_to_python(type_str)
+    if python_type[0] == "frozen":
+        python_type = python_type[1]
+    if python_type[0] == CassandraType.VECTOR.value:
+        return pa.list_(pa.float32(), int(python_type[1][1]))
+    if len(python_type) > 1:
+        # other collections are written as json text
+        return pa.string()
+    return {
+        CassandraType.BIGINT.value: pa.int64(),
+        CassandraType.BLOB.value: pa.binary(),
+        CassandraType.BOOLEAN.value: pa.bool_(),
+        CassandraType.COUNTER.value: pa.int64(),
+        CassandraType.DATE.value: pa.date32(),
+        CassandraType.DECIMAL.value: pa.float64(),
+        CassandraType.DOUBLE.value: pa.float64(),
+        CassandraType.FLOAT.value: pa.float32(),
+        CassandraType.INT.value: pa.int32(),
+        CassandraType.SMALLINT.value: pa.int16(),
+        CassandraType.TIME.value: pa.time64("ns"),
+        CassandraType.TIMESTAMP.value: pa.timestamp("ms"),
+        CassandraType.TINYINT.value: pa.int8(),
+        CassandraType.VARINT.value: pa.int64(),
+    }.get(python_type[0], pa.string())
+
+
+def csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (int, float, bool)):
+        return value
+    return _text(value)
+
+
+def json_line(row: Dict[str, Any]) -> str:
+    return json.dumps(row, default=_json_default) + "\n"
+
+
+class NDJSONWriter:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.file.write("".join(json_line({c: row.get(c) for c in self.columns}) for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class CSVWriter:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.writer.writerows([csv_cell(row.get(c)) for c in self.columns] for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path, columns, raw_columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("parquet export requires pyarrow, install it with `pip install pyarrow`")
+        self.pa = pa
+        self.columns = columns
+        types = {column["column_name"]: column["type"] for column in raw_columns}
+        self.schema = pa.schema([(c, _arrow_type(pa, types[c])) for c in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def _column(self, name, values):
+        arrow_type = self.schema.field(name).type
+        if arrow_type == self.pa.string():
+            values = [_text(v) for v in values]
+        elif arrow_type == self.pa.float64():
+            values = [None if v is None else float(v) for v in values]
+        else:
+            values = [_to_python(v) for v in values]
+        return self.pa.array(values, type=arrow_type)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        arrays = [self._column(c, [row.get(c) for row in rows]) for c in self.columns]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def make_writer(path, format, columns, raw_columns):
+    if format == "ndjson":
+        return NDJSONWriter(path, columns)
+    if format == "csv":
+        return CSVWriter(path, columns)
+    if format == "parquet":
+        return ParquetWriter(path, columns, raw_columns)
+    raise ValueError(f"Unsupported format {format}, expected one of {FORMATS}")
+
+
+def export_rows(rows: Iterable[Dict[str, Any]], path, format, columns, raw_columns, batch_size=DEFAULT_PAGE_SIZE, progress=None) -> int:
+    # rows are written a batch at a time so memory stays bounded by batch_size whatever the table size.
+    # progress(rows_written, elapsed_seconds) is called after every batch
+    writer = make_writer(path, format, columns, raw_columns)
+    started = time.time()
+    last_log = started
+    written = 0
+    batch = []
+
+    def flush():
+        nonlocal written, last_log
+        writer.write(batch)
+        written += len(batch)
+        batch.clear()
+        now = time.time()
+        if progress is not None:
+            progress(written, now - started)
+        if now - last_log >= PROGRESS_LOG_INTERVAL:
+            logger.info(f"exported {written} rows to {path} ({written / (now - started):.0f} rows/s)")
+            last_log = now
+
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        writer.close()
+    elapsed = time.time() - started
+    logger.info(f"exported {written} rows to {path} in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} rows/s)")
+    return written
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "y", "t")
+    return bool(value)
+
+
+def _coerce(value, python_type):
+    if value is None or value == "":
+        return None
+    kind = python_type[0]
+    if kind == "frozen":
+        return _coerce(value, python_type[1])
+    if kind == CassandraType.VECTOR.value:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                # plain text, embedded by the loader
+                return value
+            if isinstance(value, str):
+                return value
+        return [float(v) for v in value]
+    if kind in (CassandraType.LIST.value, CassandraType.SET.value, CassandraType.MAP.value):
+        if isinstance(value, str):
+            value = json.loads(value)
+        inner = [t if isinstance(t, list) else cqltype_to_python(t) for t in python_type[1]]
+        if kind == CassandraType.MAP.value:
+            return {_coerce(k, inner[0]): _coerce(v, inner[1]) for k, v in value.items()}
+        values = [_coerce(v, inner[0]) for v in value]
+        return set(values) if kind == CassandraType.SET.value else values
+    if kind in (CassandraType.UUID.value, CassandraType.TIMEUUID.value):
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    if kind in (CassandraType.INT.value, CassandraType.BIGINT.value, CassandraType.SMALLINT.value,
+                CassandraType.TINYINT.value, CassandraType.VARINT.value, CassandraType.COUNTER.value):
+        return int(value)
+    if kind in (CassandraType.FLOAT.value, CassandraType.DOUBLE.value):
+        return float(value)
+    if kind == CassandraType.DECIMAL.value:
+        return decimal.Decimal(str(value))
+    if kind == CassandraType.BOOLEAN.value:
+        return _parse_bool(value)
+    if kind == CassandraType.TIMESTAMP.value:
+        return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+    if kind == CassandraType.DATE.value:
+        return datetime.date.fromisoformat(value) if isinstance(value, str) else value
+    if kind == CassandraType.TIME.value:
+        return datetime.time.fromisoformat(value) if isinstance(value, str) else value
+    if kind == CassandraType.BLOB.value:
+        return base64.b64decode(value) if isinstance(value, str) else value
+    if kind in (CassandraType.TEXT.value, CassandraType.VARCHAR.value, CassandraType.ASCII.value, CassandraType.INET.value):
+        return value if isinstance(value, str) else str(value)
+    return value
+
+
+def coerce_record(record: Dict[str, Any], types: Dict[str, str]) -> Dict[str, Any]:
+    # maps a record read from disk onto the table's cql types, columns the table doesn't have are ignored
+    return {column: _coerce(record[column], cqltype_to_python(type_str)) for column, type_str in types.items() if column in record}
+
+
+def _read_ndjson(path) -> Iterator[Dict[str, Any]]:
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b""):
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_csv(path) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def read_batches(path, format, batch_size=DEFAULT_PAGE_SIZE, offset=0) -> Iterator[List[Dict[str, Any]]]:
+    # yields lists of records, skipping the first offset records
+    if format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("parquet loading requires pyarrow, install it with `pip install pyarrow`")
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            if offset >= record_batch.num_rows:
+                offset -= record_batch.num_rows
+                continue
+            yield record_batch.slice(offset).to_pylist()
+            offset = 0
+        return
+    if format == "ndjson":
+        records = _read_ndjson(path)
+    elif format == "csv":
+        records = _read_csv(path)
+    else:
+        raise ValueError(f"Unsupported format {format}, expected one of {FORMATS}")
+    batch = []
+    for i, record in enumerate(records):
+        if i < offset:
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable: Iterable[Any], size: int = 2) -> Iterator[Any]:
+    # produces items on a background thread so reading and embedding overlap with writes
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def read_checkpoint(checkpoint, path) -> int:
+    if not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("path") != os.path.abspath(path):
+        raise ValueError(f"Checkpoint {checkpoint} belongs to {state.get('path')}, not {path}")
+    return state["offset"]
+
+
+def write_checkpoint(checkpoint, path, offset):
+    tmp = f"{checkpoint}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"path": os.path.abspath(path), "offset": offset}, f)
+    os.replace(tmp, checkpoint)
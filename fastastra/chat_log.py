@@ -0,0 +1,103 @@
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+
+from fastastra.schema import TableSpec
+
+# streamed chunks are written once this many are pending or flush_interval seconds passed since the last write
+DEFAULT_MAX_CHUNKS = 50
+DEFAULT_FLUSH_INTERVAL = 0.2
+COLUMNS = ["conversation", "id", "message", "role", "content", "done"]
+
+
+class ConversationLog:
+    # append only chat history, one partition per conversation clustered by timeuuid. Every row is an entry: a
+    # whole message or one streamed chunk of it, entries of a message share its message id and the last one is
+    # done. tail() reads the entries after a cursor with a clustering range query, so polling costs the new
+    # entries and not the whole history
+    def __init__(self, db, name: str = "conversation_log", max_chunks: int = DEFAULT_MAX_CHUNKS,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, create: bool = True):
+        self.db = db
+        self.name = name
+        self.max_chunks = max_chunks
+        self.flush_interval = flush_interval
+        if create:
+            db.sync_schema([self.spec(name)])
+        self.table = db.table(name)
+
+    @staticmethod
+    def spec(name: str) -> TableSpec:
+        return TableSpec.define(
+            name,
+            conversation=str,
+            id=uuid.uuid1,
+            message=uuid.uuid1,
+            role=str,
+            content=str,
+            done=bool,
+            partition_keys="conversation",
+            clustering_columns="id",
+        )
+
+    def append(self, conversation: str, role: str, content: str) -> uuid.UUID:
+        # a complete message in one entry, returns its message id
+        message = uuid.uuid1()
+        self._write([(conversation, message, message, role, content, True)])
+        return message
+
+    def stream(self, conversation: str, role: str, chunks: Iterable[str], message: uuid.UUID = None) -> uuid.UUID:
+        # appends chunks as they arrive, buffered into one unlogged single partition batch per max_chunks chunks or
+        # flush_interval seconds, then a done entry. Pass message to hand out the id before the stream starts
+        message = message or uuid.uuid1()
+        pending = []
+        flushed = time.monotonic()
+        for chunk in chunks:
+            if chunk:
+                pending.append(chunk)
+            if len(pending) >= self.max_chunks or (pending and time.monotonic() - flushed >= self.flush_interval):
+                self._write_chunks(conversation, message, role, pending)
+                pending = []
+                flushed = time.monotonic()
+        self._write_chunks(conversation, message, role, pending, done=True)
+        return message
+
+    def _write_chunks(self, conversation, message, role, chunks: List[str], done: bool = False):
+        # entry ids are taken when the batch is written, not when the chunks arrived. An id older than entries
+        # other writers stored in the meantime would land behind a tail cursor that already moved past it
+        rows = [(conversation, uuid.uuid1(), message, role, chunk, False) for chunk in chunks]
+        if done:
+            rows.append((conversation, uuid.uuid1(), message, role, "", True))
+        self._write(rows)
+
+    def _write(self, rows: List[Tuple]):
+        self.db.client.insert_batch(self.db.keyspace, self.name, COLUMNS, rows)
+
+    def tail(self, conversation: str, after: str | uuid.UUID = None, limit: int = None) -> Tuple[List[Any], str]:
+        # entries newer than the cursor, oldest first, and the cursor to pass next time. A None cursor reads from
+        # the start and the cursor stays put when nothing is new
+        predicates = {}
+        if after is not None:
+            predicates["id__gt"] = after if isinstance(after, uuid.UUID) else uuid.UUID(after)
+        entries = self.table.rows_where(conversation, limit=limit, **predicates)
+        cursor = str(entries[-1].id) if entries else (str(after) if after is not None else None)
+        return entries, cursor
+
+    def messages(self, conversation: str, after: str | uuid.UUID = None) -> List[Dict[str, Any]]:
+        # entries merged into messages, in the order they started
+        entries, _ = self.tail(conversation, after)
+        return merge_entries(entries)
+
+
+def merge_entries(entries: Iterable[Any], messages: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    # folds entries into {"message", "role", "content", "done"} dicts, pass the previous result to extend it
+    messages = messages if messages is not None else []
+    by_id = {message["message"]: message for message in messages}
+    for entry in entries:
+        message = by_id.get(entry.message)
+        if message is None:
+            message = {"message": entry.message, "role": entry.role, "content": "", "done": False}
+            by_id[entry.message] = message
+            messages.append(message)
+        message["content"] += entry.content or ""
+        message["done"] = message["done"] or bool(entry.done)
+    return messages
@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import hmac
+import json
+from typing import Optional
+
+
+# cursors are base64url(json) + "." + base64url(hmac), bound to the query they came from so they can't be
+# edited or replayed against another query
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def derive_cursor_secret(token: str) -> bytes:
+    return hmac.new(token.encode(), b"fastastra cursor", hashlib.sha256).digest()
+
+
+def query_shape(*parts) -> str:
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def _sign(payload: bytes, secret: bytes) -> bytes:
+    return hmac.new(secret, payload, hashlib.sha256).digest()[:16]
+
+
+def encode_cursor(paging_state: Optional[bytes], shape: str, secret: bytes) -> Optional[str]:
+    # None once the last page was read
+    if paging_state is None:
+        return None
+    payload = json.dumps({"p": _b64encode(paging_state), "q": shape}, separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload, secret))}"
+
+
+def decode_cursor(cursor: str, shape: str, secret: bytes) -> bytes:
+    try:
+        encoded_payload, encoded_signature = cursor.split(".")
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        raise ValueError("Invalid cursor signature")
+    data = json.loads(payload)
+    if data["q"] != shape:
+        raise ValueError("Cursor belongs to a different query")
+    return _b64decode(data["p"])
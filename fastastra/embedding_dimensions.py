@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+from typing import Optional
+
+# output dimensions of common embedding models, so startup never has to call the provider to find out
+KNOWN_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+    "embed-english-v3.0": 1024,
+    "embed-multilingual-v3.0": 1024,
+    "embed-english-light-v3.0": 384,
+    "embed-multilingual-light-v3.0": 384,
+    "voyage-3": 1024,
+    "voyage-3-lite": 512,
+    "mistral-embed": 1024,
+    "text-embedding-004": 768,
+    "nomic-embed-text": 768,
+    "all-MiniLM-L6-v2": 384,
+}
+
+CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "fastastra",
+    "embedding_dimensions.json",
+)
+
+
+# the cache file is read once per process, it only changes when a new model or dimension is seen
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _read_cache():
+    try:
+        with open(CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _cached():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _read_cache()
+    return _cache
+
+
+def get_embedding_dimensions(model: str) -> Optional[int]:
+    if model is None:
+        return None
+    if model in KNOWN_EMBEDDING_DIMENSIONS:
+        return KNOWN_EMBEDDING_DIMENSIONS[model]
+    # the provider prefix (e.g. openai/text-embedding-3-small) doesn't change the dimensions
+    name = model.rsplit("/", 1)[-1]
+    if name in KNOWN_EMBEDDING_DIMENSIONS:
+        return KNOWN_EMBEDDING_DIMENSIONS[name]
+    return _cached().get(model)
+
+
+def remember_embedding_dimensions(model: str, dimensions: int):
+    # dimensions seen on real embedding calls are persisted so later processes know them without probing. The
+    # file is only touched for a model or dimension this process has not seen, merged with what other processes
+    # wrote since it was read
+    global _cache
+    if model is None or get_embedding_dimensions(model) == dimensions:
+        return
+    with _cache_lock:
+        cache = _read_cache()
+        cache[model] = dimensions
+        _cache = cache
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            tmp = f"{CACHE_PATH}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp, CACHE_PATH)
+        except OSError:
+            pass
+
@@ -1,18 +1,36 @@
+import asyncio
 import dataclasses
+import heapq
+import os
 import time
 import uuid
 from dataclasses import make_dataclass, field
 from typing import Dict, Tuple, Any, Optional, List, Iterator
 
-from openai import OpenAI
+from loguru import logger
 from pydantic import BaseModel, create_model
-from agentd.patch import patch_openai_with_mcp
 
-from datastore.cassandra_util import get_pydantic_type, python_to_cassandra, CassandraType, DDLModel, CassandraColumn
-from datastore.simple_cassandra_datastore import CassandraDataStore
+from datastore.cassandra_util import get_pydantic_type, CassandraType
+from datastore.latency import LatencyPolicy, POINT_READ, SCAN
+from datastore.connection_options import ConnectionOptions
+from datastore.simple_cassandra_datastore import CassandraDataStore, DEFAULT_PAGE_SIZE, SCORE_COLUMN
+from datastore.singleflight import SingleFlight
+from fastastra.bulk_io import export_rows, coerce_record, read_batches, prefetch, read_checkpoint, write_checkpoint
+from fastastra.write_behind import WriteBehindBuffer
+from fastastra.ann_cache import SemanticCache
+from fastastra.vector_mirror import VectorMirror, DEFAULT_SNAPSHOT_MAX_AGE
+from fastastra.chat_log import ConversationLog
+from fastastra.kv import KVStore
+from fastastra.cursor import derive_cursor_secret, encode_cursor, decode_cursor, query_shape
+from fastastra.schema import TableSpec, IndexBuild, index_ddl, plan_schema
+from fastastra.embedding_dimensions import get_embedding_dimensions, remember_embedding_dimensions
 
 
 
+RANGE_OPERATORS = {"lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+# seconds a query waits for an index created through Column.index() to finish building
+INDEX_BUILD_WAIT = 30.0
+
 class LoginPayload(BaseModel):
     db_id: str
 
@@ -24,10 +42,25 @@ class ai_client_cache:
 
     def get_client(self):
         if self.client is None:
+            # the provider stack is heavy to import, so it is only loaded on first embedding use
+            from openai import OpenAI
+            from agentd.patch import patch_openai_with_mcp
             self.client = patch_openai_with_mcp(OpenAI())
         return self.client
 
+    def reset(self):
+        self.client = None
+
 ai_client_cache = ai_client_cache()
+# the http client's connection pool is not safe to share with a forked child, each process builds its own
+os.register_at_fork(after_in_child=ai_client_cache.reset)
+
+def get_embeddings(texts: List[str], model: str) -> List[List[float]]:
+    response = ai_client_cache.get_client().embeddings.create(input=texts, model=model)
+    embeddings = [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+    if embeddings:
+        remember_embedding_dimensions(model, len(embeddings[0]))
+    return embeddings
 
 def get_datastore_from_cache(token) -> CassandraDataStore:
     global datastores
@@ -35,7 +68,7 @@ def get_datastore_from_cache(token) -> CassandraDataStore:
         return datastores[token]
     raise Exception(detail="Must login to a database first")
 
-def db_login(payload: LoginPayload, token: str):
+def db_login(payload: LoginPayload, token: str, latency_policies: Dict[str, LatencyPolicy] = None, connection_options: ConnectionOptions = None):
     global datastores
     datastore = datastores.get(token)
     if datastore is None:
@@ -49,7 +82,7 @@ def db_login(payload: LoginPayload, token: str):
             dbs = [{db.get("info", {}).get("name", "unknown"): db.get("id", "unknown") }for db in response.json()]
             raise ValueError(f'{{"msg": "DBID env var is required. Available databases: {dbs}"}}')
         raise ValueError('{"msg": "db_id is required."}')
-    datastore.setupSession(token, payload.db_id)
+    datastore.setupSession(token, payload.db_id, latency_policies, connection_options)
     datastores[token] = datastore
 
 class Column:
@@ -57,7 +90,6 @@ class Column:
         self.table_name = table_name
         self.column_name = column_name
         self.db = db
-        self.indexed = False
 
     def __str__(self):
         return f'"{self.table_name}"."{self.column_name}"'
@@ -68,9 +100,18 @@ class Column:
     def __iter__(self):
         return iter(self.column_name)
 
-    def index(self):
-        self.db.client.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_{self.column_name}_idx ON {self.db.keyspace}.{self.table_name} ({self.column_name})")
-        self.indexed = True
+    @property
+    def indexed(self) -> bool:
+        return self.column_name in self.db.client.get_index_metadata(self.db.keyspace, self.table_name)
+
+    def index(self, wait: bool = False) -> IndexBuild:
+        # returns once the index exists, the server keeps building it. wait=True blocks until it is queryable
+        self.db.client.execute(index_ddl(self.db.keyspace, self.table_name, self.column_name))
+        build = IndexBuild(self.db.client, self.db.keyspace, self.table_name, self.column_name)
+        self.db.index_builds[(self.table_name, self.column_name)] = build
+        if wait and not build.wait():
+            raise Exception(f"index {build.name} is still building, check build.done before querying it")
+        return build
 
 
 
@@ -99,6 +140,8 @@ class Table:
         self.db = db
         self.table_name = table_name
         self.keyspace = db.keyspace
+        self._write_behind = None
+        self._vector_mirror = None
         self.setup(table_name)
 
 
@@ -148,11 +191,19 @@ class Table:
         indexed_columns = self.db.client.get_indexes(self.keyspace, self.table_name)
 
         self._vector_indexes = []
+        # indexes created through Column.index() whose build isn't done, queries on them wait for it
+        self._building_indexes = {}
         valid_indexed_columns = []
         for indexed_column in indexed_columns:
             col = next((c for c in self.raw_columns if c.get('column_name') == indexed_column), None)
             if col is None:
                 continue
+            build = self.db.index_builds.get((self.table_name, indexed_column))
+            if build is not None:
+                if build.done:
+                    del self.db.index_builds[(self.table_name, indexed_column)]
+                else:
+                    self._building_indexes[indexed_column] = build
             col_type = col.get('type', '')
             if 'vector' in col_type:
                 self._vector_indexes.append(indexed_column)
@@ -176,6 +227,19 @@ class Table:
             keys=keys,
             args=args
         )
+        return self._get_result(item, self._overlay_buffered(rows, args))
+
+    async def get_async(self, item: Any) -> BaseModel|List[BaseModel]:
+        keys, args = self._get_keys_and_args(item)
+        rows = await self.db.client.select_from_table_by_keys_async(
+            keyspace=self.keyspace,
+            table=self.table_name,
+            keys=keys,
+            args=args
+        )
+        return self._get_result(item, self._overlay_buffered(rows, args))
+
+    def _get_result(self, item, rows):
         objs = []
         for row in rows:
             objs.append(self._dataclass(**row))
@@ -187,6 +251,129 @@ class Table:
             return objs
 
     def xtra(self, request_object: any = None, **kwargs):
+        request_dict, is_base_model, keys, args, use_index = self._xtra_args(request_object, kwargs)
+        if use_index:
+            self._wait_for_indexes(args)
+            for name, value in self._xtra_texts(args):
+                args[name] = self.db.embed(value)
+
+            cache_key = self._ann_cache_key(args)
+            if cache_key is not None:
+                generation = self.db.ann_cache.generation(self.table_name)
+                rows = self.db.ann_cache.get(self.table_name, cache_key[1], cache_key[0])
+                if rows is not None:
+                    return self._xtra_result(request_dict, is_base_model, rows)
+
+            rows = self._mirror_search(args)
+            if rows is None:
+                rows = self.db.client.select_from_table_by_index(
+                    keyspace=self.keyspace,
+                    table=self.table_name,
+                    indexed_columns=self._indexed_columns,
+                    vector_indexes=self._vector_indexes,
+                    partition_keys=self.partition_keys,
+                    columns=self.raw_columns,
+                    args=args)
+            if cache_key is not None:
+                self.db.ann_cache.put(self.table_name, cache_key[1], cache_key[0], rows, generation)
+
+        else:
+            rows = self.db.client.select_from_table_by_keys(
+                keyspace=self.keyspace,
+                table=self.table_name,
+                keys=keys,
+                args=args
+            )
+        return self._xtra_result(request_dict, is_base_model, rows)
+
+    async def xtra_async(self, request_object: any = None, **kwargs):
+        request_dict, is_base_model, keys, args, use_index = self._xtra_args(request_object, kwargs)
+        if use_index:
+            await self._wait_for_indexes_async(args)
+            texts = self._xtra_texts(args)
+            embeddings = await asyncio.gather(*[self.db.embed_async(value) for _, value in texts])
+            for (name, _), embedding in zip(texts, embeddings):
+                args[name] = embedding
+
+            cache_key = self._ann_cache_key(args)
+            if cache_key is not None:
+                generation = self.db.ann_cache.generation(self.table_name)
+                rows = self.db.ann_cache.get(self.table_name, cache_key[1], cache_key[0])
+                if rows is not None:
+                    return self._xtra_result(request_dict, is_base_model, rows)
+
+            rows = await asyncio.to_thread(self._mirror_search, args) if self._vector_mirror is not None else None
+            if rows is None:
+                rows = await self.db.client.select_from_table_by_index_async(
+                    keyspace=self.keyspace,
+                    table=self.table_name,
+                    indexed_columns=self._indexed_columns,
+                    vector_indexes=self._vector_indexes,
+                    partition_keys=self.partition_keys,
+                    columns=self.raw_columns,
+                    args=args)
+            if cache_key is not None:
+                self.db.ann_cache.put(self.table_name, cache_key[1], cache_key[0], rows, generation)
+
+        else:
+            rows = await self.db.client.select_from_table_by_keys_async(
+                keyspace=self.keyspace,
+                table=self.table_name,
+                keys=keys,
+                args=args
+            )
+        return self._xtra_result(request_dict, is_base_model, rows)
+
+    def search(
+            self,
+            query: str | List[float],
+            partitions: List[Any],
+            k: int = 10,
+            overfetch: float = 1.0,
+            column: str = None,
+            similarity: str = None,
+            concurrency: int = None,
+    ) -> List[Tuple[Any, float]]:
+        # ann search across many partitions at once, e.g. every workspace of a tenant. Each partition is queried
+        # concurrently for k * overfetch rows (more per partition improves recall) and merged into the global top k.
+        # Returns (row, score) pairs, best first
+        self.setup(self.table_name)
+        if column is None:
+            if len(self._vector_indexes) != 1:
+                raise ValueError(f"{self.table_name} has vector indexes {self._vector_indexes}, pass the column to search")
+            column = self._vector_indexes[0]
+        if similarity is None:
+            similarity = self._similarity(column)
+        self._wait_for_indexes([column])
+        vector = self.db.embed(query) if isinstance(query, str) else query
+        # group by the key columns given so each group shares one prepared statement
+        groups = {}
+        for partition in partitions:
+            keys, args = self._get_keys_and_args(partition)
+            groups.setdefault(tuple(keys), []).append(args)
+        rows = []
+        for keys, args_list in groups.items():
+            rows.extend(self.db.client.select_ann_from_partitions(
+                keyspace=self.keyspace,
+                table=self.table_name,
+                vector_column=column,
+                keys=list(keys),
+                args_list=args_list,
+                vector=vector,
+                columns=self.columns,
+                limit=k,
+                per_partition_limit=max(k, int(k * overfetch)),
+                similarity=similarity,
+                concurrency=concurrency
+            ))
+        rows = heapq.nlargest(k, rows, key=lambda row: row[SCORE_COLUMN])
+        return [(self._dataclass(**{name: value for name, value in row.items() if name != SCORE_COLUMN}), row[SCORE_COLUMN]) for row in rows]
+
+    def _xtra_texts(self, args):
+        # text values for vector columns, embedded before the ann query
+        return [(name, value) for name, value in args.items() if name in self._vector_indexes and isinstance(value, str)]
+
+    def _xtra_args(self, request_object, kwargs):
         self.setup(self.table_name)
         is_base_model = False
         if request_object is None:
@@ -221,31 +408,33 @@ class Table:
                     if arg == column:
                         arg_in_index = True
 
-        rows = None
-        if len(self._indexed_columns) + len(self._vector_indexes) > 0 and arg_in_index:
-            for column in self._vector_indexes:
-                for name, value in args.items():
-                    if name == column and isinstance(value, str):
-                        value = ai_client_cache.get_client().embeddings.create(input=[value], model=self.db.embedding_model)
-                        args[name] = value.data[0].embedding
-
-            rows = self.db.client.select_from_table_by_index(
-                keyspace=self.keyspace,
-                table=self.table_name,
-                indexed_columns=self._indexed_columns,
-                vector_indexes=self._vector_indexes,
-                partition_keys=self.partition_keys,
-                columns=self.raw_columns,
-                args=args)
-
-        else:
-            rows = self.db.client.select_from_table_by_keys(
-                keyspace=self.keyspace,
-                table=self.table_name,
-                keys=keys,
-                args=args
-            )
-
+        use_index = len(self._indexed_columns) + len(self._vector_indexes) > 0 and arg_in_index
+        return request_dict, is_base_model, keys, args, use_index
+
+    def _building(self, columns) -> List[IndexBuild]:
+        builds = [build for column, build in self._building_indexes.items() if column in columns and not build.done]
+        self._building_indexes = {column: build for column, build in self._building_indexes.items() if not build.done}
+        return builds
+
+    def _index_building(self, build: IndexBuild) -> Exception:
+        return Exception(f"index {build.name} on {self.table_name}.{build.column} is still building after {INDEX_BUILD_WAIT:.0f}s, retry once it is queryable")
+
+    def _wait_for_indexes(self, columns):
+        # a query on an index that is still building is rejected by the server, give the build a chance first
+        for build in self._building(columns):
+            logger.warning(f"waiting up to {INDEX_BUILD_WAIT:.0f}s for index {build.name} to finish building")
+            if not build.wait(timeout=INDEX_BUILD_WAIT):
+                raise self._index_building(build)
+
+    async def _wait_for_indexes_async(self, columns):
+        # _wait_for_indexes without blocking the event loop
+        for build in await asyncio.to_thread(self._building, columns):
+            logger.warning(f"waiting up to {INDEX_BUILD_WAIT:.0f}s for index {build.name} to finish building")
+            if not await build.wait_async(timeout=INDEX_BUILD_WAIT):
+                raise self._index_building(build)
+
+    def _xtra_result(self, request_dict, is_base_model, rows):
+        rows = self._overlay_buffered(rows)
         objs = []
         for row in rows:
             if is_base_model:
@@ -293,6 +482,58 @@ class Table:
         args = self._cast_args(args, keys)
         return keys, args
 
+    def _get_delete_keys_and_args(self, item):
+        if isinstance(item, BaseModel):
+            item = item.model_dump()
+        elif dataclasses.is_dataclass(item):
+            item = dataclasses.asdict(item)
+        if not isinstance(item, dict):
+            return self._get_keys_and_args(item)
+        # rows delete by their primary key, the other columns can't be in the WHERE clause
+        keys = self.partition_keys + self.clustering_columns
+        missing = [key for key in keys if item.get(key) is None]
+        if missing:
+            raise Exception(f"delete_many() needs every primary key column of a row, {item} is missing {missing}. Pass a list of key values to delete a partition or a clustering prefix")
+        args = {key: item[key] for key in keys}
+        args = self._cast_args(args, keys)
+        return keys, args
+
+    def _parse_predicates(self, predicates):
+        # turns column__op=value kwargs into (column, operator, value) ranges on clustering columns
+        ranges = []
+        for name, value in predicates.items():
+            column, _, op = name.rpartition("__")
+            if not column or (op not in RANGE_OPERATORS and op != "between"):
+                raise Exception(f"Unsupported predicate {name}, expected <column>__<op> where op is one of {list(RANGE_OPERATORS) + ['between']}")
+            if column not in self.clustering_columns:
+                raise Exception(f"Range predicates are only supported on clustering columns {self.clustering_columns}, got {column}")
+            if op == "between":
+                low, high = value
+                ranges.append((column, ">=", self._cast_args({column: low}, [column])[column]))
+                ranges.append((column, "<=", self._cast_args({column: high}, [column])[column]))
+            else:
+                ranges.append((column, RANGE_OPERATORS[op], self._cast_args({column: value}, [column])[column]))
+        return ranges
+
+    def _parse_order_by(self, order_by):
+        # "ts" sorts ascending, "-ts" descending, a list orders by several clustering columns
+        if order_by is None:
+            return None
+        order = []
+        for name in [order_by] if isinstance(order_by, str) else order_by:
+            column, direction = (name[1:], "DESC") if name.startswith("-") else (name, "ASC")
+            if column not in self.clustering_columns:
+                raise Exception(f"order_by is only supported on clustering columns {self.clustering_columns}, got {column}")
+            order.append((column, direction))
+        return order
+
+    def _split_where(self, where):
+        # where is a dict of column=value equality predicates and column__op=value range predicates
+        keys = [key for key in where if "__" not in key]
+        args = self._cast_args({key: where[key] for key in keys}, keys)
+        ranges = self._parse_predicates({key: value for key, value in where.items() if "__" in key})
+        return keys, args, ranges
+
     def _cast_args(self, args, keys):
         for key in keys:
             for column in self.raw_columns:
@@ -309,6 +550,23 @@ class Table:
     def __call__(self):
         return self.all()
 
+    def warm(self) -> int:
+        # prepares the statements reads, inserts and deletes will use, returns how many were newly prepared.
+        # insert() upserts its model's fields, keys first, while insert_raw binds the table's columns
+        if not self.columns:
+            return 0
+        return self.db.client.prepare_table_statements(self.keyspace, self.table_name, self.columns, self.partition_keys, self.clustering_columns,
+                                                       upsert_columns=list(self._model.model_fields))
+
+    def indexes(self) -> Dict[str, Dict[str, Any]]:
+        # {column: {"name", "kind", "options"}}, options hold the index class, similarity_function, analyzers...
+        return self.db.client.get_index_metadata(self.keyspace, self.table_name)
+
+    def _similarity(self, column) -> str:
+        # similarity function of the column's vector index, cosine is the SAI default
+        options = self.indexes().get(column, {}).get("options", {})
+        return options.get("similarity_function", "cosine").lower()
+
     def exists(self) -> bool:
         tables = self.db.client.get_tables(self.keyspace)
         return self.table_name in tables
@@ -331,14 +589,172 @@ class Table:
         return self._dataclass
 
 
+    def rows_where(
+            self,
+            key: Any = None,
+            order_by: str | List[str] = None,
+            limit: int = None,
+            per_partition_limit: int = None,
+            page_size: int = DEFAULT_PAGE_SIZE,
+            **predicates
+    ) -> List[dataclass]:
+        # a clustering slice filtered, ordered and limited by the server, e.g. the last hour of a device newest first:
+        # readings.rows_where("device-1", ts__gte=an_hour_ago, order_by="-ts", limit=100)
+        keys, args = self._get_keys_and_args(key) if key is not None else ([], {})
+        operation = POINT_READ if all(column in keys for column in self.partition_keys) else SCAN
+        pages = self.db.client.iter_select_from_table(
+            self.keyspace,
+            self.table_name,
+            keys=keys,
+            args=args,
+            ranges=self._parse_predicates(predicates),
+            page_size=page_size,
+            order_by=self._parse_order_by(order_by),
+            limit=limit,
+            per_partition_limit=per_partition_limit,
+            operation=operation
+        )
+        rows = self._overlay_buffered([row for page in pages for row in page])
+        return [self._dataclass(**row) for row in rows]
+
+    def iter_pages(
+            self,
+            page_size: int = DEFAULT_PAGE_SIZE,
+            key: Any = None,
+            order_by: str | List[str] = None,
+            **predicates
+    ) -> Iterator[List[dataclass]]:
+        # lazily yields one page of rows at a time, the source for fastastra.streaming responses
+        keys, args = self._get_keys_and_args(key) if key is not None else ([], {})
+        pages = self.db.client.iter_select_from_table(
+            self.keyspace,
+            self.table_name,
+            keys=keys,
+            args=args,
+            ranges=self._parse_predicates(predicates),
+            page_size=page_size,
+            order_by=self._parse_order_by(order_by),
+            operation=POINT_READ if all(column in keys for column in self.partition_keys) else SCAN
+        )
+        for page in pages:
+            yield [self._dataclass(**row) for row in self._overlay_buffered(page)]
+
+    def page(
+            self,
+            size: int = 20,
+            cursor: str = None,
+            key: Any = None,
+            order_by: str | List[str] = None,
+            **predicates
+    ) -> Tuple[List[dataclass], Optional[str]]:
+        # (rows, next_cursor) resuming from the driver's paging state, next_cursor is None after the last page.
+        # Cursors are url safe and signed, they only work for the query (table, filters, order and size) that made them
+        keys, args = self._get_keys_and_args(key) if key is not None else ([], {})
+        ranges = self._parse_predicates(predicates)
+        order = self._parse_order_by(order_by)
+        shape = query_shape(self.keyspace, self.table_name, keys, args, ranges, order, size)
+        paging_state = decode_cursor(cursor, shape, self.db.cursor_secret) if cursor else None
+        rows, next_paging_state = self.db.client.select_page(
+            self.keyspace,
+            self.table_name,
+            keys=keys,
+            args=args,
+            ranges=ranges,
+            order_by=order,
+            page_size=size,
+            paging_state=paging_state,
+            operation=POINT_READ if all(column in keys for column in self.partition_keys) else SCAN
+        )
+        rows = self._overlay_buffered(rows)
+        return [self._dataclass(**row) for row in rows], encode_cursor(next_paging_state, shape, self.db.cursor_secret)
+
     def all(self) -> List[dataclass]:
         rows = self.db.client.select_all_from_table(self.keyspace, self.table_name)
+        rows = self._overlay_buffered(rows)
         return [self._dataclass(**row) for row in rows]
 
+    def scan(
+            self,
+            parallelism: int = 8,
+            page_size: int = DEFAULT_PAGE_SIZE,
+            columns: List[str] = None,
+            checkpoint: List[Tuple[int, int]] = None,
+            on_range_complete=None,
+            transform=None,
+            processes: int = None,
+    ) -> Iterator[Any]:
+        # full table read split into token ranges that are queried concurrently, rows come back unordered.
+        # transform(rows) -> rows is applied to each page instead of building dataclasses, in a process pool if processes is set
+        rows = self.db.client.scan_table(
+            keyspace=self.keyspace,
+            table=self.table_name,
+            partition_keys=self.partition_keys,
+            columns=columns,
+            parallelism=parallelism,
+            page_size=page_size,
+            checkpoint=checkpoint,
+            on_range_complete=on_range_complete,
+            transform=transform,
+            processes=processes
+        )
+        if transform is not None:
+            yield from rows
+        else:
+            for row in rows:
+                yield self._dataclass(**row)
+
+    def export(
+            self,
+            path: str,
+            format: str = "parquet",
+            columns: List[str] = None,
+            where: Dict[str, Any] = None,
+            parallelism: int = 1,
+            page_size: int = DEFAULT_PAGE_SIZE,
+            progress=None,
+    ) -> int:
+        # streams pages straight into the writer, parallelism > 1 reads token ranges concurrently (unordered).
+        # Filtered exports read their partition with one serial paged query
+        if where and parallelism > 1:
+            raise ValueError("parallelism only applies to whole table exports, a filtered export reads its partition serially")
+        columns = columns or self.columns
+        if where:
+            keys, args, ranges = self._split_where(where)
+            pages = self.db.client.iter_select_from_table(self.keyspace, self.table_name, keys, args, ranges, columns, page_size)
+            rows = (row for page in pages for row in page)
+        elif parallelism > 1:
+            rows = self.db.client.scan_table(
+                keyspace=self.keyspace,
+                table=self.table_name,
+                partition_keys=self.partition_keys,
+                columns=columns,
+                parallelism=parallelism,
+                page_size=page_size
+            )
+        else:
+            pages = self.db.client.iter_select_from_table(self.keyspace, self.table_name, columns=columns, page_size=page_size)
+            rows = (row for page in pages for row in page)
+        return export_rows(rows, path, format, columns, self.raw_columns, batch_size=page_size, progress=progress)
+
+    def count(self, exact: bool = True, parallelism: int = 8) -> int:
+        # exact counts sum COUNT(*) over token ranges, otherwise the partition estimate from stats() is returned
+        if not exact:
+            return self.stats()["partitions"]
+        return self.db.client.count_table(
+            keyspace=self.keyspace,
+            table=self.table_name,
+            partition_keys=self.partition_keys,
+            parallelism=parallelism
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return self.db.client.get_size_estimates(self.keyspace, self.table_name)
+
     def drop(self):
         self.db.client.execute(f"DROP TABLE IF EXISTS {self.keyspace}.{self.table_name}")
+        self._after_write(deleted=[{}])
+        self.db.client.wait_for_schema_agreement()
         self.setup(self.table_name)
-        time.sleep(5)
 
     def create(
             self,
@@ -348,40 +764,9 @@ class Table:
             columns: Dict[str, Any] = None,
             **kwargs
     ):
-        if pk:
-            if partition_keys or clustering_columns:
-                Exception("Cannot provide pk AND partition_keys / clustering_columns. If you provide a pk it will be treated as a single partition_key with no clustering_columns")
-            else:
-                partition_keys = [pk]
-        if not columns:
-            columns={}
-        columns = {**columns, **kwargs}
-        column_list = []
-        if not partition_keys:
-            partition_keys = []
-        if isinstance(partition_keys, str):
-            partition_keys = [partition_keys]
-        if not clustering_columns:
-            clustering_columns = []
-        if isinstance(clustering_columns, str):
-            clustering_columns = [clustering_columns]
-        for column_name, column_type in columns.items():
-            try:
-                cas_col_type = python_to_cassandra(column_type, self.db.embedding_dimensions)
-                column_list.append(CassandraColumn(name=column_name, type=cas_col_type))
-            except Exception as e:
-                print(e)
-                raise e
-        ddl_model = DDLModel(
-            keyspace_name=self.db.keyspace,
-            table_name=self.table_name,
-            columns=column_list,
-            partition_key=partition_keys,
-            clustering_columns=clustering_columns,
-            thoughts=None
-        )
+        spec = TableSpec.define(self.table_name, pk, partition_keys, clustering_columns, columns=columns, **kwargs)
         try:
-            self.db.client.execute(ddl_model.to_string())
+            self.db.client.execute(spec.ddl(self.db.keyspace, self.db.embedding_dimensions))
         except Exception as e:
             print(e)
             raise e
@@ -408,32 +793,135 @@ class Table:
         else:
             raise Exception(f"insert() requires a pydantic model or dataclass object, got {type(request_object).__name__}")
 
-        for key in self.partition_keys:
-            if request_dict[key] is None:
-                for column in self.raw_columns:
-                    if column['column_name'] == key:
-                        if column['type'] == CassandraType.UUID.value:
-                            request_dict[key] = uuid.uuid4()
-                        elif column['type'] == CassandraType.TIMEUUID.value:
-                            request_dict[key] = uuid.uuid1()
-                        else:
-                            raise Exception(f"insert() requires a value for {key}, got {request_object}")
-                        break
+        self._generate_keys(request_dict)
 
         for column in self._vector_indexes:
             for name, value in request_dict.items():
                 if name == column:
                     if isinstance(value, str):
-                        value = ai_client_cache.get_client().embeddings.create(input=[value], model=self.db.embedding_model)
-                        request_dict[name] = value.data[0].embedding
+                        request_dict[name] = get_embeddings([value], self.db.embedding_model)[0]
 
-        self.db.client.upsert_table_from_dict(self.keyspace, self.table_name, request_dict)
+        if self._write_behind is not None:
+            self._write_behind.put(request_dict)
+        else:
+            self.db.client.upsert_table_from_dict(self.keyspace, self.table_name, request_dict)
+        self._after_write(rows=[request_dict], buffered=self._write_behind is not None)
         if is_base_model:
             return self._model(**request_dict)
         else:
             return self._dataclass(**request_dict)
 
 
+    def enable_write_behind(self, max_rows: int = 1000, interval: float = 1.0, concurrency: int = None, on_error=None):
+        # insert / update only buffer the row, writes to the same primary key are coalesced and flushed
+        # in the background every interval seconds or once max_rows rows are buffered
+        self.disable_write_behind()
+        self._write_behind = WriteBehindBuffer(self, max_rows=max_rows, interval=interval, concurrency=concurrency, on_error=on_error)
+
+    def disable_write_behind(self):
+        if self._write_behind is not None:
+            self._write_behind.close()
+            self._write_behind = None
+
+    def flush(self):
+        if self._write_behind is not None:
+            self._write_behind.flush()
+
+    def _overlay_buffered(self, rows, args=None):
+        # reads see buffered writes, with args rows that only exist in the buffer are included too
+        if self._write_behind is None:
+            return rows
+        rows = [self._write_behind.overlay(row) for row in rows]
+        if args is not None:
+            primary_key = self.partition_keys + self.clustering_columns
+            seen = {tuple(row.get(column) for column in primary_key) for row in rows}
+            for row in self._write_behind.matching(args):
+                if tuple(row.get(column) for column in primary_key) not in seen:
+                    rows.append(row)
+        return rows
+
+    def insert_raw(self, row: Dict[str, Any], return_row: bool = False):
+        # skips model validation, copies and embedding: the dict is bound straight into the prepared insert
+        # in column order, so values must already have the right python types
+        if self._write_behind is not None:
+            self._write_behind.put(row)
+        else:
+            self.db.client.insert_into_table(self.keyspace, self.table_name, self.columns, [row.get(column) for column in self.columns])
+        self._after_write(rows=[row], buffered=self._write_behind is not None)
+        if return_row:
+            return self._dataclass(**row)
+
+    def insert_many_raw(self, rows: List[Dict[str, Any]], concurrency: int = None):
+        if self._write_behind is not None:
+            for row in rows:
+                self._write_behind.put(row)
+            self._after_write(rows=rows, buffered=True)
+            return
+        columns = self.columns
+        self.db.client.insert_many_into_table(
+            self.keyspace,
+            self.table_name,
+            columns,
+            [[row.get(column) for column in columns] for row in rows],
+            concurrency=concurrency
+        )
+        self._after_write(rows=rows)
+
+    def _generate_keys(self, row):
+        # uuid and timeuuid partition keys are generated when missing
+        for key in self.partition_keys:
+            if row.get(key) is None:
+                for column in self.raw_columns:
+                    if column['column_name'] == key:
+                        if column['type'] == CassandraType.UUID.value:
+                            row[key] = uuid.uuid4()
+                        elif column['type'] == CassandraType.TIMEUUID.value:
+                            row[key] = uuid.uuid1()
+                        else:
+                            raise Exception(f"insert() requires a value for {key}, got {row}")
+                        break
+        return row
+
+    def load(
+            self,
+            path: str,
+            format: str = None,
+            concurrency: int = None,
+            batch_size: int = DEFAULT_PAGE_SIZE,
+            checkpoint: str = None,
+            progress=None,
+    ) -> int:
+        # the next batch is read, coerced and embedded on a background thread while the current one is written.
+        # checkpoint is a file holding the offset of the last fully written batch, loads resume from it
+        format = format or path.rsplit(".", 1)[-1]
+        offset = read_checkpoint(checkpoint, path) if checkpoint else 0
+        types = {column["column_name"]: column["type"] for column in self.raw_columns}
+        vector_columns = [name for name, type in types.items() if type.startswith(CassandraType.VECTOR.value)]
+
+        def prepare_batch(records):
+            rows = [self._generate_keys(coerce_record(record, types)) for record in records]
+            for column in vector_columns:
+                texts = [(i, row[column]) for i, row in enumerate(rows) if isinstance(row.get(column), str)]
+                if texts:
+                    embeddings = get_embeddings([text for _, text in texts], self.db.embedding_model)
+                    for (i, _), embedding in zip(texts, embeddings):
+                        rows[i][column] = embedding
+            return [[row.get(column) for column in self.columns] for row in rows]
+
+        started = time.time()
+        loaded = offset
+        for values in prefetch(map(prepare_batch, read_batches(path, format, batch_size, offset))):
+            self.db.client.insert_many_into_table(self.keyspace, self.table_name, self.columns, values, concurrency=concurrency)
+            self._after_write(rows=(dict(zip(self.columns, value)) for value in values))
+            loaded += len(values)
+            if checkpoint:
+                write_checkpoint(checkpoint, path, loaded)
+            if progress is not None:
+                progress(loaded, time.time() - started)
+        elapsed = time.time() - started
+        logger.info(f"loaded {loaded - offset} rows into {self.table_name} in {elapsed:.1f}s ({(loaded - offset) / elapsed if elapsed else 0:.0f} rows/s)")
+        return loaded - offset
+
     def update(self, request_object: BaseModel = None, **kwargs):
         return self.insert(request_object, **kwargs)
 
@@ -464,12 +952,118 @@ class Table:
 
         args = self._cast_args(args, keys)
 
+        if self._write_behind is not None:
+            self._write_behind.discard(args)
         self.db.client.delete_from_table_by_keys(
             keyspace=self.keyspace,
             table=self.table_name,
             keys=keys,
             args=args
         )
+        self._after_write(deleted=[args])
+
+
+    def delete_range(self, item: Any, **predicates):
+        # deletes a whole partition (or clustering prefix) when no predicates are given,
+        # otherwise a clustering range e.g. events.delete_range("device-1", ts__lt=cutoff)
+        keys, args = self._get_keys_and_args(item)
+        ranges = self._parse_predicates(predicates)
+        if self._write_behind is not None:
+            # buffered rows in the partition are discarded even if they fall outside the range
+            self._write_behind.discard(args)
+        self.db.client.delete_from_table_by_keys(
+            keyspace=self.keyspace,
+            table=self.table_name,
+            keys=keys,
+            args=args,
+            ranges=ranges
+        )
+        self._after_write(deleted=[args], ranges=ranges)
+
+    def delete_many(self, items: List[Any], concurrency: int = None, **predicates):
+        ranges = self._parse_predicates(predicates)
+        # group by the set of key columns provided so each group shares one prepared statement
+        groups = {}
+        for item in items:
+            keys, args = self._get_delete_keys_and_args(item)
+            if self._write_behind is not None:
+                self._write_behind.discard(args)
+            groups.setdefault(tuple(keys), []).append(args)
+        for keys, args_list in groups.items():
+            self.db.client.delete_many_from_table_by_keys(
+                keyspace=self.keyspace,
+                table=self.table_name,
+                keys=list(keys),
+                args_list=args_list,
+                ranges=ranges,
+                concurrency=concurrency
+            )
+        self._after_write(deleted=[args for args_list in groups.values() for args in args_list], ranges=ranges)
+
+    def _after_write(self, rows=None, deleted=None, ranges=None, buffered=False):
+        # keeps the ann cache and the vector mirror in line with writes made through this table. Buffered writes
+        # invalidate the ann cache when the write-behind buffer flushes them
+        if self.db.ann_cache is not None and not buffered:
+            self.db.ann_cache.invalidate(self.table_name)
+        if self._vector_mirror is not None:
+            for row in rows or []:
+                self._vector_mirror.upsert(row)
+            for args in deleted or []:
+                self._vector_mirror.remove(args, ranges)
+
+    def enable_vector_mirror(
+            self,
+            column: str = None,
+            metric: str = None,
+            snapshot: str = None,
+            hnsw: bool = False,
+            parallelism: int = 8,
+            background: bool = False,
+            snapshot_max_age: float = DEFAULT_SNAPSHOT_MAX_AGE,
+    ) -> VectorMirror:
+        # xtra ann queries on column without other filters are answered from a local copy of the keys and vectors,
+        # rows are then fetched with concurrent point reads. Queries go to the server until the mirror is loaded
+        self.disable_vector_mirror()
+        self.setup(self.table_name)
+        if column is None:
+            if len(self._vector_indexes) != 1:
+                raise ValueError(f"{self.table_name} has vector indexes {self._vector_indexes}, pass the column to mirror")
+            column = self._vector_indexes[0]
+        if metric is None:
+            metric = self._similarity(column)
+        mirror = VectorMirror(self, column, metric=metric, snapshot=snapshot, hnsw=hnsw, parallelism=parallelism, snapshot_max_age=snapshot_max_age)
+        self._vector_mirror = mirror
+        if background:
+            mirror.load_in_background()
+        else:
+            mirror.load()
+        return mirror
+
+    def disable_vector_mirror(self):
+        # saves the snapshot if writes changed the mirror since it was loaded
+        if self._vector_mirror is not None:
+            self._vector_mirror.close()
+            self._vector_mirror = None
+
+    def _mirror_search(self, args):
+        # None when the mirror can't answer the query and it has to go to the server
+        mirror = self._vector_mirror
+        if mirror is None or not mirror.ready or set(args) != {mirror.column} or isinstance(args[mirror.column], str):
+            return None
+        keys = [key for key, _ in mirror.search(args[mirror.column], k=20)]
+        args_list = [dict(zip(mirror.primary_key, key)) for key in keys]
+        results = self.db.client.select_many_from_table_by_keys(self.keyspace, self.table_name, mirror.primary_key, args_list)
+        return [row for rows in results for row in rows]
+
+    def _ann_cache_key(self, args):
+        # the cache covers ann queries on one vector column, the remaining args are filters
+        if self.db.ann_cache is None:
+            return None
+        vector_args = [name for name in args if name in self._vector_indexes]
+        if len(vector_args) != 1:
+            return None
+        name = vector_args[0]
+        return args[name], {column: value for column, value in args.items() if column != name}
 
 
 class DynamicTables:
@@ -495,27 +1089,152 @@ class DynamicTables:
 
 
 class AstraDatabase:
-    def __init__(self, token, dbid, embedding_model:str = None):
+    def __init__(self, token, dbid, embedding_model:str = None, embedding_dimensions: int = None, latency_policies: Dict[str, LatencyPolicy] = None, connection_options: ConnectionOptions = None, cursor_secret: str = None):
         login_payload = None
         if dbid is not None:
             login_payload = LoginPayload(db_id=dbid)
-        db_login(login_payload, token)
+        db_login(login_payload, token, latency_policies, connection_options)
         datastore = get_datastore_from_cache(token)
         self.client = datastore.client
+        self._token = token
+        # signs page() cursors, set it when cursors must stay valid across token rotation
+        self.cursor_secret = cursor_secret.encode() if cursor_secret else derive_cursor_secret(token)
         self.keyspace = "default_keyspace"
         self._tables = []
-        self.embedding_model = None
-        self.embedding_dimensions = None
-        if embedding_model is not None:
-            self.embedding_model = embedding_model
-            value = ai_client_cache.get_client().embeddings.create(input=["test"], model=embedding_model).data[0].embedding
-            if isinstance(value, list):
-                self.embedding_dimensions = len(value)
-            else:
-                raise Exception("Invalid embedding model")
+        self.embedding_model = embedding_model
+        self._embedding_dimensions = embedding_dimensions
+        self.singleflight: SingleFlight = None
+        self.ann_cache: SemanticCache = None
+        # indexes created through Column.index(), by (table, column), until their build is done
+        self.index_builds: Dict[Tuple[str, str], IndexBuild] = {}
+        self._kv_stores: Dict[str, KVStore] = {}
+        self._conversation_logs: Dict[str, ConversationLog] = {}
 
-    def __del__(self):
-        pass
+    @property
+    def embedding_dimensions(self):
+        # explicit argument, then the built-in table of known models, then dimensions seen on earlier embedding calls
+        if self._embedding_dimensions is None:
+            self._embedding_dimensions = get_embedding_dimensions(self.embedding_model)
+        return self._embedding_dimensions
+
+    def enable_coalescing(self):
+        # identical concurrent reads and embedding calls share one backend call, results fan out to every caller
+        self.singleflight = self.client.enable_coalescing()
+        return self
+
+    def disable_coalescing(self):
+        self.singleflight = None
+        self.client.disable_coalescing()
+
+    def enable_lazy_vectors(self):
+        # point, index, ann and search reads return float vectors as LazyVector, decoded only when used
+        self.client.lazy_vectors = True
+
+    def disable_lazy_vectors(self):
+        self.client.lazy_vectors = False
+
+    def enable_ann_cache(self, max_distance: float = 0.05, ttl: float = 300.0, max_entries: int = 1024):
+        # xtra ann results are reused for queries within max_distance cosine distance of a cached query
+        # with the same filters, writes to a table through this process drop its entries
+        self.ann_cache = SemanticCache(max_distance=max_distance, ttl=ttl, max_entries=max_entries)
+        return self.ann_cache
+
+    def disable_ann_cache(self):
+        self.ann_cache = None
+
+    def embed(self, text: str) -> List[float]:
+        embedding = self._cached_embedding(text)
+        if embedding is not None:
+            return embedding
+        if self.singleflight is None:
+            embedding = get_embeddings([text], self.embedding_model)[0]
+        else:
+            embedding = self.singleflight.do(("embedding", self.embedding_model, text), lambda: get_embeddings([text], self.embedding_model)[0])
+        return self._cache_embedding(text, embedding)
+
+    async def embed_async(self, text: str) -> List[float]:
+        embedding = self._cached_embedding(text)
+        if embedding is not None:
+            return embedding
+        # the provider client is synchronous, it runs in a worker thread
+        async def embed():
+            return (await asyncio.to_thread(get_embeddings, [text], self.embedding_model))[0]
+        if self.singleflight is None:
+            embedding = await embed()
+        else:
+            embedding = await self.singleflight.do_async(("embedding", self.embedding_model, text), embed)
+        return self._cache_embedding(text, embedding)
+
+    def _cached_embedding(self, text):
+        if self.ann_cache is None:
+            return None
+        return self.ann_cache.get_embedding(self.embedding_model, text)
+
+    def _cache_embedding(self, text, embedding):
+        if self.ann_cache is not None:
+            self.ann_cache.put_embedding(self.embedding_model, text, embedding)
+        return embedding
+
+    def sync_schema(self, specs: List[TableSpec], dry_run: bool = False) -> List[str]:
+        # creates the missing tables, columns and indexes of the specs and returns the DDL that was run (or would
+        # run with dry_run). Statements run concurrently in two rounds, tables then indexes, each round waits for
+        # schema agreement. Never drops anything
+        live = self.client.get_schema(self.keyspace)
+        table_statements, index_statements = plan_schema(self.keyspace, specs, live, self.embedding_dimensions)
+        if dry_run:
+            return table_statements + index_statements
+        if table_statements:
+            self.client.execute_ddl(table_statements)
+        if index_statements:
+            self.client.execute_ddl(index_statements)
+        if table_statements or index_statements:
+            names = {spec.name for spec in specs}
+            for table in self._tables:
+                if table.table_name in names:
+                    table.setup(table.table_name)
+        return table_statements + index_statements
+
+    def kv(self, name: str, **kwargs) -> KVStore:
+        # ttl'd key value store in its own table, created if missing. One store (and near cache) per name
+        store = self._kv_stores.get(name)
+        if store is None:
+            store = KVStore(self, name, **kwargs)
+            self._kv_stores[name] = store
+        return store
+
+    def conversation_log(self, name: str = "conversation_log", **kwargs) -> ConversationLog:
+        # chat history table with batched appends and incremental tail reads, created if missing. One log per name
+        log = self._conversation_logs.get(name)
+        if log is None:
+            log = ConversationLog(self, name, **kwargs)
+            self._conversation_logs[name] = log
+        return log
+
+    def close(self):
+        # flushes write-behind buffers, saves vector mirror snapshots and releases the connection, shared clusters
+        # shut down with their last user
+        for table in self._tables:
+            table.disable_write_behind()
+            table.disable_vector_mirror()
+        datastore = datastores.get(self._token)
+        if datastore is not None and datastore.client is self.client:
+            del datastores[self._token]
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def table(self, table_name) -> Table:
+        # the table object db.t returns, created and set up once
+        for table in self._tables:
+            if table.table_name == table_name:
+                return table
+        table = Table(self, table_name)
+        self._tables.append(table)
+        return table
 
     @property
     def t(self):
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+
+from fastastra.schema import TableSpec
+
+DEFAULT_NEAR_CACHE_TTL = 1.0
+DEFAULT_NEAR_CACHE_SIZE = 10000
+_MISSING = object()
+
+
+class NearCache:
+    # small lru of recently read or written encoded values that expire after ttl seconds, misses are cached too
+    def __init__(self, ttl: float = DEFAULT_NEAR_CACHE_TTL, max_entries: int = DEFAULT_NEAR_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: float = None):
+        # ttl is the value's own ttl, the entry never outlives it
+        expires = time.monotonic() + (min(self.ttl, ttl) if ttl else self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _encoded(rows: List[Dict[str, Any]]) -> bytes | None:
+    return rows[0]["value"] if rows else None
+
+
+class KVStore:
+    # string keys and ttl'd values in a key / blob table, values are encoded with dumps and decoded with loads
+    # (json by default). Hot keys are answered from a near cache for near_cache_ttl seconds, writes through this
+    # store update it and writes from other processes show up once the cached entry expires
+    def __init__(self, db, name: str, near_cache_ttl: float = DEFAULT_NEAR_CACHE_TTL, near_cache_size: int = DEFAULT_NEAR_CACHE_SIZE,
+                 dumps: Callable[[Any], str | bytes] = json.dumps, loads: Callable[[bytes], Any] = json.loads, create: bool = True):
+        self.db = db
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.near_cache = NearCache(near_cache_ttl, near_cache_size) if near_cache_ttl else None
+        if create:
+            db.sync_schema([self.spec(name)])
+
+    @staticmethod
+    def spec(name: str) -> TableSpec:
+        return TableSpec.define(name, key=str, value=bytes, pk="key")
+
+    def _encode(self, value) -> bytes:
+        encoded = self.dumps(value)
+        return encoded.encode() if isinstance(encoded, str) else encoded
+
+    def _cached(self, key: str) -> bytes | None:
+        # the encoded value, None for a cached miss, _MISSING when not cached
+        if self.near_cache is None:
+            return _MISSING
+        return self.near_cache.get(key)
+
+    def _cache(self, key: str, value: Any, ttl: int = None):
+        if self.near_cache is not None:
+            self.near_cache.put(key, value, ttl)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        encoded = self._cached(key)
+        if encoded is _MISSING:
+            encoded = _encoded(self.db.client.select_from_table_by_keys(self.db.keyspace, self.name, ["key"], {"key": key}))
+            self._cache(key, encoded)
+        return default if encoded is None else self.loads(encoded)
+
+    async def get_async(self, key: str, default: Any = None) -> Any:
+        encoded = self._cached(key)
+        if encoded is _MISSING:
+            encoded = _encoded(await self.db.client.select_from_table_by_keys_async(self.db.keyspace, self.name, ["key"], {"key": key}))
+            self._cache(key, encoded)
+        return default if encoded is None else self.loads(encoded)
+
+    def get_many(self, keys: Iterable[str], concurrency: int = None) -> Dict[str, Any]:
+        # {key: value} for the keys that exist, the ones not in the near cache are read concurrently
+        encoded = {}
+        remote = []
+        for key in dict.fromkeys(keys):
+            encoded[key] = self._cached(key)
+            if encoded[key] is _MISSING:
+                remote.append(key)
+        if remote:
+            results = self.db.client.select_many_from_table_by_keys(self.db.keyspace, self.name, ["key"], [{"key": key} for key in remote], concurrency=concurrency)
+            for key, rows in zip(remote, results):
+                encoded[key] = _encoded(rows)
+                self._cache(key, encoded[key])
+        return {key: self.loads(value) for key, value in encoded.items() if value is not None}
+
+    def set(self, key: str, value: Any, ttl: int = None):
+        # ttl in seconds, None keeps the value until it is overwritten or deleted
+        encoded = self._encode(value)
+        self.db.client.insert_into_table(self.db.keyspace, self.name, ["key", "value"], [key, encoded], ttl=ttl or 0)
+        self._cache(key, encoded, ttl)
+
+    def set_many(self, items: Dict[str, Any], ttl: int = None, concurrency: int = None):
+        rows = [[key, self._encode(value)] for key, value in items.items()]
+        self.db.client.insert_many_into_table(self.db.keyspace, self.name, ["key", "value"], rows, concurrency=concurrency, ttl=ttl or 0)
+        for key, encoded in rows:
+            self._cache(key, encoded, ttl)
+
+    def delete(self, key: str):
+        self.db.client.delete_from_table_by_keys(self.db.keyspace, self.name, ["key"], {"key": key})
+        self._cache(key, None)
+
+    def delete_many(self, keys: Iterable[str], concurrency: int = None):
+        keys = list(keys)
+        self.db.client.delete_many_from_table_by_keys(self.db.keyspace, self.name, ["key"], [{"key": key} for key in keys], concurrency=concurrency)
+        for key in keys:
+            self._cache(key, None)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: str):
+        self.delete(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel, ConfigDict
+
+from datastore.cassandra_util import DDLModel, CassandraColumn, python_to_cassandra
+
+# seconds IndexBuild.wait gives a new index to become queryable
+DEFAULT_INDEX_BUILD_TIMEOUT = 300.0
+# seconds IndexBuild.done reuses the last build state before asking the server again
+INDEX_STATUS_RECHECK = 1.0
+
+
+class TableSpec(BaseModel):
+    # declared shape of a table for db.sync_schema, column types are the python types Table.create takes
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    name: str
+    columns: Dict[str, Any]
+    partition_keys: List[str]
+    clustering_columns: List[str] = []
+    indexes: List[str] = []
+
+    @classmethod
+    def define(
+            cls,
+            name: str,
+            /,
+            pk: str = None,
+            partition_keys: str | List[str] = None,
+            clustering_columns: str | List[str] = None,
+            indexes: str | List[str] = None,
+            columns: Dict[str, Any] = None,
+            **kwargs
+    ) -> "TableSpec":
+        # same arguments as Table.create, plus the columns to index
+        if pk:
+            if partition_keys or clustering_columns:
+                raise ValueError("Cannot provide pk AND partition_keys / clustering_columns. If you provide a pk it will be treated as a single partition_key with no clustering_columns")
+            partition_keys = [pk]
+        return cls(
+            name=name,
+            columns={**(columns or {}), **kwargs},
+            partition_keys=_as_list(partition_keys),
+            clustering_columns=_as_list(clustering_columns),
+            indexes=_as_list(indexes),
+        )
+
+    def cassandra_columns(self, embedding_dimensions: int = None) -> List[CassandraColumn]:
+        return [CassandraColumn(name=name, type=python_to_cassandra(column_type, embedding_dimensions)) for name, column_type in self.columns.items()]
+
+    def ddl(self, keyspace: str, embedding_dimensions: int = None, if_not_exists: bool = False) -> str:
+        ddl_model = DDLModel(
+            keyspace_name=keyspace,
+            table_name=self.name,
+            columns=self.cassandra_columns(embedding_dimensions),
+            partition_key=self.partition_keys,
+            clustering_columns=self.clustering_columns,
+        )
+        return ddl_model.to_string(if_not_exists=if_not_exists)
+
+
+def _as_list(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def _normalize_type(cql_type: str) -> str:
+    return cql_type.replace(" ", "").lower()
+
+
+def index_name(table: str, column: str) -> str:
+    return f"{table}_{column}_idx"
+
+
+def index_ddl(keyspace: str, table: str, column: str) -> str:
+    return f"CREATE INDEX IF NOT EXISTS {index_name(table, column)} ON {keyspace}.{table} ({column})"
+
+
+class IndexBuild:
+    # returned by Column.index(), SAI indexes are built in the background after CREATE INDEX returns. Queries on
+    # the column through xtra and search wait for the build instead of hitting a half built index
+    def __init__(self, client, keyspace: str, table: str, column: str, recheck_interval: float = INDEX_STATUS_RECHECK):
+        self.client = client
+        self.keyspace = keyspace
+        self.table = table
+        self.column = column
+        self.name = index_name(table, column)
+        self.recheck_interval = recheck_interval
+        self._done = False
+        self._checked = None
+
+    def status(self) -> Dict[str, bool]:
+        status = self.client.get_index_status(self.keyspace, self.name)
+        if status is None:
+            # without a build state from the coordinator all we know is that the index exists
+            status = {"queryable": True, "building": False}
+        self._done = status["queryable"] and not status["building"]
+        self._checked = time.monotonic()
+        return status
+
+    @property
+    def done(self) -> bool:
+        # a finished build is never checked again, a running one at most every recheck_interval seconds
+        if not self._done and (self._checked is None or time.monotonic() - self._checked >= self.recheck_interval):
+            self.status()
+        return self._done
+
+    def wait(self, timeout: float = DEFAULT_INDEX_BUILD_TIMEOUT, interval: float = 1.0) -> bool:
+        # True once the index is queryable, False if timeout seconds passed first, None waits forever
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done:
+            self.status()
+            if self._done:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    async def wait_async(self, timeout: float = DEFAULT_INDEX_BUILD_TIMEOUT, interval: float = 1.0) -> bool:
+        # wait() for event loops, status queries run on a worker thread
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done:
+            await asyncio.to_thread(self.status)
+            if self._done:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+    def __repr__(self):
+        return f"<IndexBuild {self.name} {'done' if self._done else 'building'}>"
+
+
+def plan_schema(keyspace: str, specs: List[TableSpec], live: Dict[str, Dict[str, Any]], embedding_dimensions: int = None) -> Tuple[List[str], List[str]]:
+    # diffs the specs against the live schema (CassandraClient.get_schema) and returns the DDL that is missing:
+    # table and column statements first, index statements second since they need their table. Nothing is ever
+    # dropped, changes that can't be made with ALTER TABLE ... ADD raise before anything is applied
+    table_statements = []
+    index_statements = []
+    for spec in specs:
+        columns = spec.cassandra_columns(embedding_dimensions)
+        for column in spec.indexes:
+            if column not in spec.columns:
+                raise ValueError(f"{spec.name}: can't index {column}, it is not a column of the spec")
+        existing = live.get(spec.name)
+        if existing is None:
+            table_statements.append(spec.ddl(keyspace, embedding_dimensions, if_not_exists=True))
+            live_indexes = set()
+        else:
+            live_columns = {column["column_name"]: column for column in existing["columns"]}
+            live_partition_keys = _key_columns(existing["columns"], "partition_key")
+            live_clustering_columns = _key_columns(existing["columns"], "clustering")
+            if live_partition_keys != spec.partition_keys or live_clustering_columns != spec.clustering_columns:
+                raise ValueError(f"{spec.name}: primary key ({live_partition_keys}, {live_clustering_columns}) can't be changed to ({spec.partition_keys}, {spec.clustering_columns})")
+            missing = []
+            for column in columns:
+                live_column = live_columns.get(column.name)
+                if live_column is None:
+                    missing.append(column)
+                elif _normalize_type(live_column["type"]) != _normalize_type(column.type):
+                    raise ValueError(f"{spec.name}: column {column.name} is {live_column['type']}, can't be changed to {column.type}")
+            if missing:
+                added = ", ".join(f"{column.name} {column.type}" for column in missing)
+                table_statements.append(f"ALTER TABLE {keyspace}.{spec.name} ADD ({added})")
+            live_indexes = existing["indexes"]
+        for column in spec.indexes:
+            if column not in live_indexes:
+                index_statements.append(index_ddl(keyspace, spec.name, column))
+    return table_statements, index_statements
+
+
+def _key_columns(columns: List[Dict[str, Any]], kind: str) -> List[str]:
+    key_columns = sorted((column for column in columns if column["kind"] == kind), key=lambda column: column["position"])
+    return [column["column_name"] for column in key_columns]
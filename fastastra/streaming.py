@@ -0,0 +1,118 @@
+import asyncio
+import concurrent.futures
+import csv
+import dataclasses
+import io
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
+
+from fastastra.bulk_io import csv_cell, json_line
+
+# pages fetched ahead of the one being sent, a slow client stops the fetching once this many are waiting
+DEFAULT_PREFETCH = 2
+
+
+def _row_dict(row) -> Dict[str, Any]:
+    if isinstance(row, BaseModel):
+        return row.model_dump()
+    if dataclasses.is_dataclass(row):
+        return dataclasses.asdict(row)
+    return dict(row)
+
+
+async def aiter_pages(pages: Iterable[List[Any]], prefetch: int = DEFAULT_PREFETCH) -> AsyncIterator[List[Any]]:
+    # pages are read on a background thread into a bounded queue, so the next page is fetched while the current one
+    # is sent and fetching blocks when the client falls behind. Stops the thread when the client goes away
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(items.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put((page, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+
+    threading.Thread(target=produce, name="fastastra-stream", daemon=True).start()
+    try:
+        while True:
+            page, error = await items.get()
+            if error is not None:
+                raise error
+            if page is done:
+                return
+            yield page
+    finally:
+        stop.set()
+
+
+async def _ndjson(pages, prefetch):
+    async for page in aiter_pages(pages, prefetch):
+        yield "".join(json_line(_row_dict(row)) for row in page)
+
+
+async def _csv(pages, columns, prefetch):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = columns is not None
+    if header:
+        writer.writerow(columns)
+    async for page in aiter_pages(pages, prefetch):
+        rows = [_row_dict(row) for row in page]
+        if not header and rows:
+            columns = list(rows[0])
+            writer.writerow(columns)
+            header = True
+        writer.writerows([csv_cell(row.get(column)) for column in columns] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def _html(pages, render, head, tail, prefetch):
+    if head:
+        yield head
+    async for page in aiter_pages(pages, prefetch):
+        yield "".join(render(row) for row in page)
+    if tail:
+        yield tail
+
+
+def ndjson_response(pages: Iterable[List[Any]], prefetch: int = DEFAULT_PREFETCH, **kwargs) -> StreamingResponse:
+    # pages is any iterable of row lists, e.g. table.iter_pages(1000). Rows are dataclasses, pydantic models or dicts
+    return StreamingResponse(_ndjson(pages, prefetch), media_type="application/x-ndjson", **kwargs)
+
+
+def csv_response(pages: Iterable[List[Any]], columns: List[str] = None, filename: str = None, prefetch: int = DEFAULT_PREFETCH, **kwargs) -> StreamingResponse:
+    headers = kwargs.pop("headers", None) or {}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(_csv(pages, columns, prefetch), media_type="text/csv", headers=headers, **kwargs)
+
+
+def html_response(pages: Iterable[List[Any]], render: Callable[[Any], str] = None, head: str = "", tail: str = "", prefetch: int = DEFAULT_PREFETCH, **kwargs) -> StreamingResponse:
+    # each row is rendered on its own, by default through FastHTML's to_xml so a dataclass __ft__ is used
+    if render is None:
+        from fasthtml.common import to_xml
+        render = to_xml
+    return StreamingResponse(_html(pages, render, head, tail, prefetch), media_type="text/html", **kwargs)
@@ -0,0 +1,331 @@
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from fastastra.bulk_io import coerce_record, json_line
+
+METRICS = ("cosine", "dot_product", "euclidean")
+# snapshots older than this are rescanned, they don't have the writes other processes made since they were saved
+DEFAULT_SNAPSHOT_MAX_AGE = 3600.0
+RANGE_CHECKS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class VectorMirror:
+    # a process local copy of a table's primary key and one vector column for exact (or hnsw) search without a
+    # round trip. It is loaded by a parallel scan and kept current by writes made through this process only
+    def __init__(self, table, column: str, metric: str = "cosine", snapshot: str = None, hnsw: bool = False, parallelism: int = 8,
+                 snapshot_max_age: float = DEFAULT_SNAPSHOT_MAX_AGE):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric}, expected one of {METRICS}")
+        self.table = table
+        self.column = column
+        self.metric = metric
+        # directory holding vectors.npy, keys.ndjson and meta.json, memory mapped on load so restarts skip the
+        # scan. Saved after a scan and again on close when writes changed the mirror
+        self.snapshot = snapshot
+        self.snapshot_max_age = snapshot_max_age
+        self.parallelism = parallelism
+        self.primary_key = table.partition_keys + table.clustering_columns
+        self.ready = False
+        # the exception of the last failed load, queries keep going to the server
+        self.error: Optional[Exception] = None
+        self._lock = threading.RLock()
+        # writes made while a load runs, applied on top of what it loaded
+        self._loading = False
+        self._buffered: List[Tuple[Any, Tuple]] = []
+        self._dirty = False
+        self._keys: List[Tuple] = []
+        self._rows: Dict[Tuple, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._size = 0
+        self._hnsw = None
+        self._use_hnsw = hnsw
+        # hnsw labels are stable per key while matrix rows move on delete
+        self._labels: Dict[Tuple, int] = {}
+        self._label_keys: Dict[int, Tuple] = {}
+        if snapshot:
+            atexit.register(self.close)
+
+    def __len__(self):
+        return self._size
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        # cosine is a dot product over normalized vectors
+        if self.metric != "cosine":
+            return vectors
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def load(self, refresh: bool = False):
+        # from a fresh enough snapshot, otherwise (or with refresh) from a scan
+        started = time.time()
+        with self._lock:
+            self._loading = True
+            self._buffered = []
+        try:
+            loaded = None if refresh else self._read_snapshot()
+            source = "snapshot"
+            if loaded is None:
+                loaded = self._scan()
+                source = "scan"
+        except Exception as e:
+            with self._lock:
+                self._loading = False
+                self._buffered = []
+            self.error = e
+            logger.error(f"failed to load the vector mirror of {self.table.table_name}.{self.column}, queries stay on the server: {e}")
+            raise
+        keys, vectors = loaded
+        with self._lock:
+            self._keys = list(keys)
+            self._rows = {key: i for i, key in enumerate(self._keys)}
+            self._vectors = vectors
+            self._size = len(self._keys)
+            self._hnsw = None
+            if self._use_hnsw and self._size:
+                self._build_hnsw()
+            buffered, self._buffered, self._loading = self._buffered, [], False
+            self._dirty = False
+            for apply, args in buffered:
+                apply(*args)
+            self.ready = True
+            self.error = None
+        if self.snapshot and (source == "scan" or self._dirty):
+            self.save()
+        logger.info(f"loaded {self._size} vectors of {self.table.table_name}.{self.column} from {source} in {time.time() - started:.1f}s")
+        return self
+
+    def load_in_background(self) -> threading.Thread:
+        # failures are logged and kept in error, the mirror then stays unused
+        def load():
+            try:
+                self.load()
+            except Exception:
+                pass
+        thread = threading.Thread(target=load, name=f"vector-mirror-{self.table.table_name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _snapshot_path(self, name):
+        return os.path.join(self.snapshot, name)
+
+    def _read_snapshot(self):
+        # (keys, vectors) or None when there is no usable snapshot: missing, incomplete, made for another column
+        # or metric, or older than snapshot_max_age
+        if not self.snapshot:
+            return None
+        try:
+            with open(self._snapshot_path("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (meta.get("column"), meta.get("metric"), meta.get("primary_key")) != (self.column, self.metric, self.primary_key):
+            logger.info(f"vector mirror snapshot in {self.snapshot} was made for another column or metric, rescanning")
+            return None
+        age = time.time() - meta.get("saved_at", 0)
+        if self.snapshot_max_age is not None and age > self.snapshot_max_age:
+            logger.info(f"vector mirror snapshot in {self.snapshot} is {age:.0f}s old, rescanning")
+            return None
+        vectors = np.load(self._snapshot_path("vectors.npy"), mmap_mode="r")
+        types = {column["column_name"]: column["type"] for column in self.table.raw_columns if column["column_name"] in self.primary_key}
+        keys = []
+        with open(self._snapshot_path("keys.ndjson"), "r", encoding="utf-8") as f:
+            for line in f:
+                record = coerce_record(json.loads(line), types)
+                keys.append(tuple(record[column] for column in self.primary_key))
+        if len(keys) != meta.get("rows") or vectors.shape[0] != len(keys):
+            logger.warning(f"vector mirror snapshot in {self.snapshot} is incomplete, rescanning")
+            return None
+        return keys, vectors
+
+    def _scan(self):
+        keys = []
+        vectors = []
+        rows = self.table.db.client.scan_table(
+            keyspace=self.table.keyspace,
+            table=self.table.table_name,
+            partition_keys=self.table.partition_keys,
+            columns=self.primary_key + [self.column],
+            parallelism=self.parallelism,
+        )
+        for row in rows:
+            if row[self.column] is not None:
+                keys.append(tuple(row[column] for column in self.primary_key))
+                vectors.append(row[self.column])
+        dimensions = len(vectors[0]) if vectors else 0
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(vectors), dimensions)
+        return keys, self._prepare(matrix)
+
+    def save(self):
+        # meta.json is removed first and written last, so an interrupted save is never loaded
+        os.makedirs(self.snapshot, exist_ok=True)
+        with self._lock:
+            vectors = np.ascontiguousarray(self._vectors[:self._size])
+            keys = list(self._keys)
+            self._dirty = False
+        meta = {"column": self.column, "metric": self.metric, "primary_key": self.primary_key, "rows": len(keys), "saved_at": time.time()}
+        if os.path.exists(self._snapshot_path("meta.json")):
+            os.remove(self._snapshot_path("meta.json"))
+        self._replace("vectors.npy", "wb", lambda f: np.save(f, vectors))
+        self._replace("keys.ndjson", "w", lambda f: f.writelines(json_line(dict(zip(self.primary_key, key))) for key in keys))
+        self._replace("meta.json", "w", lambda f: json.dump(meta, f))
+
+    def _replace(self, name, mode, write):
+        tmp = self._snapshot_path(f"{name}.{os.getpid()}.tmp")
+        with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            write(f)
+        os.replace(tmp, self._snapshot_path(name))
+
+    def close(self):
+        # saves the writes made since the last save, called by disable_vector_mirror, db.close() and at exit
+        if self.snapshot:
+            atexit.unregister(self.close)
+            if self.ready and self._dirty:
+                self.save()
+
+    def _writable(self, rows: int):
+        # memory mapped snapshots are read only, the first write copies them into a growable array
+        capacity = self._vectors.shape[0]
+        if self._vectors.flags.writeable and capacity >= rows:
+            return
+        dimensions = self._vectors.shape[1]
+        grown = np.empty((max(rows, capacity * 2, 1024), dimensions), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+
+    def upsert(self, row: Dict[str, Any]):
+        vector = row.get(self.column)
+        if vector is None or isinstance(vector, str):
+            return
+        with self._lock:
+            if self._loading:
+                self._buffered.append((self._upsert, (row,)))
+            if self.ready:
+                self._upsert(row)
+
+    def _upsert(self, row: Dict[str, Any]):
+        vector = row[self.column]
+        key = tuple(row.get(column) for column in self.primary_key)
+        prepared = self._prepare(np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] == 0:
+                self._vectors = np.empty((0, len(prepared)), dtype=np.float32)
+            index = self._rows.get(key)
+            if index is None:
+                self._writable(self._size + 1)
+                index = self._size
+                self._keys.append(key)
+                self._rows[key] = index
+                self._size += 1
+            else:
+                self._writable(self._size)
+            self._vectors[index] = prepared
+            self._dirty = True
+            if self._use_hnsw:
+                # an empty mirror has no dimensions to build the graph with until the first vector arrives
+                if self._hnsw is None:
+                    self._build_hnsw()
+                else:
+                    self._hnsw_add(key, prepared)
+
+    def remove(self, args: Dict[str, Any], ranges: List[Tuple[str, str, Any]] = None):
+        # removes rows matching a (possibly partial) primary key and optional clustering ranges
+        with self._lock:
+            if self._loading:
+                self._buffered.append((self._remove, (args, ranges)))
+            if self.ready:
+                self._remove(args, ranges)
+
+    def _remove(self, args, ranges):
+        with self._lock:
+            for key in [key for key in self._keys if self._matches(key, args, ranges)]:
+                self._remove_key(key)
+
+    def _matches(self, key, args, ranges):
+        values = dict(zip(self.primary_key, key))
+        if any(values.get(column) != value for column, value in args.items()):
+            return False
+        return all(RANGE_CHECKS[operator](values[column], value) for column, operator, value in ranges or [])
+
+    def _remove_key(self, key):
+        # swap with the last row so the matrix stays contiguous
+        index = self._rows.pop(key)
+        last = self._size - 1
+        self._writable(self._size)
+        if index != last:
+            last_key = self._keys[last]
+            self._vectors[index] = self._vectors[last]
+            self._keys[index] = last_key
+            self._rows[last_key] = index
+        self._keys.pop()
+        self._size -= 1
+        self._dirty = True
+        if self._hnsw is not None:
+            self._hnsw.mark_deleted(self._labels.pop(key))
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("hnsw search requires hnswlib, install it with `pip install hnswlib`")
+        space = {"cosine": "ip", "dot_product": "ip", "euclidean": "l2"}[self.metric]
+        self._hnsw = hnswlib.Index(space=space, dim=self._vectors.shape[1])
+        self._hnsw.init_index(max_elements=max(self._size * 2, 1024), ef_construction=200, M=16, allow_replace_deleted=True)
+        self._labels = {key: label for label, key in enumerate(self._keys)}
+        self._label_keys = dict(enumerate(self._keys))
+        if self._size:
+            self._hnsw.add_items(np.asarray(self._vectors[:self._size]), np.arange(self._size))
+
+    def _hnsw_add(self, key, vector):
+        label = self._labels.get(key)
+        if label is None:
+            label = len(self._label_keys)
+            self._labels[key] = label
+            self._label_keys[label] = key
+        if self._hnsw.get_current_count() >= self._hnsw.get_max_elements():
+            self._hnsw.resize_index(self._hnsw.get_max_elements() * 2)
+        self._hnsw.add_items(vector[None, :], [label])
+
+    def search(self, vector, k: int = 20) -> List[Tuple[Tuple, float]]:
+        # (primary key, score) pairs, best first. Scores follow the server: higher is more similar
+        query = self._prepare(np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            if self._size == 0:
+                return []
+            k = min(k, self._size)
+            if self._hnsw is not None:
+                self._hnsw.set_ef(max(k * 2, 50))
+                labels, distances = self._hnsw.knn_query(query, k=k)
+                return [(self._label_keys[label], self._score_from_distance(distance)) for label, distance in zip(labels[0], distances[0])]
+            vectors = self._vectors[:self._size]
+            if self.metric == "euclidean":
+                scores = -np.sum((vectors - query) ** 2, axis=1)
+            else:
+                scores = vectors @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._keys[i], self._score(float(scores[i]))) for i in top]
+
+    def _score(self, score):
+        # the same [0, 1] similarity the server returns from similarity_cosine / dot_product / euclidean
+        if self.metric == "euclidean":
+            return 1 / (1 - score)
+        return (1 + score) / 2
+
+    def _score_from_distance(self, distance):
+        if self.metric == "euclidean":
+            return 1 / (1 + float(distance))
+        return (1 + (1 - float(distance))) / 2
@@ -0,0 +1,147 @@
+import atexit
+import os
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# open buffers, reset in forked children: the locks may have been held by a parent thread that does not exist in
+# the child, and the parent flushes the rows that were pending when it forked
+_buffers = weakref.WeakSet()
+
+
+class WriteBehindBuffer:
+    def __init__(self, table, max_rows: int = 1000, interval: float = 1.0, concurrency: int = None, on_error=None):
+        self.table = table
+        self.max_rows = max_rows
+        self.interval = interval
+        self.concurrency = concurrency
+        # on_error(exception, rows) is called from the flushing thread when a flush fails, the rows are dropped
+        self.on_error = on_error
+        self._primary_key = table.partition_keys + table.clustering_columns
+        # rows waiting for the next flush and rows currently being written, both keyed by primary key
+        self._pending: Dict[Tuple, Dict[str, Any]] = {}
+        self._flushing: Dict[Tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._start()
+        atexit.register(self.close)
+        _buffers.add(self)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.table.table_name}", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        if not self._closed:
+            self._start()
+
+    def _key(self, row) -> Tuple:
+        return tuple(row.get(column) for column in self._primary_key)
+
+    def _matches(self, row, args) -> bool:
+        return all(row.get(column) == value for column, value in args.items())
+
+    def put(self, row: Dict[str, Any]):
+        # repeated writes to the same primary key collapse into one row, None values leave earlier values untouched
+        key = self._key(row)
+        with self._lock:
+            buffered = self._pending.get(key)
+            if buffered is None:
+                self._pending[key] = dict(row)
+            else:
+                buffered.update({column: value for column, value in row.items() if value is not None})
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def overlay(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        key = self._key(row)
+        with self._lock:
+            layers = [self._flushing.get(key), self._pending.get(key)]
+        merged = dict(row)
+        for layer in layers:
+            if layer is not None:
+                merged.update({column: value for column, value in layer.items() if value is not None})
+        return merged
+
+    def matching(self, args: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # buffered rows whose values equal args, for reads that should see rows not written yet
+        with self._lock:
+            keys = [key for key, row in {**self._flushing, **self._pending}.items() if self._matches(row, args)]
+        return [self.overlay(dict(zip(self._primary_key, key))) for key in keys]
+
+    def discard(self, args: Dict[str, Any]):
+        # called before a delete so a later flush cannot resurrect the deleted rows
+        with self._flush_lock:
+            with self._lock:
+                for key in [key for key, row in self._pending.items() if self._matches(row, args)]:
+                    del self._pending[key]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+                rows = list(self._flushing.values())
+            columns = self.table.columns
+            try:
+                self.table.db.client.insert_many_into_table(
+                    self.table.keyspace,
+                    self.table.table_name,
+                    columns,
+                    [[row.get(column) for column in columns] for row in rows],
+                    concurrency=self.concurrency
+                )
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e, rows)
+                else:
+                    logger.error(f"write-behind flush of {len(rows)} rows to {self.table.table_name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._flushing = {}
+                # cached ann results are only stale once the rows are on the server, a query answered while they
+                # were buffered would otherwise be cached again before the flush
+                if self.table.db.ann_cache is not None:
+                    self.table.db.ann_cache.invalidate(self.table.table_name)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"write-behind flush for {self.table.table_name} failed: {e}")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+        _buffers.discard(self)
+
+
+def _reset_after_fork():
+    for buffer in list(_buffers):
+        buffer._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,48 @@
+from fastastra.ann_cache import SemanticCache
+
+ROWS = [{"id": 1}]
+
+
+def test_close_vectors_hit_and_far_vectors_miss():
+    cache = SemanticCache(max_distance=0.05)
+    cache.put("dogs", {}, [1.0, 0.0], ROWS)
+    assert cache.get("dogs", {}, [2.0, 0.01]) == ROWS
+    assert cache.get("dogs", {}, [0.0, 1.0]) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_tables_and_filters_are_separate():
+    cache = SemanticCache()
+    cache.put("dogs", {"owner": "seb"}, [1.0, 0.0], ROWS)
+    assert cache.get("dogs", {}, [1.0, 0.0]) is None
+    assert cache.get("cats", {"owner": "seb"}, [1.0, 0.0]) is None
+    assert cache.get("dogs", {"owner": "seb"}, [1.0, 0.0]) == ROWS
+
+
+def test_invalidate_drops_the_table_and_stale_puts():
+    cache = SemanticCache()
+    cache.put("dogs", {}, [1.0, 0.0], ROWS)
+    cache.put("cats", {}, [1.0, 0.0], ROWS)
+    generation = cache.generation("dogs")
+    cache.invalidate("dogs")
+    assert cache.get("dogs", {}, [1.0, 0.0]) is None
+    assert cache.get("cats", {}, [1.0, 0.0]) == ROWS
+
+    # a result read before the write is not stored after it
+    cache.put("dogs", {}, [1.0, 0.0], ROWS, generation)
+    assert cache.get("dogs", {}, [1.0, 0.0]) is None
+    cache.put("dogs", {}, [1.0, 0.0], ROWS, cache.generation("dogs"))
+    assert cache.get("dogs", {}, [1.0, 0.0]) == ROWS
+
+
+def test_expired_and_evicted_entries_miss():
+    cache = SemanticCache(ttl=0)
+    cache.put("dogs", {}, [1.0, 0.0], ROWS)
+    assert cache.get("dogs", {}, [1.0, 0.0]) is None
+    assert len(cache) == 0
+
+    cache = SemanticCache(max_entries=1)
+    cache.put("dogs", {}, [1.0, 0.0], ROWS)
+    cache.put("dogs", {}, [0.0, 1.0], ROWS)
+    assert len(cache) == 1
+    assert cache.get("dogs", {}, [1.0, 0.0]) is None
@@ -0,0 +1,147 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+from cassandra import util
+from cassandra.cqltypes import lookup_casstype
+
+from datastore.lazy_vector import LazyVector
+from fastastra.bulk_io import coerce_record, read_batches, read_checkpoint, write_checkpoint, export_rows
+from fastastra.fastastra import Table
+
+TYPES = {
+    "id": "uuid",
+    "count": "int",
+    "score": "double",
+    "price": "decimal",
+    "done": "boolean",
+    "created": "timestamp",
+    "day": "date",
+    "data": "blob",
+    "tags": "set<text>",
+    "scores": "map<text, int>",
+    "embedding": "vector<float, 2>",
+    "name": "text",
+}
+
+
+def test_csv_strings_are_coerced_to_column_types():
+    record = {
+        "id": "5b6962dd-3f90-4c93-8f61-eabfa4a803e2",
+        "count": "3",
+        "score": "1.5",
+        "price": "9.99",
+        "done": "yes",
+        "created": "2024-01-02T03:04:05",
+        "day": "2024-01-02",
+        "data": "aGk=",
+        "tags": '["a", "b"]',
+        "scores": '{"a": "1"}',
+        "embedding": "[0.5, 1]",
+        "name": 7,
+        "extra": "ignored",
+    }
+    assert coerce_record(record, TYPES) == {
+        "id": uuid.UUID("5b6962dd-3f90-4c93-8f61-eabfa4a803e2"),
+        "count": 3,
+        "score": 1.5,
+        "price": decimal.Decimal("9.99"),
+        "done": True,
+        "created": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "day": datetime.date(2024, 1, 2),
+        "data": b"hi",
+        "tags": {"a", "b"},
+        "scores": {"a": 1},
+        "embedding": [0.5, 1.0],
+        "name": "7",
+    }
+
+
+def test_empty_values_are_null_and_text_vectors_are_kept_for_embedding():
+    assert coerce_record({"count": "", "done": None}, TYPES) == {"count": None, "done": None}
+    assert coerce_record({"embedding": "a cat"}, TYPES) == {"embedding": "a cat"}
+    assert coerce_record({"embedding": '"a cat"'}, TYPES) == {"embedding": "a cat"}
+
+
+def test_read_batches_skips_the_offset(tmp_path):
+    path = tmp_path / "rows.ndjson"
+    path.write_text("".join(json.dumps({"count": i}) + "\n" for i in range(7)) + "\n")
+    assert [[record["count"] for record in batch] for batch in read_batches(str(path), "ndjson", batch_size=3, offset=2)] == [[2, 3, 4], [5, 6]]
+
+    path = tmp_path / "rows.csv"
+    path.write_text("count,name\n1,a\n2,b\n")
+    assert list(read_batches(str(path), "csv")) == [[{"count": "1", "name": "a"}, {"count": "2", "name": "b"}]]
+
+    with pytest.raises(ValueError):
+        list(read_batches(str(path), "xml"))
+
+
+def test_checkpoint_belongs_to_its_file(tmp_path):
+    checkpoint = str(tmp_path / "load.checkpoint")
+    assert read_checkpoint(checkpoint, "rows.ndjson") == 0
+    write_checkpoint(checkpoint, "rows.ndjson", 500)
+    assert read_checkpoint(checkpoint, "rows.ndjson") == 500
+    with pytest.raises(ValueError):
+        read_checkpoint(checkpoint, "other.ndjson")
+
+
+EXPORT_COLUMNS = [{"column_name": name, "type": cql_type} for name, cql_type in TYPES.items()]
+
+
+VECTOR2 = lookup_casstype("org.apache.cassandra.db.marshal.VectorType(org.apache.cassandra.db.marshal.FloatType, 2)")
+
+
+def exported_row(i):
+    # values as the driver returns them
+    return {
+        "id": uuid.UUID(int=i),
+        "count": i,
+        "score": i / 2,
+        "price": decimal.Decimal("1.25"),
+        "done": i % 2 == 0,
+        "created": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "day": util.Date(datetime.date(2024, 1, 2)),
+        "data": b"hi",
+        "tags": util.SortedSet(["b", "a"]),
+        "scores": {"a": i},
+        "embedding": LazyVector(VECTOR2.serialize([0.5, float(i)], 5)),
+        "name": None,
+    }
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv", "parquet"])
+def test_exported_rows_load_back(tmp_path, format):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"rows.{format}")
+    progress = []
+    columns = list(TYPES)
+    assert export_rows((exported_row(i) for i in range(5)), path, format, columns, EXPORT_COLUMNS, batch_size=2, progress=lambda written, _: progress.append(written)) == 5
+    assert progress == [2, 4, 5]
+
+    records = [record for batch in read_batches(path, format) for record in batch]
+    loaded = [coerce_record(record, TYPES) for record in records]
+    assert [row["id"] for row in loaded] == [uuid.UUID(int=i) for i in range(5)]
+    assert loaded[3] == {
+        "id": uuid.UUID(int=3),
+        "count": 3,
+        "score": 1.5,
+        "price": decimal.Decimal("1.25"),
+        "done": False,
+        "created": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "day": datetime.date(2024, 1, 2),
+        "data": b"hi",
+        "tags": {"a", "b"},
+        "scores": {"a": 3},
+        "embedding": [0.5, 3.0],
+        "name": None,
+    }
+
+
+def test_filtered_export_is_not_parallel(tmp_path):
+    table = Table.__new__(Table)
+    with pytest.raises(ValueError, match="parallelism"):
+        table.export(str(tmp_path / "rows.ndjson"), format="ndjson", where={"owner": "seb"}, parallelism=8)
+    assert not (tmp_path / "rows.ndjson").exists()
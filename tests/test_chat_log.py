@@ -0,0 +1,41 @@
+import uuid
+
+from fastastra.chat_log import ConversationLog
+
+
+class BatchClient:
+    def __init__(self):
+        self.batches = []
+
+    def insert_batch(self, keyspace, table, columns, rows):
+        self.batches.append(rows)
+
+
+class FakeDB:
+    keyspace = "ks"
+
+    def __init__(self):
+        self.client = BatchClient()
+
+    def table(self, name):
+        return None
+
+
+def test_stream_takes_entry_ids_when_written():
+    db = FakeDB()
+    log = ConversationLog(db, max_chunks=2, create=False)
+    yielded = []
+
+    def chunks():
+        for chunk in ["a", "b", "c"]:
+            yielded.append(uuid.uuid1().time)
+            yield chunk
+
+    message = log.stream("c1", "assistant", chunks())
+    assert [[row[4] for row in rows] for rows in db.client.batches] == [["a", "b"], ["c", ""]]
+    rows = [row for rows in db.client.batches for row in rows]
+    assert all(row[2] == message for row in rows)
+    assert [row[5] for row in rows] == [False, False, False, True]
+    # every entry id is newer than the last chunk of its batch
+    assert all(row[1].time > yielded[1] for row in db.client.batches[0])
+    assert all(row[1].time > yielded[2] for row in db.client.batches[1])
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+
+import pytest
+from cassandra import OperationTimedOut
+from cassandra.cluster import NoHostAvailable
+from cassandra.policies import RetryPolicy
+from cassandra.protocol import OverloadedErrorMessage
+
+from datastore import concurrency
+from datastore.concurrency import AdaptiveLimiter, run_limited, call_limited, call_limited_async
+from datastore.latency import make_execution_profiles, resolve_latency_policies
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(concurrency, "OVERLOAD_BACKOFF", 0)
+
+
+def overloaded():
+    return OverloadedErrorMessage(0x1001, "overloaded", None)
+
+
+class FakeFuture:
+    # a driver ResponseFuture that has already completed
+    def __init__(self, result=None, error=None):
+        self._result = result
+        self._error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        if self._error is not None:
+            errback(self._error, *errback_args)
+        else:
+            callback(self._result, *callback_args)
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Submitter:
+    # answers each item with its square, failing items with the queued errors first
+    def __init__(self, errors=None):
+        self.errors = {item: list(queued) for item, queued in (errors or {}).items()}
+        self.calls = []
+
+    def __call__(self, item):
+        self.calls.append(item)
+        if self.errors.get(item):
+            return FakeFuture(error=self.errors[item].pop(0))
+        return FakeFuture(item * item)
+
+
+def test_limiter_backs_off_on_overload():
+    limiter = AdaptiveLimiter(16, min_limit=2)
+    for _ in range(10):
+        limiter.acquire()
+        limiter._last_decrease = 0.0
+        limiter.release(error=overloaded())
+    assert limiter.limit == 2
+    assert limiter.overloads == 10
+    assert limiter.in_flight == 0
+
+
+def test_limiter_grows_while_used():
+    limiter = AdaptiveLimiter(2, max_limit=4)
+    limiter._limit = 2.0
+    for _ in range(50):
+        limiter.acquire()
+        limiter.acquire()
+        limiter.release(0.01)
+        limiter.release(0.01)
+    assert limiter.limit == 4
+
+
+def test_limiter_blocks_at_limit():
+    limiter = AdaptiveLimiter(1)
+    limiter.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.05)
+    limiter.release(0.01)
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_run_limited_keeps_item_order():
+    limiter = AdaptiveLimiter(4)
+    assert run_limited(limiter, Submitter(), list(range(10)), 3) == [i * i for i in range(10)]
+    assert limiter.in_flight == 0
+
+
+def test_run_limited_retries_overloaded_items():
+    limiter = AdaptiveLimiter(8)
+    submit = Submitter({3: [overloaded(), overloaded()]})
+    assert run_limited(limiter, submit, list(range(5)), 5) == [0, 1, 4, 9, 16]
+    assert submit.calls.count(3) == 3
+    assert submit.calls.count(0) == 1
+    assert limiter.overloads == 2
+
+
+def test_run_limited_raises_other_errors():
+    submit = Submitter({1: [ValueError("bad")]})
+    with pytest.raises(ValueError):
+        run_limited(AdaptiveLimiter(4), submit, list(range(3)), 1)
+    # submissions stop after the first failure
+    assert 2 not in submit.calls
+
+
+def test_run_limited_gives_up_after_retries():
+    submit = Submitter({0: [overloaded()] * 3})
+    with pytest.raises(OverloadedErrorMessage):
+        run_limited(AdaptiveLimiter(4), submit, [0], 1, retries=2)
+
+
+def test_call_limited_retries_overloaded():
+    limiter = AdaptiveLimiter(4)
+    errors = [overloaded(), overloaded()]
+
+    def execute():
+        if errors:
+            raise errors.pop(0)
+        return "rows"
+    assert call_limited(limiter, execute) == "rows"
+    assert limiter.overloads == 2
+    assert limiter.in_flight == 0
+
+    with pytest.raises(ValueError):
+        call_limited(limiter, lambda: (_ for _ in ()).throw(ValueError("bad")))
+    assert limiter.in_flight == 0
+
+
+async def test_call_limited_async_waits_for_a_slot():
+    limiter = AdaptiveLimiter(1)
+    limiter.acquire()
+    errors = [overloaded()]
+
+    async def execute():
+        if errors:
+            raise errors.pop(0)
+        return "rows"
+    task = asyncio.ensure_future(call_limited_async(limiter, execute))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+    threading.Thread(target=limiter.release, args=(0.01,)).start()
+    assert await asyncio.wait_for(task, 1) == "rows"
+    assert limiter.overloads == 1
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("error", [
+    OperationTimedOut(),
+    NoHostAvailable("Unable to complete the operation against any hosts", {"10.0.0.1": OperationTimedOut(), "10.0.0.2": overloaded()}),
+])
+def test_call_limited_backs_off_on_congestion(error):
+    limiter = AdaptiveLimiter(16)
+
+    def execute():
+        raise error
+    with pytest.raises(type(error)):
+        call_limited(limiter, execute)
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+
+
+def test_call_limited_resubmits_when_every_host_is_overloaded():
+    limiter = AdaptiveLimiter(16)
+    errors = [NoHostAvailable("Unable to complete the operation against any hosts", {"10.0.0.1": overloaded(), "10.0.0.2": overloaded()})]
+
+    def execute():
+        if errors:
+            raise errors.pop(0)
+        return "rows"
+    assert call_limited(limiter, execute) == "rows"
+    assert limiter.limit == 8
+    assert limiter.overloads == 1
+
+
+def test_profiles_leave_overloads_to_the_limiter():
+    profiles, _ = make_execution_profiles(resolve_latency_policies())
+    for profile in profiles.values():
+        decision, _ = profile.retry_policy.on_request_error(None, None, overloaded(), 0)
+        assert decision == RetryPolicy.RETHROW
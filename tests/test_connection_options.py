@@ -0,0 +1,28 @@
+import pytest
+
+from datastore.connection_options import ConnectionOptions
+
+
+def test_presets_validate():
+    ConnectionOptions().validate_options()
+    ConnectionOptions.low_latency().validate_options()
+    ConnectionOptions.bulk_throughput(compression=True).validate_options()
+
+
+@pytest.mark.parametrize("options", [
+    {"executor_threads": 0},
+    {"protocol_version": 42},
+    {"connect_timeout": -1},
+    {"idle_heartbeat_interval": -1},
+    {"connections_per_host": 0},
+    {"max_requests_per_connection": 0},
+    {"request_concurrency": 0},
+    {"request_concurrency": 10, "max_request_concurrency": 5},
+    {"reactor": "select"},
+    {"load_balancing": "random"},
+    {"load_balancing": "round_robin", "local_dc": "dc1"},
+    {"compression": "zstd"},
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        ConnectionOptions(**options).validate_options()
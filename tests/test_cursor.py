@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from fastastra.cursor import derive_cursor_secret, query_shape, encode_cursor, decode_cursor, _b64encode, _b64decode
+
+SECRET = derive_cursor_secret("token")
+SHAPE = query_shape("ks", "dogs", ("seb",), 20)
+
+
+def test_round_trip():
+    cursor = encode_cursor(b"\x00paging\xff", SHAPE, SECRET)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, SHAPE, SECRET) == b"\x00paging\xff"
+    assert encode_cursor(None, SHAPE, SECRET) is None
+
+
+def test_edited_payload_is_rejected():
+    payload, signature = encode_cursor(b"paging", SHAPE, SECRET).split(".")
+    data = json.loads(_b64decode(payload))
+    data["p"] = _b64encode(b"other")
+    edited = _b64encode(json.dumps(data).encode())
+    with pytest.raises(ValueError, match="Invalid cursor signature"):
+        decode_cursor(f"{edited}.{signature}", SHAPE, SECRET)
+
+
+def test_other_secret_is_rejected():
+    cursor = encode_cursor(b"paging", SHAPE, derive_cursor_secret("other token"))
+    with pytest.raises(ValueError, match="Invalid cursor signature"):
+        decode_cursor(cursor, SHAPE, SECRET)
+
+
+def test_other_query_is_rejected():
+    cursor = encode_cursor(b"paging", query_shape("ks", "cats", (), 20), SECRET)
+    with pytest.raises(ValueError, match="different query"):
+        decode_cursor(cursor, SHAPE, SECRET)
+
+
+@pytest.mark.parametrize("cursor", ["", "no-dot", "a.b.c", "!!!.???"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, SHAPE, SECRET)
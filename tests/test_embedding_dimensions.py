@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from fastastra import embedding_dimensions
+from fastastra.embedding_dimensions import get_embedding_dimensions, remember_embedding_dimensions
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "embedding_dimensions.json"
+    monkeypatch.setattr(embedding_dimensions, "CACHE_PATH", str(path))
+    monkeypatch.setattr(embedding_dimensions, "_cache", None)
+    return path
+
+
+def test_known_models_ignore_the_provider_prefix(cache_path):
+    assert get_embedding_dimensions("openai/text-embedding-3-small") == 1536
+    assert not cache_path.exists()
+
+
+def test_cache_file_is_read_once_and_written_on_change(cache_path, monkeypatch):
+    cache_path.write_text(json.dumps({"custom": 12}))
+    reads = []
+    read_cache = embedding_dimensions._read_cache
+    monkeypatch.setattr(embedding_dimensions, "_read_cache", lambda: reads.append(1) or read_cache())
+
+    for _ in range(5):
+        assert get_embedding_dimensions("custom") == 12
+        remember_embedding_dimensions("custom", 12)
+    assert len(reads) == 1
+
+    remember_embedding_dimensions("other", 8)
+    assert len(reads) == 2
+    assert get_embedding_dimensions("other") == 8
+    assert json.loads(cache_path.read_text()) == {"custom": 12, "other": 8}
@@ -5,6 +5,7 @@ from typing import List
 import dotenv
 
 from fastastra.fastastra import AstraDatabase
+from fastastra.schema import TableSpec
 
 dotenv.load_dotenv("./.env")
 dotenv.load_dotenv("../.env")
@@ -129,3 +130,190 @@ def test_fastastra():
     except Exception as e:
         print(e)
         raise e
+
+
+def test_bulk_delete():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    events = db.t.events
+    events.drop()
+    if not events.exists():
+        events.create(device=str, ts=int, value=float, partition_keys='device', clustering_columns='ts')
+
+    for ts in range(10):
+        events.insert(device="a", ts=ts, value=float(ts))
+        events.insert(device="b", ts=ts, value=float(ts))
+
+    events.delete_range("a", ts__lt=5)
+    assert len(events["a"]) == 5
+
+    events.delete_many([["a", 5], ["a", 6]])
+    assert len(events["a"]) == 3
+
+    events.delete_range("a", ts__between=(7, 8))
+    assert events["a"].ts == 9
+
+    # rows read from the table delete by their primary key only
+    events.delete_many(events.rows_where("b", ts__lt=5))
+    assert [row.ts for row in events.rows_where("b")] == [5, 6, 7, 8, 9]
+    events.delete_many([events.pydantic_model()(device="b", ts=5, value=5.0)])
+    assert len(events["b"]) == 4
+
+    events.delete_many(["b"])
+    try:
+        events["b"]
+        assert False
+    except KeyError:
+        pass
+
+
+def test_rows_where():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    metrics = db.t.metrics
+    metrics.drop()
+    if not metrics.exists():
+        metrics.create(device=str, ts=int, value=float, partition_keys='device', clustering_columns='ts')
+
+    for ts in range(10):
+        metrics.insert(device="a", ts=ts, value=float(ts))
+        metrics.insert(device="b", ts=ts, value=float(ts))
+
+    rows = metrics.rows_where("a", ts__gte=3, ts__lt=7)
+    assert [row.ts for row in rows] == [3, 4, 5, 6]
+
+    rows = metrics.rows_where("a", ts__between=(2, 8), order_by="-ts", limit=3)
+    assert [row.ts for row in rows] == [8, 7, 6]
+
+    rows = metrics.rows_where(per_partition_limit=1)
+    assert sorted((row.device, row.ts) for row in rows) == [("a", 0), ("b", 0)]
+
+    # paged reads of a whole partition bypass coalescing
+    db.enable_coalescing()
+    try:
+        rows = metrics.rows_where("a", ts__gte=3, ts__lt=7, page_size=2)
+        assert [row.ts for row in rows] == [3, 4, 5, 6]
+        assert len(next(metrics.iter_pages(page_size=2, key="b"))) == 2
+    finally:
+        db.disable_coalescing()
+
+
+def test_scan():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    readings = db.t.readings
+    readings.drop()
+    if not readings.exists():
+        readings.create(id=int, value=float, pk='id')
+
+    for i in range(50):
+        readings.insert(id=i, value=float(i))
+
+    completed = []
+    ids = {row.id for row in readings.scan(parallelism=4, page_size=7, on_range_complete=completed.append)}
+    assert ids == set(range(50))
+
+    assert readings.count() == 50
+    # size estimates only appear after the server's next refresh, so check their shape rather than their value
+    stats = readings.stats()
+    assert set(stats) == {"partitions", "bytes", "mean_partition_size", "ring_coverage"}
+    assert all(isinstance(stats[key], int) and stats[key] >= 0 for key in ("partitions", "bytes", "mean_partition_size"))
+    assert isinstance(stats["ring_coverage"], float) and 0.0 <= stats["ring_coverage"] <= 1.0
+    assert readings.count(exact=False) == stats["partitions"]
+
+    # every range was checkpointed so resuming yields nothing
+    assert list(readings.scan(parallelism=4, checkpoint=completed)) == []
+
+
+def test_sync_schema():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    db.t.birds.drop()
+    db.t.fish.drop()
+    specs = [
+        TableSpec.define("birds", id=int, name=str, pk="id", indexes="name"),
+        TableSpec.define("fish", tank=str, id=int, name=str, partition_keys="tank", clustering_columns="id"),
+    ]
+    assert len(db.sync_schema(specs)) == 3
+    assert db.sync_schema(specs) == []
+    assert db.t.birds.c.name.indexed
+    assert db.t.birds.indexes()["name"]["name"] == "birds_name_idx"
+
+    specs[1] = TableSpec.define("fish", tank=str, id=int, name=str, fins=int, partition_keys="tank", clustering_columns="id")
+    assert db.sync_schema(specs, dry_run=True) == ["ALTER TABLE default_keyspace.fish ADD (fins int)"]
+    db.sync_schema(specs)
+    assert "fins" in db.t.fish.columns
+
+
+def test_conversation_log():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    log = db.conversation_log("test_conversation_log")
+    assert db.conversation_log("test_conversation_log") is log
+    conversation = str(uuid.uuid4())
+    log.append(conversation, "user", "hi")
+    entries, cursor = log.tail(conversation)
+    assert [entry.content for entry in entries] == ["hi"]
+
+    log.stream(conversation, "assistant", iter(["hel", "lo"]))
+    entries, cursor = log.tail(conversation, after=cursor)
+    assert "".join(entry.content for entry in entries) == "hello"
+    assert log.tail(conversation, after=cursor) == ([], cursor)
+
+    assert [(message["role"], message["content"]) for message in log.messages(conversation)] == [("user", "hi"), ("assistant", "hello")]
+
+
+def test_kv():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    kv = db.kv("test_kv", near_cache_ttl=0)
+    kv.set("a", {"user": 1}, ttl=60)
+    assert kv.get("a") == {"user": 1}
+    assert kv.get("missing") is None
+
+    kv.set_many({"b": [1, 2], "c": "x"}, ttl=60)
+    assert kv.get_many(["a", "b", "c", "missing"]) == {"a": {"user": 1}, "b": [1, 2], "c": "x"}
+
+    kv.delete("a")
+    assert "a" not in kv
+
+
+def test_warm():
+    token = os.environ["ASTRA_DB_APPLICATION_TOKEN"]
+    dbid = os.environ["DBID"]
+
+    db = AstraDatabase(token, dbid)
+
+    todos = db.t.warm_todos
+    todos.drop()
+    if not todos.exists():
+        todos.create(id=uuid.uuid4, title=str, done=bool, priority=int, pk="id")
+
+    todos = db.table("warm_todos")
+    assert todos.warm() > 0
+    prepared = dict(db.client._prepared_statements)
+
+    # inserts, raw inserts, point reads and deletes are all served by the warmed statements
+    todo = todos.insert(title="hi", done=False)
+    todos.insert_raw({"id": uuid.uuid4(), "title": "raw", "done": True, "priority": 1})
+    todos[todo.id]
+    todos.delete(todo.id)
+    assert db.client._prepared_statements == prepared
@@ -0,0 +1,96 @@
+import pytest
+from cassandra import OperationTimedOut
+from cassandra.policies import RetryPolicy
+from cassandra.query import SimpleStatement
+
+from datastore.concurrency import AdaptiveLimiter
+from datastore.latency import (POINT_READ, SCAN, LatencyPolicy, PercentileSpeculativeExecutionPolicy, make_execution_profiles,
+                               resolve_latency_policies)
+from datastore.simple_cassandra_datastore import CassandraClient
+
+
+def test_delay_is_the_cached_percentile():
+    policy = PercentileSpeculativeExecutionPolicy(percentile=90, min_samples=10, refresh_every=10, initial_delay=0.1, min_delay=0.001)
+    for i in range(9):
+        policy.record(i / 100)
+    assert policy.delay() == 0.1
+    policy.record(0.09)
+    assert policy.delay() == 0.09
+    # unchanged until the next refresh
+    for _ in range(9):
+        policy.record(1.0)
+    assert policy.delay() == 0.09
+    policy.record(1.0)
+    assert policy.delay() == 1.0
+
+
+def test_profile_retries_follow_max_retries():
+    profiles, _ = make_execution_profiles(resolve_latency_policies({SCAN: LatencyPolicy(timeout=30.0, idempotent=True, max_retries=3)}))
+    retry_policy = profiles[SCAN].retry_policy
+    assert retry_policy.on_read_timeout(None, None, 1, 0, False, 2)[0] == RetryPolicy.RETRY
+    assert retry_policy.on_read_timeout(None, None, 1, 0, False, 3)[0] == RetryPolicy.RETHROW
+    assert profiles[POINT_READ].retry_policy.on_request_error(None, None, OperationTimedOut(), 1)[0] == RetryPolicy.RETHROW
+
+    write_retry_policy = profiles["write"].retry_policy
+    assert write_retry_policy.on_write_timeout(SimpleStatement("INSERT", is_idempotent=False), None, "SIMPLE", 1, 0, 0)[0] == RetryPolicy.RETHROW
+
+
+class FakeFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        if self.error is not None:
+            errback(self.error, *errback_args)
+        else:
+            callback([], *callback_args)
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return []
+
+
+class FakeSession:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+
+    def execute(self, statement, parameters=None, execution_profile=None, paging_state=None):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        return []
+
+    def execute_async(self, statement, parameters=None, execution_profile=None):
+        return FakeFuture(self.errors.pop(0) if self.errors else None)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+
+def client(session):
+    client = CassandraClient.__new__(CassandraClient)
+    client._session = session
+    client._pid = None
+    client.latency_policies = resolve_latency_policies()
+    client._speculative_policies = {POINT_READ: Recorder()}
+    client.limiter = AdaptiveLimiter(4)
+    return client
+
+
+def test_latency_is_recorded_for_concurrent_and_failed_requests():
+    db = client(FakeSession([None, None, OperationTimedOut()]))
+    with pytest.raises(OperationTimedOut):
+        db.execute_concurrent(SimpleStatement("SELECT"), [()] * 3, operation=POINT_READ)
+    assert len(db._speculative_policies[POINT_READ].samples) == 3
+
+    db = client(FakeSession([OperationTimedOut()]))
+    with pytest.raises(OperationTimedOut):
+        db._execute_statement(POINT_READ, SimpleStatement("SELECT"))
+    db._execute_statement(POINT_READ, SimpleStatement("SELECT"))
+    assert len(db._speculative_policies[POINT_READ].samples) == 2
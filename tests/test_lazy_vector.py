@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from cassandra.cqltypes import lookup_casstype, Int32Type
+
+from datastore.lazy_vector import LazyVector, lazy_vector_type, lazy_vector_statement
+
+VECTOR3 = lookup_casstype("org.apache.cassandra.db.marshal.VectorType(org.apache.cassandra.db.marshal.FloatType, 3)")
+VALUES = [1.0, 2.5, -3.0]
+
+
+class Prepared:
+    def __init__(self, result_metadata):
+        self.result_metadata = result_metadata
+
+
+def test_lazy_vector_decodes_like_a_list():
+    vector = LazyVector(VECTOR3.serialize(VALUES, 5))
+    assert len(vector) == 3
+    assert vector == VALUES
+    assert vector[1] == 2.5
+    assert list(vector) == VALUES
+    assert vector == LazyVector(VECTOR3.serialize(VALUES, 5))
+    assert np.asarray(vector).dtype == np.float32
+    assert vector.numpy().tolist() == VALUES
+
+
+def test_float_vector_types_deserialize_lazily():
+    lazy_type = lazy_vector_type(VECTOR3)
+    assert lazy_vector_type(VECTOR3) is lazy_type
+    assert lazy_vector_type(Int32Type) is Int32Type
+    assert lazy_type.deserialize(VECTOR3.serialize(VALUES, 5), 5) == VALUES
+    assert isinstance(lazy_type.deserialize(VECTOR3.serialize(VALUES, 5), 5), LazyVector)
+    with pytest.raises(ValueError):
+        lazy_type.deserialize(b"\x00" * 8, 5)
+
+
+def test_statement_is_copied_only_with_vector_columns():
+    plain = Prepared([("ks", "dogs", "id", Int32Type)])
+    assert lazy_vector_statement(plain) is plain
+    assert lazy_vector_statement(Prepared(None)).result_metadata is None
+
+    metadata = [("ks", "dogs", "id", Int32Type), ("ks", "dogs", "embedding", VECTOR3)]
+    statement = Prepared(metadata)
+    lazy = lazy_vector_statement(statement)
+    assert lazy is not statement
+    assert statement.result_metadata == metadata
+    assert [column[3] for column in lazy.result_metadata] == [Int32Type, lazy_vector_type(VECTOR3)]
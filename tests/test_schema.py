@@ -0,0 +1,108 @@
+import pytest
+
+from fastastra import fastastra
+from fastastra.fastastra import Table
+from fastastra.schema import IndexBuild, TableSpec, plan_schema
+
+
+class StatusClient:
+    # answers get_index_status from a list of statuses, the last one repeats
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.queries = 0
+
+    def get_index_status(self, keyspace, index_name):
+        self.queries += 1
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+
+BUILDING = {"queryable": False, "building": True}
+
+
+def test_index_build_waits_until_queryable():
+    building = {"queryable": False, "building": True}
+    client = StatusClient(building, building, {"queryable": True, "building": False})
+    build = IndexBuild(client, "ks", "dogs", "name")
+    assert build.name == "dogs_name_idx"
+    assert not build.done
+    assert build.wait(timeout=5, interval=0.01)
+    assert build.done
+
+
+def test_index_build_unknown_status_is_done():
+    assert IndexBuild(StatusClient(None), "ks", "dogs", "name").done
+
+
+def test_index_build_wait_times_out():
+    build = IndexBuild(StatusClient({"queryable": False, "building": True}), "ks", "dogs", "name")
+    assert not build.wait(timeout=0.05, interval=0.01)
+
+
+def test_index_build_state_is_cached():
+    client = StatusClient(BUILDING)
+    build = IndexBuild(client, "ks", "dogs", "name", recheck_interval=60)
+    assert not build.done
+    assert not build.done
+    assert client.queries == 1
+
+    client = StatusClient({"queryable": True, "building": False})
+    build = IndexBuild(client, "ks", "dogs", "name", recheck_interval=0)
+    assert build.done and build.done
+    assert client.queries == 1
+
+
+async def test_index_build_waits_without_blocking_the_loop():
+    build = IndexBuild(StatusClient(BUILDING, BUILDING, {"queryable": True, "building": False}), "ks", "dogs", "name")
+    assert await build.wait_async(timeout=5, interval=0.01)
+    assert not await IndexBuild(StatusClient(BUILDING), "ks", "dogs", "name").wait_async(timeout=0.05, interval=0.01)
+
+
+async def test_async_query_on_a_building_index_raises(monkeypatch):
+    monkeypatch.setattr(fastastra, "INDEX_BUILD_WAIT", 0.05)
+    table = Table.__new__(Table)
+    table.table_name = "dogs"
+    table._building_indexes = {"name": IndexBuild(StatusClient(BUILDING), "ks", "dogs", "name", recheck_interval=0)}
+    await table._wait_for_indexes_async(["owner"])
+    with pytest.raises(Exception, match="dogs_name_idx on dogs.name is still building"):
+        await table._wait_for_indexes_async(["name"])
+
+
+def live_table(*columns, indexes=()):
+    # get_schema shaped table, columns are (name, kind, type, position)
+    return {
+        "columns": [{"column_name": name, "kind": kind, "type": cql_type, "position": position} for name, kind, cql_type, position in columns],
+        "indexes": set(indexes),
+    }
+
+
+BIRDS = TableSpec.define("birds", id=int, name=str, pk="id", indexes="name")
+FISH = TableSpec.define("fish", tank=str, id=int, name=str, partition_keys="tank", clustering_columns="id")
+LIVE_FISH = live_table(("tank", "partition_key", "text", 0), ("id", "clustering", "int", 0), ("name", "regular", "text", -1))
+
+
+def test_plan_creates_missing_tables_and_indexes():
+    tables, indexes = plan_schema("ks", [BIRDS], {})
+    assert tables == [BIRDS.ddl("ks", if_not_exists=True)]
+    assert indexes == ["CREATE INDEX IF NOT EXISTS birds_name_idx ON ks.birds (name)"]
+
+
+def test_plan_of_matching_schema_is_empty():
+    live = {"fish": LIVE_FISH, "birds": live_table(("id", "partition_key", "int", 0), ("name", "regular", "TEXT", -1), indexes=["birds_name_idx"])}
+    assert plan_schema("ks", [FISH], live) == ([], [])
+    assert plan_schema("ks", [BIRDS], {"birds": live_table(("id", "partition_key", "int", 0), ("name", "regular", "text", -1), indexes=["name"])}) == ([], [])
+
+
+def test_plan_adds_missing_columns():
+    spec = TableSpec.define("fish", tank=str, id=int, name=str, fins=int, weight=float, partition_keys="tank", clustering_columns="id")
+    assert plan_schema("ks", [spec], {"fish": LIVE_FISH})[0] == ["ALTER TABLE ks.fish ADD (fins int, weight double)"]
+
+
+@pytest.mark.parametrize("spec", [
+    TableSpec.define("fish", tank=str, id=int, name=int, partition_keys="tank", clustering_columns="id"),
+    TableSpec.define("fish", tank=str, id=int, name=str, partition_keys="tank"),
+    TableSpec.define("fish", tank=str, id=int, name=str, partition_keys=["tank", "id"]),
+    TableSpec.define("fish", tank=str, id=int, name=str, partition_keys="tank", clustering_columns="id", indexes="fins"),
+])
+def test_plan_rejects_changes_it_cannot_make(spec):
+    with pytest.raises(ValueError):
+        plan_schema("ks", [spec], {"fish": LIVE_FISH})
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+from datastore.singleflight import SingleFlight
+
+
+def run_together(flight, fn, callers):
+    # starts that many threads on the same key while fn is blocked, returns what each got back or raised
+    outcomes = [None] * callers
+    threads = []
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do("key", fn)
+        except Exception as e:
+            outcomes[i] = e
+    for i in range(callers):
+        threads.append(threading.Thread(target=call, args=(i,)))
+        threads[-1].start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flight, count):
+    for _ in range(1000):
+        if flight.shared >= count:
+            return
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return "rows"
+    threads, outcomes = run_together(flight, fn, 5)
+    wait_for_waiters(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert outcomes == ["rows"] * 5
+    assert flight.shared == 4
+
+    # nothing is cached once the call finished
+    assert flight.do("key", lambda: "fresh") == "fresh"
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+    error = ValueError("failed")
+
+    def fn():
+        release.wait()
+        raise error
+    threads, outcomes = run_together(flight, fn, 3)
+    wait_for_waiters(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert outcomes == [error] * 3
+
+
+async def test_async_calls_share_one_task():
+    flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "rows"
+    assert await asyncio.gather(*[flight.do_async("key", fn) for _ in range(4)]) == ["rows"] * 4
+    assert calls == [1]
+    assert flight.shared == 3
+
+
+async def test_async_error_reaches_every_waiter():
+    flight = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+    outcomes = await asyncio.gather(*[flight.do_async("key", fn) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
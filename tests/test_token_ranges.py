@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+from datastore.simple_cassandra_datastore import split_token_ranges, MIN_TOKEN, MAX_TOKEN
+
+
+def assert_covers_ring(ranges):
+    # (start, end] ranges, each starting where the previous one ended, from the minimum to the maximum token
+    assert ranges[0][0] == MIN_TOKEN
+    assert ranges[-1][1] == MAX_TOKEN
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == end
+    assert all(start < end for start, end in ranges)
+
+
+@pytest.mark.parametrize("ring", [[], [0], [-100, 5, 2 ** 62], [random.Random(i).randint(MIN_TOKEN, MAX_TOKEN) for i in range(48)]])
+@pytest.mark.parametrize("splits", [1, 3, 16, 257])
+def test_ranges_cover_the_whole_ring(ring, splits):
+    ranges = split_token_ranges(ring, splits)
+    assert_covers_ring(ranges)
+    assert len(ranges) >= splits
+    # node tokens stay range boundaries so no range spans two replicas
+    boundaries = {end for _, end in ranges}
+    assert all(token in boundaries for token in ring)
+
+
+def test_string_tokens_and_duplicates():
+    assert split_token_ranges(["10", 10, "-3"], 1) == [(MIN_TOKEN, -3), (-3, 10), (10, MAX_TOKEN)]
+
+
+def test_ranges_too_small_to_split_are_kept():
+    ranges = split_token_ranges([MIN_TOKEN + 1], 4)
+    assert_covers_ring(ranges)
+    assert (MIN_TOKEN, MIN_TOKEN + 1) in ranges
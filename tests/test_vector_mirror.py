@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import uuid
+
+from fastastra.vector_mirror import VectorMirror
+
+
+class ScanClient:
+    def __init__(self, rows, gate=None):
+        self.rows = rows
+        self.gate = gate
+
+    def scan_table(self, **kwargs):
+        if self.gate is not None:
+            self.gate.wait()
+        yield from self.rows
+
+
+class FakeTable:
+    table_name = "docs"
+    keyspace = "ks"
+    partition_keys = ["id"]
+    clustering_columns = ["ts"]
+    raw_columns = [{"column_name": "id", "type": "uuid"}, {"column_name": "ts", "type": "int"}, {"column_name": "v", "type": "vector<float, 2>"}]
+
+    def __init__(self, client):
+        self.db = type("DB", (), {"client": client})()
+
+
+def rows(n):
+    return [{"id": uuid.uuid4(), "ts": i, "v": [1.0, float(i)]} for i in range(n)]
+
+
+def test_writes_during_load_are_applied():
+    gate = threading.Event()
+    scanned = rows(5)
+    mirror = VectorMirror(FakeTable(ScanClient(scanned, gate)), "v")
+    thread = mirror.load_in_background()
+    added = {"id": uuid.uuid4(), "ts": 9, "v": [0.0, 1.0]}
+    mirror.upsert(added)
+    mirror.remove({"id": scanned[0]["id"]})
+    gate.set()
+    thread.join()
+    assert mirror.ready
+    assert len(mirror) == 5
+    assert mirror.search([0.0, 1.0], k=1)[0][0] == (added["id"], 9)
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot = str(tmp_path / "mirror")
+    mirror = VectorMirror(FakeTable(ScanClient(rows(3))), "v", snapshot=snapshot).load()
+    assert sorted(os.listdir(snapshot)) == ["keys.ndjson", "meta.json", "vectors.npy"]
+    mirror.upsert({"id": uuid.uuid4(), "ts": 7, "v": [0.5, 0.5]})
+    mirror.close()
+
+    # loaded from the snapshot, the scan would only return one row
+    reloaded = VectorMirror(FakeTable(ScanClient(rows(1))), "v", snapshot=snapshot).load()
+    assert set(reloaded._keys) == set(mirror._keys)
+    assert isinstance(reloaded._keys[0][0], uuid.UUID)
+
+
+def test_stale_or_foreign_snapshot_is_rescanned(tmp_path):
+    snapshot = str(tmp_path / "mirror")
+    VectorMirror(FakeTable(ScanClient(rows(3))), "v", snapshot=snapshot).load()
+    assert len(VectorMirror(FakeTable(ScanClient(rows(1))), "v", snapshot=snapshot, snapshot_max_age=0).load()) == 1
+    VectorMirror(FakeTable(ScanClient(rows(3))), "v", snapshot=snapshot).load()
+    assert len(VectorMirror(FakeTable(ScanClient(rows(1))), "v", metric="euclidean", snapshot=snapshot).load()) == 1
+    with open(os.path.join(snapshot, "meta.json")) as f:
+        assert json.load(f)["metric"] == "euclidean"
+
+
+def test_failed_background_load_is_kept():
+    class FailingClient:
+        def scan_table(self, **kwargs):
+            raise RuntimeError("scan failed")
+
+    mirror = VectorMirror(FakeTable(FailingClient()), "v")
+    mirror.load_in_background().join()
+    assert not mirror.ready
+    assert str(mirror.error) == "scan failed"
@@ -0,0 +1,57 @@
+import pytest
+from cassandra import DriverException
+
+from datastore import simple_cassandra_datastore
+from datastore.simple_cassandra_datastore import connect_waking_up, WAKE_UP_MAX_BACKOFF
+
+
+class FakeTime:
+    # a clock that only moves when something sleeps
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(simple_cassandra_datastore, "time", clock)
+    monkeypatch.setattr(simple_cassandra_datastore, "make_keyspace", lambda dbid, token: None)
+    return clock
+
+
+def hibernated_for(clock, seconds):
+    def connect():
+        if clock.now < seconds:
+            raise DriverException("Unable to connect to the metadata service")
+        return "cluster"
+    return connect
+
+
+def test_waits_minutes_for_the_database_to_resume(clock):
+    assert connect_waking_up("db", "token", hibernated_for(clock, 150)) == "cluster"
+    assert 150 <= clock.now < 150 + WAKE_UP_MAX_BACKOFF
+    # exponential backoff capped at the maximum
+    assert clock.sleeps[1] >= clock.sleeps[0]
+    assert max(clock.sleeps) <= WAKE_UP_MAX_BACKOFF
+
+
+def test_gives_up_at_the_deadline(clock):
+    with pytest.raises(Exception, match="did not wake up within 60s"):
+        connect_waking_up("db", "token", hibernated_for(clock, 1000), timeout=60)
+    assert clock.now == 60
+
+
+def test_other_errors_are_not_retried(clock):
+    def connect():
+        raise ValueError("bad bundle")
+    with pytest.raises(ValueError):
+        connect_waking_up("db", "token", connect)
+    assert clock.sleeps == []
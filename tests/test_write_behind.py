@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+from fastastra.write_behind import WriteBehindBuffer
+
+
+class InsertClient:
+    def __init__(self):
+        self.inserted = []
+
+    def insert_many_into_table(self, keyspace, table, columns, values, concurrency=None):
+        self.inserted.extend(values)
+
+
+class AnnCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, table):
+        self.invalidated.append(table)
+
+
+class FakeTable:
+    table_name = "todos"
+    keyspace = "ks"
+    partition_keys = ["id"]
+    clustering_columns = []
+    columns = ["id", "title"]
+
+    def __init__(self):
+        self.db = type("DB", (), {"client": InsertClient(), "ann_cache": AnnCache()})()
+
+
+@pytest.fixture
+def buffer():
+    buffer = WriteBehindBuffer(FakeTable(), interval=60)
+    yield buffer
+    buffer.close()
+
+
+def test_ann_cache_is_invalidated_after_the_flush(buffer):
+    buffer.put({"id": 1, "title": "a"})
+    buffer.put({"id": 1, "title": "b"})
+    assert buffer.table.db.ann_cache.invalidated == []
+    buffer.flush()
+    assert buffer.table.db.client.inserted == [[1, "b"]]
+    assert buffer.table.db.ann_cache.invalidated == ["todos"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_starts_with_an_empty_buffer(buffer):
+    buffer.put({"id": 1, "title": "a"})
+    buffer._lock.acquire()
+    pid = os.fork()
+    if pid == 0:
+        # the lock held by the parent and its pending rows are not inherited
+        code = 1
+        try:
+            with buffer._lock:
+                pass
+            buffer.put({"id": 2, "title": "b"})
+            buffer.flush()
+            if buffer.table.db.client.inserted == [[2, "b"]] and buffer._thread.is_alive():
+                code = 0
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    buffer._lock.release()
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert len(buffer) == 1